@@ -38,3 +38,16 @@ class MockDropOp(operations.Operation):
 
     def __call__(self, story_data):
         return story_data.iloc[self.from_idx: self.to_idx, :], {}
+
+
+class FakeAddColumns(operations.AddColumns):
+    """
+    just returning hard-coded columns to be joined to the story data
+    """
+
+    def __init__(self, output, join_kind="left"):
+        operations.AddColumns.__init__(self, join_kind=join_kind)
+        self.output = output
+
+    def build_output(self, story_data):
+        return self.output
@@ -0,0 +1,69 @@
+import logging
+import time
+
+import numpy as np
+
+from trumania.core.relationship import Relationship, CsrRelationship
+from trumania.core.util_functions import setup_logging, build_ids
+
+# measures how many edges per second can be loaded in a relationship, with
+# add_relations() and with the bulk from_edges() constructor
+#
+# python tests/scenarios/long_relationship_loading.py
+
+
+def measure(description, build, n_edges):
+    start = time.time()
+    relationship = build()
+    relationship.get_neighbourhood_size(["id_0"])
+    duration = time.time() - start
+
+    logging.info("{}: {:.1f}s, {:,.0f} edges/second".format(
+        description, duration, n_edges / duration))
+
+
+if __name__ == "__main__":
+    setup_logging()
+
+    n_froms = 200000
+    average_degree = 25
+    n_edges = n_froms * average_degree
+
+    state = np.random.RandomState(1234)
+    from_ids = np.array(build_ids(n_froms, prefix="id_"), dtype=object)[
+        state.randint(n_froms, size=n_edges)]
+    to_ids = state.randint(n_froms, size=n_edges)
+    weights = state.uniform(size=n_edges)
+
+    logging.info("loading {:,} edges from {:,} froms".format(n_edges, n_froms))
+
+    def added(relationship_class):
+        def _build():
+            relationship = relationship_class(seed=1)
+            relationship.add_relations(from_ids, to_ids, weights)
+            return relationship
+        return _build
+
+    def bulk(relationship_class):
+        def _build():
+            return relationship_class.from_edges(1, from_ids, to_ids, weights)
+        return _build
+
+    measure("grouped, add_relations", added(Relationship), n_edges)
+    measure("grouped, from_edges", bulk(Relationship), n_edges)
+    measure("csr, add_relations", added(CsrRelationship), n_edges)
+    measure("csr, from_edges", bulk(CsrRelationship), n_edges)
+
+    """
+    result on a laptop, 5M edges from 200k froms:
+
+     before from_edges():
+     - grouped, add_relations: 19.3s, 258,692 edges/second
+     - csr, add_relations: 15.5s, 321,663 edges/second
+
+     after:
+     - grouped, add_relations: 13.2s, 380,031 edges/second
+     - grouped, from_edges: 4.4s, 1,148,206 edges/second
+     - csr, add_relations: 3.2s, 1,582,652 edges/second
+     - csr, from_edges: 3.0s, 1,652,685 edges/second
+    """
@@ -1,9 +1,13 @@
 from __future__ import division
+import os
+import path
 import pytest
 import pandas as pd
 
-from trumania.core.random_generators import SequencialGenerator
+from trumania.core.random_generators import SequencialGenerator, ConstantGenerator
 from trumania.core.circus import Circus
+from trumania.core.log_sinks import CsvSink, LogSink
+from trumania.core.operations import FieldLogger
 from trumania.components.time_patterns.profilers import DefaultDailyTimerGenerator
 
 
@@ -71,3 +75,212 @@ def test_adding_a_second_story_with_same_name_should_be_refused():
         flying.create_story(name="the_story",
                             initiating_population=customers,
                             member_id_field="population_id")
+
+
+def build_sparse_circus(scheduler, with_reverse_lookup=False):
+
+    circus = Circus(name="tested_circus",
+                    master_seed=1,
+                    start=pd.Timestamp("8 June 2016"),
+                    step_duration=pd.Timedelta("15min"))
+
+    customers = circus.create_population(
+        "the_customers", size=20,
+        ids_gen=SequencialGenerator(prefix="a"))
+
+    timer_gen = DefaultDailyTimerGenerator(circus.clock, seed=1)
+
+    # about one execution per customer per week
+    story = circus.create_story(
+        name="restock",
+        initiating_population=customers,
+        member_id_field="A_ID",
+        timer_gen=timer_gen,
+        activity_gen=ConstantGenerator(value=1. / 7),
+        scheduler=scheduler)
+
+    operations = [circus.clock.ops.timestamp(named_as="TIME")]
+
+    if with_reverse_lookup:
+        suppliers = customers.create_relationship("SUPPLIERS", seed=1)
+        suppliers.add_relations(from_ids=customers.ids[::-1],
+                                to_ids=customers.ids)
+        operations.append(suppliers.ops.select_one_reverse(
+            to_field="A_ID", named_as="SUPPLIED"))
+
+    operations.append(FieldLogger(log_id="restocks"))
+    story.set_operations(*operations)
+
+    return circus
+
+
+def test_skipping_idle_steps_should_produce_identical_logs():
+
+    with path.tempdir() as log_parent_folder:
+
+        def run(scheduler, skip_idle_steps):
+            log_folder = os.path.join(
+                log_parent_folder, "{}_{}".format(scheduler, skip_idle_steps))
+
+            circus = build_sparse_circus(scheduler)
+            circus.run(duration=pd.Timedelta("10 days"),
+                       log_output_folder=log_folder,
+                       skip_idle_steps=skip_idle_steps)
+
+            # the clock should end up at the same date in any case
+            assert circus.clock.current_date == pd.Timestamp("18 June 2016")
+
+            with open(os.path.join(log_folder, "restocks.csv")) as f:
+                return f.read()
+
+        step_by_step = run("countdown", False)
+        assert len(step_by_step.splitlines()) > 10
+
+        assert run("countdown", True) == step_by_step
+        assert run("calendar", True) == step_by_step
+
+
+def test_run_with_a_log_sink_should_produce_the_same_logs_as_with_a_folder():
+
+    with path.tempdir() as log_parent_folder:
+        folder_logs = os.path.join(log_parent_folder, "folder")
+        sink_logs = os.path.join(log_parent_folder, "sink")
+
+        build_sparse_circus("countdown").run(
+            duration=pd.Timedelta("2 days"), log_output_folder=folder_logs)
+
+        build_sparse_circus("countdown").run(
+            duration=pd.Timedelta("2 days"), log_sink=CsvSink(sink_logs))
+
+        for file_name in os.listdir(folder_logs):
+            with open(os.path.join(folder_logs, file_name)) as f1, \
+                    open(os.path.join(sink_logs, file_name)) as f2:
+                assert f1.read() == f2.read()
+
+
+def test_run_should_require_exactly_one_log_destination():
+
+    circus = build_sparse_circus("countdown")
+
+    with pytest.raises(ValueError):
+        circus.run(duration=pd.Timedelta("1 day"))
+
+    with pytest.raises(ValueError):
+        circus.run(duration=pd.Timedelta("1 day"), log_output_folder="logs",
+                   log_sink=CsvSink("logs"))
+
+
+def test_run_iter_should_yield_the_logs_written_by_run():
+
+    with path.tempdir() as log_parent_folder:
+        log_folder = os.path.join(log_parent_folder, "logs")
+        build_sparse_circus("countdown").run(
+            duration=pd.Timedelta("2 days"), log_output_folder=log_folder)
+        written = pd.read_csv(os.path.join(log_folder, "restocks.csv"))
+
+    circus = build_sparse_circus("countdown")
+    steps = list(circus.run_iter(duration=pd.Timedelta("2 days")))
+
+    assert [step for step, _, _ in steps] == list(range(2 * 24 * 4))
+    assert steps[1][1] == pd.Timestamp("8 June 2016 00:15:00")
+    assert circus.clock.current_date == pd.Timestamp("10 June 2016")
+
+    yielded = pd.concat([logs["restocks"] for _, _, logs in steps
+                         if "restocks" in logs],
+                        ignore_index=True)
+    assert yielded["A_ID"].tolist() == written["A_ID"].tolist()
+    assert yielded["TIME"].tolist() == written["TIME"].tolist()
+
+
+def test_run_iter_should_not_yield_skipped_steps():
+
+    circus = build_sparse_circus("calendar")
+    steps = list(circus.run_iter(duration=pd.Timedelta("2 days"),
+                                 skip_idle_steps=True))
+
+    assert len(steps) < 2 * 24 * 4
+    assert all(len(logs) > 0 for _, _, logs in steps)
+    assert circus.clock.current_date == pd.Timestamp("10 June 2016")
+
+
+@pytest.mark.parametrize("scheduler,skip_idle_steps,with_reverse_lookup", [
+    ("countdown", False, False), ("calendar", False, False),
+    ("calendar", True, False), ("countdown", False, True)])
+def test_resuming_from_a_checkpoint_should_continue_exactly_like_the_interrupted_run(
+        scheduler, skip_idle_steps, with_reverse_lookup):
+
+    with path.tempdir() as root:
+        reference_logs = os.path.join(root, "reference")
+        reference = build_sparse_circus(scheduler, with_reverse_lookup)
+        reference.run(
+            duration=pd.Timedelta("3 days"), log_output_folder=reference_logs,
+            skip_idle_steps=skip_idle_steps)
+
+        logs = os.path.join(root, "logs")
+        checkpoint_file = os.path.join(root, "checkpoint.pickle")
+        interrupted = build_sparse_circus(scheduler, with_reverse_lookup)
+
+        # crashing the run after a bit more than 2 days
+        original_increment = interrupted.clock.increment
+
+        def crashing_increment(n_steps=1):
+            if interrupted.clock.current_date > pd.Timestamp("10 June 2016 03:00"):
+                raise RuntimeError("simulated crash")
+            original_increment(n_steps)
+
+        interrupted.clock.increment = crashing_increment
+
+        with pytest.raises(RuntimeError):
+            interrupted.run(duration=pd.Timedelta("3 days"),
+                            log_output_folder=logs,
+                            skip_idle_steps=skip_idle_steps,
+                            checkpoint_file=checkpoint_file,
+                            checkpoint_every=24 * 4)
+
+        resumed = build_sparse_circus(scheduler, with_reverse_lookup)
+        resumed.resume(checkpoint_file)
+
+        assert resumed.clock.current_date == reference.clock.current_date
+        with open(os.path.join(reference_logs, "restocks.csv")) as f1, \
+                open(os.path.join(logs, "restocks.csv")) as f2:
+            assert f1.read() == f2.read()
+
+
+def test_resuming_a_circus_built_differently_should_be_refused():
+
+    with path.tempdir() as root:
+        checkpoint_file = os.path.join(root, "checkpoint.pickle")
+        build_sparse_circus("countdown").run(
+            duration=pd.Timedelta("1 day"),
+            log_output_folder=os.path.join(root, "logs"),
+            checkpoint_file=checkpoint_file, checkpoint_every=10)
+
+        other = build_sparse_circus("countdown")
+        other.create_population("others", size=10,
+                                ids_gen=SequencialGenerator(prefix="o"))
+
+        with pytest.raises(ValueError):
+            other.resume(checkpoint_file)
+
+
+def test_run_with_a_sink_without_checkpoints_should_be_refused_before_any_step():
+
+    class RecordingSink(LogSink):
+        def __init__(self):
+            self.written = []
+
+        def write(self, log_id, logs):
+            self.written.append(log_id)
+
+    sink = RecordingSink()
+    circus = build_sparse_circus("countdown")
+
+    with path.tempdir() as root:
+        with pytest.raises(ValueError):
+            circus.run(duration=pd.Timedelta("2 days"), log_sink=sink,
+                       checkpoint_file=os.path.join(root, "checkpoint.pickle"),
+                       checkpoint_every=10)
+
+    assert sink.written == []
+    assert circus.clock.current_date == pd.Timestamp("8 June 2016")
+    assert CsvSink("logs").supports_checkpoints()
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 
 from trumania.core.clock import CyclicTimerProfile, CyclicTimerGenerator
@@ -57,6 +58,26 @@ def test_DefaultDailyTimerGenerator_should_be_initialized_correctly():
     assert daily.profile.index[0] == pd.Timestamp("12 Sept 2016")
 
 
+def test_incrementing_n_steps_should_be_identical_to_n_increments():
+
+    clocks = [Clock(start=pd.Timestamp("12 Sept 2016"),
+                    step_duration=pd.Timedelta("15 min"),
+                    seed=1234)
+              for _ in range(2)]
+
+    stepped, jumped = [DefaultDailyTimerGenerator(clock=clock, seed=1234)
+                       for clock in clocks]
+
+    for _ in range(150):
+        clocks[0].increment()
+    clocks[1].increment(150)
+
+    assert clocks[0].current_date == clocks[1].current_date
+    assert stepped.profile.index.equals(jumped.profile.index)
+    assert np.array_equal(stepped.profile["cdf"].values,
+                          jumped.profile["cdf"].values)
+
+
 def test_cyclic_timer_profile_should_compute_duration_correct():
 
     tested = CyclicTimerProfile(
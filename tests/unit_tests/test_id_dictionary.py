@@ -0,0 +1,63 @@
+import numpy as np
+
+from trumania.core.id_dictionary import IdDictionary
+
+
+def test_ids_should_get_the_codes_of_their_first_appearance():
+
+    dictionary = IdDictionary(["b", "a", "b", "c"])
+
+    assert len(dictionary) == 3
+    assert dictionary.ids.tolist() == ["b", "a", "c"]
+    assert dictionary.encode(["c", "b", "c"]).tolist() == [2, 0, 2]
+    assert dictionary.encode(["a"]).dtype == np.int32
+
+
+def test_unknown_ids_should_be_encoded_as_minus_one_unless_added():
+
+    dictionary = IdDictionary(["a", "b"])
+
+    assert dictionary.encode(["b", "z"]).tolist() == [1, -1]
+    assert len(dictionary) == 2
+
+    assert dictionary.encode(["b", "z", "y", "z"], add=True).tolist() == [1, 2, 3, 2]
+    assert dictionary.ids.tolist() == ["a", "b", "z", "y"]
+
+
+def test_decoding_should_return_the_encoded_ids():
+
+    dictionary = IdDictionary()
+    ids = np.array(["x%d" % i for i in np.random.RandomState(1).randint(50, size=200)],
+                   dtype=object)
+
+    assert dictionary.decode(dictionary.encode(ids, add=True)).tolist() == ids.tolist()
+
+
+def test_numerical_ids_should_keep_their_type():
+
+    dictionary = IdDictionary()
+    dictionary.add(np.array([10, 30, 20]))
+
+    assert dictionary.decode(np.array([2, 0])).tolist() == [20, 10]
+    assert dictionary.ids.dtype.kind == "i"
+
+
+def test_ids_added_in_many_batches_should_keep_their_codes():
+
+    dictionary = IdDictionary()
+    ids = ["x%d" % i for i in range(1000)]
+    for lower in range(0, 1000, 7):
+        dictionary.add(ids[lower:lower + 7] + ids[:3])
+
+    assert dictionary.ids.tolist() == ids
+    assert dictionary.encode(ids[::-1]).tolist() == list(range(999, -1, -1))
+    assert dictionary.encode(["x1000"]).tolist() == [-1]
+
+
+def test_ids_of_another_type_added_later_should_be_stored_as_objects():
+
+    dictionary = IdDictionary(np.array([10, 30]))
+    dictionary.add(np.array(["a", 10], dtype=object))
+
+    assert dictionary.ids.tolist() == [10, 30, "a"]
+    assert dictionary.encode(np.array(["a", 30], dtype=object)).tolist() == [2, 1]
@@ -0,0 +1,105 @@
+import os
+import path
+import pytest
+import pandas as pd
+
+from trumania.core.log_sinks import CsvSink, ParquetSink, NULL_DAY_PARTITION
+from trumania.core.util_functions import load_all_logs
+
+
+def calls(ids, times, durations):
+    return pd.DataFrame({"A": ids, "TIME": times, "DURATION": durations},
+                        columns=["A", "TIME", "DURATION"])
+
+
+def test_csv_sink_should_append_logs_with_a_single_header():
+
+    with path.tempdir() as root:
+        sink = CsvSink(os.path.join(root, "logs"))
+        sink.write("calls", calls(["a1"], ["2016-06-08 10:00:00"], [10]))
+        sink.write("calls", calls(["a2"], ["2016-06-08 11:00:00"], [20]))
+        sink.close()
+
+        with open(os.path.join(root, "logs", "calls.csv")) as f:
+            assert f.read().splitlines() == [
+                "A,TIME,DURATION",
+                "a1,2016-06-08 10:00:00,10",
+                "a2,2016-06-08 11:00:00,20"]
+
+
+def test_parquet_sink_should_write_one_file_per_log_id():
+    pytest.importorskip("pyarrow")
+
+    with path.tempdir() as root:
+        folder = os.path.join(root, "logs")
+        sink = ParquetSink(folder)
+        sink.write("calls", calls(["a1", "a2"], ["2016-06-08 10:00:00"] * 2,
+                                  [10, 20]))
+        sink.write("sms", pd.DataFrame({"A": ["a3"]}))
+
+        # columns in another order should be written according to the schema
+        sink.write("calls", calls(["a4"], ["2016-06-09 10:00:00"], [30])
+                   [["DURATION", "A", "TIME"]])
+        sink.close()
+
+        assert sorted(os.listdir(folder)) == ["calls.parquet", "sms.parquet"]
+
+        all_logs = load_all_logs(folder)
+        assert all_logs["calls"]["A"].tolist() == ["a1", "a2", "a4"]
+        assert all_logs["calls"]["DURATION"].tolist() == [10, 20, 30]
+        assert all_logs["sms"]["A"].tolist() == ["a3"]
+
+
+def test_parquet_sink_should_partition_logs_by_day():
+    pyarrow = pytest.importorskip("pyarrow")
+
+    with path.tempdir() as root:
+        folder = os.path.join(root, "logs")
+        schema = pyarrow.schema([pyarrow.field("A", pyarrow.string()),
+                                 pyarrow.field("TIME", pyarrow.string()),
+                                 pyarrow.field("DURATION", pyarrow.int32())])
+
+        sink = ParquetSink(folder, schemas={"calls": schema}, day_field="TIME")
+        sink.write("calls", calls(["a1", "a2"],
+                                  ["2016-06-08 23:00:00", "2016-06-09 01:00:00"],
+                                  [10, 20]))
+        sink.write("calls", calls(["a3"], ["2016-06-09 02:00:00"], [30]))
+        # late logs of a day that has been closed end up in a new part file
+        sink.write("calls", calls(["a4"], ["2016-06-08 23:30:00"], [40]))
+        sink.close()
+
+        assert sorted(os.listdir(os.path.join(folder, "calls"))) == \
+            ["day=2016-06-08", "day=2016-06-09"]
+        assert sorted(os.listdir(os.path.join(folder, "calls", "day=2016-06-08"))) == \
+            ["part-0.parquet", "part-1.parquet"]
+
+        logs = load_all_logs(folder)["calls"].sort_values("A")
+        assert logs["A"].tolist() == ["a1", "a2", "a3", "a4"]
+        assert logs["DURATION"].dtype == "int32"
+        assert logs["day"].astype(str).tolist() == \
+            ["2016-06-08", "2016-06-09", "2016-06-09", "2016-06-08"]
+
+
+def test_parquet_sink_should_keep_logs_without_day_in_their_own_partition():
+    pytest.importorskip("pyarrow")
+
+    with path.tempdir() as root:
+        folder = os.path.join(root, "logs")
+        sink = ParquetSink(folder, day_field="TIME")
+        sink.write("calls", calls(["a1", "a2", "a3"],
+                                  ["2016-06-08 10:00:00", None, "NaT"],
+                                  [10, 20, 30]))
+        sink.close()
+
+        assert sorted(os.listdir(os.path.join(folder, "calls"))) == \
+            ["day=2016-06-08", "day={}".format(NULL_DAY_PARTITION)]
+
+        logs = load_all_logs(folder)["calls"]
+        assert sorted(logs["A"].tolist()) == ["a1", "a2", "a3"]
+
+
+def test_parquet_sink_should_not_support_checkpoints():
+    pytest.importorskip("pyarrow")
+
+    with path.tempdir() as root:
+        assert not ParquetSink(os.path.join(root, "logs")).supports_checkpoints()
@@ -0,0 +1,101 @@
+import os
+import path
+import pytest
+import pandas as pd
+
+from trumania.core.circus import Circus
+from trumania.core.log_sinks import CsvSink
+from trumania.core.log_writer import BufferedLogWriter
+
+
+def log_fragments():
+    return [
+        ("calls", pd.DataFrame({"A": ["a1", "a2"], "DURATION": [10, 20]},
+                               columns=["A", "DURATION"])),
+        ("sms", pd.DataFrame({"A": ["a3"]})),
+        ("calls", pd.DataFrame({"A": ["a3"], "DURATION": [30]},
+                               columns=["A", "DURATION"])),
+        # different dtype: must not turn the previous durations into floats
+        ("calls", pd.DataFrame({"A": ["a4"], "DURATION": [1.5]},
+                               columns=["A", "DURATION"])),
+        ("calls", pd.DataFrame(columns=["A", "DURATION"])),
+        ("sms", pd.DataFrame({"A": ["a5", "a6"]})),
+    ]
+
+
+def read_all(folder):
+    contents = {}
+    for file_name in os.listdir(folder):
+        with open(os.path.join(folder, file_name)) as f:
+            contents[file_name] = f.read()
+    return contents
+
+
+@pytest.mark.parametrize("max_buffered_rows", [1, 2, 1000])
+def test_buffered_logs_should_be_identical_to_direct_appends(max_buffered_rows):
+
+    with path.tempdir() as root:
+        direct_folder = os.path.join(root, "direct")
+        buffered_folder = os.path.join(root, "buffered")
+
+        for log_id, logs in log_fragments():
+            Circus.save_logs(log_id, logs, direct_folder)
+
+        with BufferedLogWriter(CsvSink(buffered_folder),
+                               max_buffered_rows=max_buffered_rows,
+                               max_pending_batches=1) as writer:
+            for log_id, logs in log_fragments():
+                writer.write(log_id, logs)
+
+        assert read_all(buffered_folder) == read_all(direct_folder)
+
+
+def test_closing_writer_should_flush_logs_when_an_exception_is_raised():
+
+    with path.tempdir() as root:
+        folder = os.path.join(root, "logs")
+
+        with pytest.raises(RuntimeError):
+            with BufferedLogWriter(CsvSink(folder)) as writer:
+                writer.write("calls", pd.DataFrame({"A": ["a1", "a2"]}))
+                raise RuntimeError("simulation failure")
+
+        written = pd.read_csv(os.path.join(folder, "calls.csv"))
+        assert written["A"].tolist() == ["a1", "a2"]
+
+
+def test_writing_to_a_closed_writer_should_be_refused():
+
+    with path.tempdir() as root:
+        writer = BufferedLogWriter(CsvSink(os.path.join(root, "logs")))
+        writer.close()
+
+        # closing twice is harmless
+        writer.close()
+
+        with pytest.raises(ValueError):
+            writer.write("calls", pd.DataFrame({"A": ["a1"]}))
+
+
+def test_background_write_failure_should_be_raised_on_close():
+
+    with path.tempdir() as root:
+        # a file where the output folder is expected makes all writes fail
+        blocking_file = os.path.join(root, "logs")
+        with open(blocking_file, "w") as f:
+            f.write("not a folder")
+
+        writer = BufferedLogWriter(CsvSink(blocking_file))
+        writer.write("calls", pd.DataFrame({"A": ["a1"]}))
+
+        with pytest.raises(IOError):
+            writer.close()
+
+
+def test_invalid_buffering_thresholds_should_be_refused():
+
+    with pytest.raises(ValueError):
+        BufferedLogWriter(CsvSink("some_folder"), max_buffered_rows=0)
+
+    with pytest.raises(ValueError):
+        BufferedLogWriter(CsvSink("some_folder"), max_pending_batches=0)
@@ -81,10 +81,9 @@ def test_one_execution_should_merge_empty_data_correctly():
 
     # empty previous
     prev_df = pd.DataFrame(columns=[])
-    prev_log = {}
     nop = operations.Operation()
 
-    output, logs = operations.Chain._execute_operation((prev_df, prev_log), nop)
+    output, logs = operations.Chain(nop)(prev_df)
 
     assert logs == {}
     assert output.equals(prev_df)
@@ -93,13 +92,13 @@ def test_one_execution_should_merge_empty_data_correctly():
 def test_one_execution_should_merge_one_op_with_nothing_into_one_result():
 
     # empty previous
-    prev = pd.DataFrame(columns=[]), {}
+    prev = pd.DataFrame(columns=[])
 
     cdrs = pd.DataFrame(np.random.rand(12, 3), columns=["A", "B", "duration"])
     input = pd.DataFrame(np.random.rand(10, 2), columns=["C", "D"])
     op = mockops.FakeOp(input, logs={"cdrs": cdrs})
 
-    output, logs = operations.Chain._execute_operation(prev, op)
+    output, logs = operations.Chain(op)(prev)
 
     assert logs == {"cdrs": cdrs}
     assert input.equals(output)
@@ -116,8 +115,12 @@ def test_one_execution_should_merge_2_ops_correctly():
     input = pd.DataFrame(np.random.rand(10, 2), columns=["C", "D"])
     op = mockops.FakeOp(input, {"cdrs": cdrs})
 
-    output, logs = operations.Chain._execute_operation(
-        (init, {"mobility": mobility_logs}), op)
+    previous_logs = operations.LogAccumulator()
+    previous_logs.add({"mobility": mobility_logs})
+
+    output, supp_logs = op(init)
+    previous_logs.add(supp_logs)
+    logs = previous_logs.result()
 
     assert logs == {"cdrs": cdrs, "mobility": mobility_logs}
     assert input.equals(output)
@@ -145,6 +148,74 @@ def test_chain_of_3_operation_should_return_merged_logs():
     assert all_logs["cdrs3"].equals(cdrs3)
 
 
+def test_chain_should_concatenate_logs_with_same_id_in_order():
+
+    story_data = pd.DataFrame({"A": [1, 2]})
+    op1 = mockops.FakeOp(story_data, {"cdrs": pd.DataFrame({"X": [1, 2]})})
+    op2 = mockops.FakeOp(story_data, {})
+    op3 = mockops.FakeOp(story_data, {"cdrs": pd.DataFrame({"X": [3]}),
+                                      "other": pd.DataFrame({"Y": [4]})})
+    op4 = mockops.FakeOp(story_data, {"cdrs": pd.DataFrame({"X": [5, 6]})})
+
+    _, all_logs = operations.Chain(op1, op2, op3, op4)(story_data)
+
+    assert set(all_logs.keys()) == {"cdrs", "other"}
+    assert all_logs["cdrs"]["X"].tolist() == [1, 2, 3, 5, 6]
+    assert all_logs["cdrs"].index.tolist() == [0, 1, 2, 3, 4]
+    assert all_logs["other"]["Y"].tolist() == [4]
+
+
+def test_add_columns_with_aligned_index_should_not_modify_input():
+
+    story_data = pd.DataFrame({"A": [1, 2, 3]}, index=["a", "b", "c"])
+    new_cols = pd.DataFrame({"B": [4, 5, 6], "C": ["x", "y", "z"]},
+                            index=["a", "b", "c"])
+
+    output = mockops.FakeAddColumns(new_cols).transform(story_data)
+
+    assert output.columns.tolist() == ["A", "B", "C"]
+    assert output["B"].tolist() == [4, 5, 6]
+    assert output["C"].tolist() == ["x", "y", "z"]
+
+    # the previous story_data might be referenced elsewhere (e.g. in logs)
+    assert story_data.columns.tolist() == ["A"]
+
+
+def test_add_columns_left_join_should_insert_nan_for_missing_rows():
+
+    story_data = pd.DataFrame({"A": [1, 2, 3]}, index=["a", "b", "c"])
+    new_cols = pd.DataFrame({"B": [6., 4.]}, index=["c", "a"])
+
+    output = mockops.FakeAddColumns(new_cols).transform(story_data)
+
+    assert output.index.tolist() == ["a", "b", "c"]
+    assert output["B"].fillna(-1).tolist() == [4, -1, 6]
+
+
+def test_add_columns_inner_join_should_keep_order_of_input_rows():
+
+    story_data = pd.DataFrame({"A": [1, 2, 3, 4]}, index=["d", "b", "c", "a"])
+    new_cols = pd.DataFrame({"B": [10, 40, 20]}, index=["a", "d", "b"])
+
+    output = mockops.FakeAddColumns(new_cols, join_kind="inner").transform(
+        story_data)
+
+    assert output.index.tolist() == ["d", "b", "a"]
+    assert output["A"].tolist() == [1, 2, 4]
+    assert output["B"].tolist() == [40, 20, 10]
+
+
+def test_add_columns_with_duplicate_index_should_still_be_merged():
+
+    story_data = pd.DataFrame({"A": [1, 2, 3]}, index=["a", "a", "c"])
+    new_cols = pd.DataFrame({"B": [4, 5]}, index=["a", "c"])
+
+    output = mockops.FakeAddColumns(new_cols).transform(story_data)
+
+    assert output.index.tolist() == ["a", "a", "c"]
+    assert output["B"].tolist() == [4, 4, 5]
+
+
 def test_drop_when_condition_is_all_false_should_have_no_impact():
 
     cdrs = pd.DataFrame(np.random.rand(12, 3), columns=["A", "B", "duration"])
@@ -280,3 +351,32 @@ def test_bounded_generator_should_limnit_with_both_bound():
     assert bound_f(12) == 12
     assert bound_f(15) == 15
     assert bound_f(20) == 15
+
+
+def test_field_logger_should_explode_list_columns_into_one_log_per_element():
+
+    story_data = pd.DataFrame({
+        "A": ["a1", "a2", "a3"],
+        "B": [["b1", "b2"], [], ["b3"]],
+        "C": [[1, 2], [], [3]]},
+        index=["r1", "r2", "r3"])
+
+    logger = operations.FieldLogger(log_id="the_logs", cols="A",
+                                    exploded_cols=["B", "C"])
+    logs = logger.emit_logs(story_data)["the_logs"]
+
+    assert logs.columns.tolist() == ["A", "B", "C"]
+    assert logs.index.tolist() == ["r1", "r1", "r3"]
+    assert logs["A"].tolist() == ["a1", "a1", "a3"]
+    assert logs["B"].tolist() == ["b1", "b2", "b3"]
+    assert logs["C"].tolist() == [1, 2, 3]
+
+
+def test_field_logger_should_keep_mixed_types_of_exploded_values():
+
+    story_data = pd.DataFrame({"A": ["a1", "a2"], "B": [[1, "x"], [2]]})
+
+    logs = operations.FieldLogger(log_id="the_logs", exploded_cols="B") \
+        .emit_logs(story_data)["the_logs"]
+
+    assert logs["B"].tolist() == [1, "x", 2]
@@ -1,9 +1,13 @@
 import path
 import pandas as pd
+import numpy as np
 import os
+import pytest
 
 from trumania.core.random_generators import SequencialGenerator
 from trumania.core.population import Population
+from trumania.core.relationship import Relationship, CsrRelationship
+from trumania.core.circus import Circus
 
 dummy_population = Population(circus=None,
                               size=10,
@@ -288,3 +292,136 @@ def test_io_round_trip():
             assert dummy_population.get_relationship(rel_name)._table.equals(
                 retrieved.get_relationship(rel_name)._table
             )
+
+
+@pytest.mark.parametrize("storage", ["grouped", "csr"])
+def test_io_round_trip_should_keep_relationships_and_their_storage(storage):
+
+    population = Population(circus=None, size=3,
+                            ids_gen=SequencialGenerator(prefix="p_"))
+    rel = population.create_relationship("r", seed=1, storage=storage)
+    rel.add_relations(from_ids=["p_0", "p_0", "p_2"], to_ids=["x", "y", "z"])
+
+    with path.tempdir() as p:
+        population_path = os.path.join(p, "test_location")
+        population.save_to(population_path)
+        retrieved = Population.load_from(circus=None, folder=population_path)
+
+    retrieved_rel = retrieved.get_relationship("r")
+    assert isinstance(retrieved_rel, type(rel))
+    assert retrieved_rel.get_relations().equals(rel.get_relations())
+
+
+def test_io_round_trip_should_share_the_id_dictionary_of_the_population_again():
+
+    persons = Population(circus=None, size=4,
+                         ids_gen=SequencialGenerator(max_length=1, prefix="p_"))
+    friends = persons.create_relationship("FRIENDS", seed=1, storage="csr",
+                                          to_population=persons)
+    friends.add_relations(from_ids=["p_0", "p_1", "p_1"], to_ids=["p_3", "p_2", "p_0"])
+
+    with path.tempdir() as p:
+        population_path = os.path.join(p, "persons")
+        persons.save_to(population_path)
+        retrieved = Population.load_from(circus=None, folder=population_path)
+
+    retrieved_friends = retrieved.get_relationship("FRIENDS")
+    assert retrieved_friends.to_dictionary is retrieved.id_dictionary
+    assert retrieved_friends.get_relations().equals(friends.get_relations())
+    assert retrieved_friends.to_codes.tolist() == \
+        retrieved.id_dictionary.encode(["p_3", "p_2", "p_0"]).tolist()
+
+
+def test_io_round_trip_should_share_the_id_dictionary_of_another_population_again():
+
+    circus = Circus(name="c", master_seed=1, start=pd.Timestamp("8 June 2016"),
+                    step_duration=pd.Timedelta("1h"))
+    sims = circus.create_population("sims", size=3,
+                                    ids_gen=SequencialGenerator(prefix="s_"))
+    owners = circus.create_population("owners", size=2,
+                                      ids_gen=SequencialGenerator(prefix="o_"))
+    owned = owners.create_relationship("SIMS", seed=1, storage="csr",
+                                       to_population=sims)
+    owned.add_relations(from_ids=["o_0", "o_1"], to_ids=["s_2", "s_0"])
+
+    with path.tempdir() as p:
+        owners.save_to(os.path.join(p, "owners"))
+        sims.save_to(os.path.join(p, "sims"))
+        retrieved_owners = Population.load_from(os.path.join(p, "owners"), circus=None)
+        retrieved_sims = Population.load_from(os.path.join(p, "sims"), circus=None)
+
+    retrieved_owned = retrieved_owners.get_relationship("SIMS")
+    assert retrieved_owners.unlinked_relationships == {"SIMS": "sims"}
+
+    retrieved_owners.link_relationships({"sims": retrieved_sims})
+    assert retrieved_owners.unlinked_relationships == {}
+    assert retrieved_owned.to_dictionary is retrieved_sims.id_dictionary
+    assert retrieved_owned.get_relations().equals(owned.get_relations())
+
+
+def test_create_relationship_should_use_the_requested_storage():
+
+    population = Population(circus=None, size=5, ids_gen=SequencialGenerator(prefix="p"))
+
+    grouped = population.create_relationship("r1", seed=1)
+    assert isinstance(grouped, Relationship)
+    assert not isinstance(grouped, CsrRelationship)
+    assert isinstance(population.create_relationship("r2", seed=1, storage="csr"),
+                      CsrRelationship)
+
+    with pytest.raises(ValueError):
+        population.create_relationship("r3", seed=1, storage="sparse")
+
+
+def test_csr_relationships_to_a_population_should_share_its_id_codes():
+
+    persons = Population(circus=None, size=4,
+                         ids_gen=SequencialGenerator(max_length=1, prefix="p_"))
+    assert persons.id_dictionary.ids.tolist() == persons.ids.tolist()
+
+    friends = persons.create_relationship("FRIENDS", seed=1, storage="csr",
+                                          to_population=persons)
+    friends.add_relations(from_ids=["p_0", "p_1"], to_ids=["p_3", "p_2"])
+    colleagues = persons.create_relationship("COLLEAGUES", seed=1, storage="csr",
+                                             to_population=persons)
+    colleagues.add_relations(from_ids=["p_2"], to_ids=["p_3"])
+
+    assert friends.select_one(["p_1"])["to"].tolist() == ["p_2"]
+    assert colleagues.select_one(["p_2"])["to"].tolist() == ["p_3"]
+    assert friends.to_codes.tolist() == [3, 2]
+    assert colleagues.to_codes.tolist() == [3]
+
+    # members added later get the next codes
+    persons.create_attribute("AGE", init_values=[1, 2, 3, 4])
+    persons.update(pd.DataFrame({"AGE": [5]}, index=["p_9"]))
+    assert persons.id_dictionary.encode(["p_9"]).tolist() == [4]
+
+
+def test_id_dictionary_should_only_be_built_on_first_use():
+
+    persons = Population(circus=None, size=4,
+                         ids_gen=SequencialGenerator(max_length=1, prefix="p_"))
+    persons.create_attribute("AGE", init_values=[1, 2, 3, 4])
+    persons.update(pd.DataFrame({"AGE": [5]}, index=["p_9"]))
+    assert persons._id_dictionary is None
+
+    assert persons.id_dictionary.encode(["p_9", "p_0"]).tolist() == [4, 0]
+    assert persons.id_dictionary is persons.id_dictionary
+
+
+def test_load_relationship_should_add_the_edges_of_the_file():
+
+    population = Population(circus=None, size=3,
+                            ids_gen=SequencialGenerator(max_length=1, prefix="id_"))
+
+    with path.tempdir() as p:
+        edges_path = os.path.join(p, "edges.npz")
+        np.savez(edges_path, **{"from": np.array(["id_0", "id_2", "id_0"]),
+                                "to": np.array(["x", "y", "z"])})
+
+        rel = population.load_relationship("FRIENDS", edges_path, seed=1,
+                                           storage="csr")
+
+    assert population.get_relationship("FRIENDS") is rel
+    assert isinstance(rel, CsrRelationship)
+    assert rel.get_neighbourhood_size(population.ids).tolist() == [2, 0, 1]
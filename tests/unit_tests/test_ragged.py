@@ -0,0 +1,41 @@
+import numpy as np
+
+from trumania.core.ragged import RaggedArray
+
+
+def test_ragged_array_from_lists_should_keep_rows_and_flat_values():
+
+    ragged = RaggedArray.from_lists([["a", "b"], [], ["c"], ["d", "e", "f"]])
+
+    assert len(ragged) == 4
+    assert ragged.values.tolist() == ["a", "b", "c", "d", "e", "f"]
+    assert ragged.values.dtype == object
+    assert ragged.sizes.tolist() == [2, 0, 1, 3]
+    assert ragged.row_ids().tolist() == [0, 0, 2, 3, 3, 3]
+    assert ragged.to_lists() == [["a", "b"], [], ["c"], ["d", "e", "f"]]
+
+
+def test_ragged_array_from_sizes_should_slice_the_values_in_order():
+
+    ragged = RaggedArray.from_sizes(np.arange(6), [3, 0, 2, 1])
+
+    assert [row.tolist() for row in ragged.split()] == [[0, 1, 2], [], [3, 4], [5]]
+    assert ragged.with_values(np.arange(6) * 10).to_lists() == [
+        [0, 10, 20], [], [30, 40], [50]]
+
+
+def test_empty_ragged_array_should_have_no_rows():
+
+    ragged = RaggedArray.from_lists([])
+
+    assert len(ragged) == 0
+    assert ragged.split() == []
+    assert ragged.to_lists() == []
+
+
+def test_ragged_array_from_lists_should_keep_mixed_values_as_they_are():
+
+    ragged = RaggedArray.from_lists([[1, "a"], [(2, 3)], [("b", 4), 5]])
+
+    assert ragged.values.dtype == object
+    assert ragged.to_lists() == [[1, "a"], [(2, 3)], [("b", 4), 5]]
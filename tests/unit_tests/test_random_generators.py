@@ -12,9 +12,9 @@ from trumania.core.random_generators import DependentTriggerGenerator, FakerGene
 def test_constant_generator_should_produce_constant_values():
     tested = ConstantGenerator(value="c")
 
-    assert [] == tested.generate(size=0)
-    assert ["c"] == tested.generate(size=1)
-    assert ["c", "c", "c", "c", "c"] == tested.generate(size=5)
+    assert [] == tested.generate(size=0).tolist()
+    assert ["c"] == tested.generate(size=1).tolist()
+    assert ["c", "c", "c", "c", "c"] == tested.generate(size=5).tolist()
 
 
 def test_numpy_random_generator_should_delegate_to_numpy_correctly():
@@ -168,3 +168,99 @@ def test_sequencial_generator_must_not_change_format_when_size_is_float():
     # bugfix: this was previously generating "sq00.0", "sq01.0",...
     assert ["sq00", "sq01", "sq02"] == seq.generate(size=3.3)
     assert ["sq03", "sq04", "sq05"] == seq.generate(size=3.3)
+
+
+def test_mapped_generators_should_produce_arrays():
+
+    gen = NumpyRandomGenerator(method="uniform", seed=1234)
+
+    for mapped in [gen.map(f=lambda v: v * 2), gen.map(f_vect=lambda v: v * 2),
+                   gen.map(np.sqrt), gen.map(f=str)]:
+        values = mapped.generate(size=10)
+        assert isinstance(values, np.ndarray)
+        assert values.shape == (10,)
+
+    assert gen.map(f=str).generate(size=3).dtype == object
+
+
+def test_chained_maps_should_be_fused_and_equivalent_to_sequential_ones():
+
+    def build():
+        return NumpyRandomGenerator(method="uniform", seed=1234)
+
+    chained = build() \
+        .map(f=lambda v: v * 10) \
+        .map(f=int) \
+        .map(f_vect=lambda v: v + 1) \
+        .map(np.negative)
+
+    # all the maps are applied directly to the values of the root generator
+    assert isinstance(chained.parent, NumpyRandomGenerator)
+
+    expected = -(np.array([int(v * 10) for v in build().generate(size=20)]) + 1)
+    assert chained.generate(size=20).tolist() == expected.tolist()
+
+
+def test_mapped_values_should_be_positional_even_if_mapper_returns_series():
+
+    gen = ConstantGenerator(value=3).map(
+        f_vect=lambda values: pd.Series(values, index=[10, 11, 12]))
+
+    story_data = pd.DataFrame({"A": [1, 2, 3]}, index=[0, 1, 2])
+    output, _ = gen.ops.generate(named_as="B")(story_data)
+
+    assert output["B"].tolist() == [3, 3, 3]
+
+
+def test_constant_generator_should_broadcast_its_value_without_copies():
+
+    values = ConstantGenerator(value=2.5).generate(size=1000000)
+
+    assert values.dtype == float
+    assert values.strides == (0,)
+    assert not values.flags.writeable
+    assert ConstantGenerator(value="c").generate(size=2).dtype == object
+    assert ConstantGenerator(value=[1, 2]).generate(size=2).tolist() == [
+        [1, 2], [1, 2]]
+
+
+def test_constant_generator_ops_should_add_a_constant_column():
+
+    story_data = pd.DataFrame({"A": [1, 2, 3]}, index=[7, 8, 9])
+    op = ConstantGenerator(value="VOICE").ops.generate(named_as="PRODUCT")
+    output, _ = op(story_data)
+
+    assert output["PRODUCT"].tolist() == ["VOICE"] * 3
+
+    # the column can be modified like any other one
+    output.loc[8, "PRODUCT"] = "SMS"
+    assert output["PRODUCT"].tolist() == ["VOICE", "SMS", "VOICE"]
+
+
+def test_mapping_a_constant_generator_with_a_ufunc_should_yield_a_constant():
+
+    mapped = ConstantGenerator(value=4.).map(np.sqrt)
+
+    assert isinstance(mapped, ConstantGenerator)
+    assert mapped.generate(size=3).tolist() == [2.] * 3
+
+
+def test_mapping_a_constant_generator_should_call_the_function_per_value():
+
+    state = np.random.RandomState(1)
+    mapped = ConstantGenerator(value=10).map(f=lambda v: v + state.uniform())
+
+    assert len(set(mapped.generate(size=5))) == 5
+
+
+def test_mapped_values_of_mixed_types_should_be_kept_as_they_are():
+
+    gen = NumpyRandomGenerator(method="choice", a=[0, 1, 2], seed=1234)
+    values = gen.map(f=lambda v: "none" if v == 0 else v).generate(size=50)
+
+    assert values.dtype == object
+    assert set(values) == {"none", 1, 2}
+
+    pairs = gen.map(f=lambda v: (v, v)).generate(size=5)
+    assert pairs.shape == (5,)
+    assert all(isinstance(pair, tuple) for pair in pairs)
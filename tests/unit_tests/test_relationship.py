@@ -4,10 +4,12 @@ import logging
 import os
 import numpy as np
 import functools
+import pytest
 
 from trumania.core.util_functions import setup_logging
 from trumania.core.util_functions import build_ids
-from trumania.core.relationship import Relationship
+from trumania.core import relationship
+from trumania.core.relationship import Relationship, CsrRelationship
 
 setup_logging()
 
@@ -254,6 +256,35 @@ def test_weighted_relationship_should_take_overridden_weights_into_account():
     assert sorted(selected["from"].tolist()) == ["a", "b", "c"]
 
 
+def test_overridden_weights_missing_a_to_should_be_rejected():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a", "a", "b"], to_ids=["x", "y", "z"])
+
+    with pytest.raises(AssertionError) as e:
+        rel.select_one(overridden_to_weights=pd.Series([1, 1], index=["x", "y"]))
+    assert "'z'" in str(e.value)
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_overridden_weights_should_ignore_removed_relations(relationship_class):
+
+    rel = relationship_class(seed=1)
+    rel.add_relations(from_ids=["a"] * 4 + ["b"] * 2,
+                      to_ids=["w", "x", "y", "z", "w", "z"])
+    rel.remove_relations(from_ids=["a", "b"], to_ids=["x", "z"])
+
+    # removed relations do not need any weight
+    overridden_to_weights = pd.Series([1, 0, 3], index=["w", "y", "z"])
+    selected = rel.select_one(from_ids=pd.Series(["a", "b"] * 2000),
+                              overridden_to_weights=overridden_to_weights)
+
+    assert selected[selected["from"] == "b"]["to"].unique().tolist() == ["w"]
+    counts = selected[selected["from"] == "a"]["to"].value_counts()
+    assert counts.index.tolist() == ["z", "w"]
+    assert 1350 < counts["z"] < 1650
+
+
 def test_pop_one_relationship_should_remove_element():
     # we're removing relations from this one => working on a copy not to
     # influence other tests
@@ -343,6 +374,70 @@ def test_select_one_to_one_should_not_return_duplicates_2():
     assert 1 <= output.shape[0] <= 2
 
 
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_select_one_to_one_should_redraw_the_conflicting_requests(
+        relationship_class):
+
+    # everybody is connected to everything => conflicting requests can always
+    # be served by another "to"
+    rel = relationship_class(seed=1)
+    rel.add_relations(from_ids=np.repeat(["a", "b", "c"], 50),
+                      to_ids=["t%d" % i for i in range(50)] * 3)
+
+    requested = pd.Series(["a", "b", "c"] * 15 + ["d"], index=range(100, 146))
+    selected = rel.select_one(requested, one_to_one=True, discard_empty=False)
+
+    assert selected.index.tolist() == requested.index.tolist()
+    assert selected["to"].iloc[:45].nunique() == 45
+    assert selected["to"].iloc[45] is None
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_select_one_to_one_should_be_reproducible(relationship_class):
+
+    def select(seed):
+        rel = relationship_class(seed=seed)
+        rel.add_relations(from_ids=np.repeat(["a", "b", "c"], 4),
+                          to_ids=["x", "y", "z", "w"] * 3,
+                          weights=[1, 2, 3, 4] * 3)
+        return rel.select_one(pd.Series(["a", "b", "c"] * 3), one_to_one=True)
+
+    assert select(3).equals(select(3))
+    assert select(3)["to"].nunique() == 4
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_degrees_and_weight_sums_should_follow_the_changes(relationship_class):
+
+    rel = relationship_class(seed=1)
+    rel.add_relations(from_ids=["a", "a", "b", "c"], to_ids=["x", "y", "x", "z"],
+                      weights=[1, 2, 3, 4])
+
+    requested = ["c", "a", "zz", "a"]
+    assert rel.get_degrees(requested).tolist() == [1, 2, 0, 2]
+    assert rel.get_weight_sums(requested).tolist() == [4, 3, 0, 3]
+
+    rel.add_relations(from_ids=["a", "d"], to_ids=["z", "x"], weights=[5, 6])
+    rel.remove_relations(from_ids=["c", "a"], to_ids=["z", "x"])
+    rel.select_one(["b"], remove_selected=True)
+
+    assert rel.get_degrees(["a", "b", "c", "d"]).tolist() == [2, 0, 0, 1]
+    assert rel.get_weight_sums(["a", "b", "c", "d"]).tolist() == [7, 0, 0, 6]
+
+
+def test_neighbourhood_size_op_should_be_aligned_with_the_story_data():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a", "a", "b"], to_ids=["x", "y", "x"])
+    op = rel.ops.get_neighbourhood_size(from_field="A", named_as="SIZE")
+
+    story_data = pd.DataFrame({"A": ["b", "zz", "a", "b"]}, index=[10, 3, 7, 1])
+    output, logs = op(story_data)
+
+    assert output["SIZE"].tolist() == [1, 0, 2, 1]
+    assert output.index.tolist() == [10, 3, 7, 1]
+
+
 def test_select_one_to_one_among_no_data_should_return_nothing():
     # (instead of crashing...)
 
@@ -517,6 +612,30 @@ def test_select_many_with_drop_should_remove_elements():
             assert to_id not in rels["to"]
 
 
+def test_select_many_with_drop_should_remove_the_picks_of_repeated_froms():
+
+    rel = Relationship(seed=1234)
+    rel.add_relations(from_ids=["id1"] * 10 + ["id2"] * 4,
+                      to_ids=["t%d" % i for i in range(14)])
+
+    from_ids = pd.Series(["id1", "id2", "id1", "id1", "id2"],
+                         index=["r1", "r2", "r3", "r4", "r5"])
+    selection = rel.select_many(from_ids=from_ids, named_as="picks",
+                                quantities=[3, 1, 2, 4, 2],
+                                remove_selected=True, discard_empty=False)
+
+    assert selection["picks"].map(len)[from_ids.index].tolist() == [3, 1, 2, 4, 2]
+
+    all_picks = [to for picks in selection["picks"] for to in picks]
+    assert len(set(all_picks)) == len(all_picks) == 12
+
+    # the picks of every request are removed, not only of the first one
+    remaining = rel.get_relations()
+    assert remaining.shape[0] == 2
+    assert not set(remaining["to"]) & set(all_picks)
+    assert rel.get_neighbourhood_size(["id1", "id2"]).tolist() == [1, 1]
+
+
 def test_select_many_several_times_with_pop_should_empty_all_data():
 
     rel = Relationship(seed=1234)
@@ -687,6 +806,192 @@ def test_add_grouped():
         "f21", "f22", "f23", "f24"]
 
 
+def test_added_relations_should_be_merged_when_read():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a", "b"], to_ids=["x1", "y1"])
+    rel.add_relations(from_ids=["b", "a", "c"], to_ids=["y2", "x2", "z1"],
+                      weights=[1, 2, 3])
+
+    # nothing is merged until the relationship is read
+    assert rel._pending_size == 5
+
+    assert rel.get_relations(["a"])["to"].tolist() == ["x1", "x2"]
+    assert rel.get_relations(["a"])["weight"].tolist() == [1, 2]
+    assert rel._pending_size == 0
+    assert set(rel.grouped.keys()) == {"a", "b", "c"}
+    assert rel.get_neighbourhood_size(["a", "b", "c"]).tolist() == [2, 2, 1]
+
+
+def test_relations_added_in_several_times_should_keep_their_order():
+
+    tos = ["t%d" % i for i in range(20)]
+
+    rel = Relationship(seed=1)
+    for i in range(20):
+        rel.add_relations(from_ids=["a", "b"], to_ids=[tos[i], tos[-i - 1]],
+                          weights=[i, 1])
+
+    assert rel.get_relations(["a"])["to"].tolist() == tos
+    assert rel.get_relations(["a"])["weight"].tolist() == list(range(20))
+    assert rel.get_relations(["b"])["to"].tolist() == tos[::-1]
+
+
+def test_pending_relations_should_be_merged_above_threshold(monkeypatch):
+
+    monkeypatch.setattr(relationship, "PENDING_RELATIONS_THRESHOLD", 5)
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a"] * 3, to_ids=["x", "y", "z"])
+    assert rel._pending_size == 3
+
+    rel.add_grouped_relations(from_ids=["b"], grouped_ids=[["u", "v"]])
+    assert rel._pending_size == 0
+    assert len(rel._grouped) == 2
+
+
+def test_add_grouped_should_keep_the_order_of_the_items():
+
+    items = ["i%d" % i for i in range(50)]
+    for rel in [Relationship(seed=1), CsrRelationship(seed=1)]:
+        rel.add_grouped_relations(from_ids=["b1", "b2"],
+                                  grouped_ids=[items, items[::-1]])
+
+        assert rel.get_relations(["b1"])["to"].tolist() == items
+        assert rel.get_relations(["b2"])["to"].tolist() == items[::-1]
+
+
+def test_remove_relations_should_remove_all_matching_pairs():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a", "a", "a", "b", "b", "c"],
+                      to_ids=["x", "y", "x", "x", "z", "x"])
+
+    rel.remove_relations(from_ids=["a", "b", "unknown"],
+                         to_ids=["x", "z", "x"])
+
+    assert rel.get_relations(["a"])["to"].tolist() == ["y"]
+    assert rel.get_relations(["b"])["to"].tolist() == ["x"]
+    assert rel.get_relations(["c"])["to"].tolist() == ["x"]
+
+    # emptied "from" are discarded, and unknown ones not added
+    rel.remove_relations(from_ids=["c"], to_ids=["x"])
+    assert set(rel.grouped.keys()) == {"a", "b"}
+
+
+def test_remove_operation_should_remove_relations():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a", "a", "b"], to_ids=["x", "y", "x"])
+
+    op = rel.ops.remove(from_field="A", item_field="B")
+    op(pd.DataFrame({"A": ["a", "b"], "B": ["y", "x"]}))
+
+    assert rel.get_relations()["to"].tolist() == ["x"]
+    assert set(rel.grouped.keys()) == {"a"}
+
+
+def test_selections_after_removal_should_be_the_same_as_from_remaining_relations():
+
+    tos = ["t%d" % i for i in range(10)]
+    removed = ["t1", "t4", "t7"]
+    remaining = [to for to in tos if to not in removed]
+
+    popped = Relationship(seed=1)
+    popped.add_relations(from_ids=["a"] * 10, to_ids=tos, weights=range(1, 11))
+    popped.remove_relations(from_ids=["a"] * 3, to_ids=removed)
+
+    # removed relations are only flagged as such until the next compaction
+    assert popped.grouped["a"].alive.shape[0] == 10
+
+    rebuilt = Relationship(seed=1)
+    rebuilt.add_relations(from_ids=["a"] * 7, to_ids=remaining,
+                          weights=[int(to[1:]) + 1 for to in remaining])
+
+    assert popped.get_relations().equals(rebuilt.get_relations())
+
+    requested = pd.Series(["a"] * 20)
+    assert popped.select_one(requested).equals(rebuilt.select_one(requested))
+
+    picked = popped.select_many(requested[:1], named_as="T", quantities=[5])
+    assert list(picked.loc[0, "T"]) == list(rebuilt.select_many(
+        requested[:1], named_as="T", quantities=[5]).loc[0, "T"])
+
+
+def test_removing_most_relations_should_compact_the_storage():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a"] * 10, to_ids=["t%d" % i for i in range(10)])
+
+    for _ in range(6):
+        rel.select_one(from_ids=["a"], remove_selected=True)
+
+    relations = rel.grouped["a"]
+    assert len(relations) == 4
+    assert relations.alive.shape[0] < 10
+    assert relations.weight_sum == 4
+    assert rel.get_relations().shape[0] == 4
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_relationship_built_from_edges_should_contain_all_of_them_in_order(
+        relationship_class):
+
+    from_ids = np.array(["b", "a", "b", "c", "a", "b"])
+    to_ids = np.array(["b1", "a1", "b2", "c1", "a2", "b3"])
+
+    rel = relationship_class.from_edges(seed=1, from_ids=from_ids,
+                                        to_ids=to_ids, weights=np.arange(6))
+
+    assert rel.get_relations(["a"])["to"].tolist() == ["a1", "a2"]
+    assert rel.get_relations(["b"])["to"].tolist() == ["b1", "b2", "b3"]
+    assert rel.get_relations(["b"])["weight"].tolist() == [0, 2, 5]
+    assert rel.get_neighbourhood_size(["a", "b", "c", "d"]).tolist() == [2, 3, 1, 0]
+
+    added = relationship_class(seed=1)
+    added.add_relations(from_ids=from_ids, to_ids=to_ids, weights=np.arange(6))
+    assert added.get_relations().sort_values(["from", "to"]).reset_index(drop=True).equals(
+        rel.get_relations().sort_values(["from", "to"]).reset_index(drop=True))
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_relationship_loaded_from_npz_edges_should_contain_all_of_them(
+        relationship_class):
+
+    with path.tempdir() as p:
+        edges_path = os.path.join(p, "edges.npz")
+        np.savez(edges_path, **{"from": np.repeat(np.arange(100), 10),
+                                "to": np.arange(1000),
+                                "weight": np.ones(1000) * 2})
+
+        rel = relationship_class.load_edges(seed=1, file_path=edges_path)
+
+    relations = rel.get_relations()
+    assert relations.shape[0] == 1000
+    assert set(relations["to"]) == set(range(1000))
+    assert (relations["weight"] == 2).all()
+    assert rel.get_neighbourhood_size([0, 99, 100]).tolist() == [10, 10, 0]
+
+
+def test_relationship_loaded_from_parquet_edges_should_have_default_weights():
+    pytest.importorskip("pyarrow")
+
+    with path.tempdir() as p:
+        edges_path = os.path.join(p, "edges.parquet")
+        pd.DataFrame({"from": ["a", "a", "b"], "to": ["x", "y", "z"]}).to_parquet(edges_path)
+
+        rel = Relationship.load_edges(seed=1, file_path=edges_path)
+
+    assert rel.get_relations(["a"])["to"].tolist() == ["x", "y"]
+    assert rel.get_relations()["weight"].tolist() == [1, 1, 1]
+
+
+def test_loading_edges_from_an_unknown_format_should_be_refused():
+
+    with pytest.raises(ValueError):
+        Relationship.load_edges(seed=1, file_path="edges.csv")
+
+
 def test_io_round_trip():
 
     with path.tempdir() as p:
@@ -706,3 +1011,585 @@ def test_io_round_trip():
         assert expected_relations["from"].equals(actual_relations["from"])
         assert expected_relations["to"].equals(actual_relations["to"])
         assert expected_relations["weight"].equals(actual_relations["weight"])
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_binary_round_trip_should_keep_relations_and_random_state(
+        relationship_class):
+
+    rel = relationship_class(seed=3)
+    rel.add_relations(from_ids=["a", "b", "b", "c", "c", "c"],
+                      to_ids=["ta", "tb1", "tb2", "tc1", "tc2", "tc3"],
+                      weights=[1, 2, 3, 4, 5, 6])
+    rel.remove_relations(from_ids=["c"], to_ids=["tc2"])
+    rel.select_one(pd.Series(["a", "b", "c"]))
+
+    with path.tempdir() as p:
+        folder = os.path.join(p, "relationship")
+        rel.save_binary(folder)
+
+        assert Relationship.binary_storage(folder) == rel.storage
+        retrieved = relationship_class.load_binary(folder)
+
+    assert isinstance(retrieved, relationship_class)
+    assert retrieved.seed == 3
+    assert retrieved.get_relations().equals(rel.get_relations())
+
+    requested = pd.Series(["a", "b", "c"] * 10)
+    assert retrieved.select_one(requested).equals(rel.select_one(requested))
+
+
+@pytest.mark.parametrize("saved_class,loaded_class", [
+    (Relationship, CsrRelationship), (CsrRelationship, Relationship)])
+def test_binary_relationship_should_be_loadable_in_another_storage(
+        saved_class, loaded_class):
+
+    rel = saved_class.from_edges(seed=1, from_ids=["a", "a", "b"],
+                                 to_ids=["x", "y", "z"], weights=[1., 2., 3.])
+    rel.remove_relations(from_ids=["a"], to_ids=["y"])
+
+    with path.tempdir() as p:
+        folder = os.path.join(p, "relationship")
+        rel.save_binary(folder)
+        retrieved = loaded_class.load_binary(folder)
+
+    assert isinstance(retrieved, loaded_class)
+    relations = retrieved.get_relations().sort_values("from")
+    assert relations["from"].tolist() == ["a", "b"]
+    assert relations["to"].tolist() == ["x", "z"]
+    assert relations["weight"].tolist() == [1., 3.]
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_binary_format_should_store_ids_without_pickling(relationship_class):
+
+    rel = relationship_class.from_edges(
+        seed=1, from_ids=np.array([1, 2], dtype=object), to_ids=["x", "y"])
+
+    with path.tempdir() as p:
+        folder = os.path.join(p, "relationship")
+        rel.save_binary(folder)
+
+        # np.load() refuses arrays that would need unpickling
+        assert np.load(os.path.join(folder, "from_ids.npy"),
+                       allow_pickle=False).tolist() == [1, 2]
+        assert np.load(os.path.join(folder, "to_ids.npy"),
+                       allow_pickle=False).tolist() == ["x", "y"]
+
+        mixed = relationship_class.from_edges(
+            seed=1, from_ids=np.array([1, "b"], dtype=object), to_ids=["x", "y"])
+        with pytest.raises(ValueError):
+            mixed.save_binary(folder)
+
+
+def test_loading_npz_edges_of_python_objects_should_be_refused():
+
+    with path.tempdir() as p:
+        edges_path = os.path.join(p, "edges.npz")
+        np.savez(edges_path, **{"from": np.array(["a", "b"], dtype=object),
+                                "to": np.array(["x", "y"], dtype=object)})
+
+        with pytest.raises(ValueError):
+            Relationship.load_edges(seed=1, file_path=edges_path)
+
+
+def test_memory_mapped_csr_relationship_should_select_like_the_saved_one():
+
+    rel = build_csr(seed=2).freeze()
+
+    with path.tempdir() as p:
+        folder = os.path.join(p, "relationship")
+        rel.save_binary(folder)
+
+        shared = CsrRelationship.load_binary(folder, mmap_mode="r")
+        assert isinstance(shared.to_codes, np.memmap)
+        assert shared.frozen
+
+        requested = pd.Series(["a", "b", "c", "d"] * 10)
+        assert shared.select_one(requested).equals(rel.select_one(requested))
+
+        # copy-on-write maps can be modified, without changing the files
+        private = CsrRelationship.load_binary(folder, mmap_mode="c")
+        private.remove_relations(from_ids=["b"], to_ids=["tb1"])
+        assert private.get_neighbourhood_size(["b"]).tolist() == [1]
+
+        reloaded = CsrRelationship.load_binary(folder, mmap_mode="r")
+        assert reloaded.get_neighbourhood_size(["b"]).tolist() == [2]
+        del shared, private, reloaded
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_reverse_neighbourhood_size_should_follow_changes_of_the_relations(
+        relationship_class):
+
+    rel = relationship_class(seed=1)
+    rel.add_relations(from_ids=["a", "a", "b", "c"], to_ids=["x", "y", "x", "x"])
+
+    sizes = rel.get_reverse_neighbourhood_size(["y", "x", "zz"])
+    assert sizes.to_dict() == {"x": 3, "y": 1, "zz": 0}
+
+    rel.remove_relations(from_ids=["b"], to_ids=["x"])
+    rel.add_relations(from_ids=["d"], to_ids=["y"])
+    assert rel.get_reverse_degrees(["x", "y", "zz"]).tolist() == [2, 2, 0]
+
+    rel.select_one(["a", "a"], remove_selected=True)
+    assert rel.get_reverse_degrees(["x", "y"]).sum() == 2
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_select_one_reverse_should_follow_the_weights(relationship_class):
+
+    rel = relationship_class(seed=1)
+    rel.add_relations(from_ids=["a", "b", "c", "d"], to_ids=["x", "x", "x", "y"],
+                      weights=[1, 3, 0, 1])
+
+    to_ids = pd.Series(["x"] * 4000 + ["zz", "y"], index=np.arange(4002) * 2)
+    selected = rel.select_one_reverse(to_ids, named_as="FROM",
+                                      discard_empty=False)
+
+    assert selected.index.tolist() == to_ids.index.tolist()
+    assert selected["to"].tolist() == to_ids.tolist()
+    assert selected["FROM"].iloc[-2:].tolist() == [None, "d"]
+
+    counts = selected["FROM"].iloc[:-2].value_counts()
+    assert "c" not in counts
+    assert 0.7 < counts["b"] / 4000 < 0.8
+
+
+def test_select_one_reverse_should_use_the_random_state_of_the_relationship():
+
+    def selections():
+        rel = build_csr(seed=4)
+        rel.add_relations(from_ids=["d", "e"], to_ids=["tb1", "tb1"])
+        return rel.select_one_reverse(pd.Series(["tb1"] * 20))
+
+    assert selections().equals(selections())
+
+
+def test_reverse_ops_should_add_columns_aligned_with_the_story_data():
+
+    rel = Relationship(seed=1)
+    rel.add_relations(from_ids=["a", "b", "b"], to_ids=["x", "y", "x"])
+
+    story_data = pd.DataFrame({"T": ["y", "zz", "x"]}, index=[10, 3, 7])
+
+    output, _ = rel.ops.get_reverse_neighbourhood_size(
+        to_field="T", named_as="SIZE")(story_data)
+    assert output["SIZE"].tolist() == [1, 0, 2]
+    assert output.index.tolist() == [10, 3, 7]
+
+    output, _ = rel.ops.select_one_reverse(
+        to_field="T", named_as="OWNER", discard_empty=True)(story_data)
+    assert output.columns.tolist() == ["T", "OWNER"]
+    assert output.index.tolist() == [10, 7]
+    assert output.loc[10, "OWNER"] == "b"
+    assert output.loc[7, "OWNER"] in {"a", "b"}
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_relation_arrays_should_be_typed_and_grouped_by_from(relationship_class):
+
+    rel = relationship_class.from_edges(
+        seed=1, from_ids=["b", "a", "b", "c"], to_ids=[10, 11, 12, 13],
+        weights=[1., 2., 3., 4.])
+    rel.remove_relations(from_ids=["c"], to_ids=[13])
+
+    from_ids, to_ids, weights = rel.get_relation_arrays(["b", "zz", "c", "b"])
+
+    assert from_ids.tolist() == ["b", "b"]
+    assert to_ids.tolist() == [10, 12]
+    assert to_ids.dtype.kind == "i"
+    assert weights.dtype == float
+    assert weights.tolist() == [1., 3.]
+
+    relations = rel.get_relations()
+    assert relations.columns.tolist() == ["from", "to", "weight"]
+    assert sorted(relations["to"].tolist()) == [10, 11, 12]
+
+
+@pytest.mark.parametrize("relationship_class", [Relationship, CsrRelationship])
+def test_iter_relations_should_cover_all_relations_in_bounded_chunks(
+        relationship_class):
+
+    froms = np.repeat(np.array(build_ids(50, prefix="f_"), dtype=object),
+                      np.arange(50) % 7)
+    rel = relationship_class.from_edges(seed=1, from_ids=froms,
+                                        to_ids=np.arange(froms.shape[0]))
+
+    chunks = list(rel.iter_relations(chunk_size=20))
+
+    assert len(chunks) > 1
+    assert all(chunk.shape[0] < 40 for chunk in chunks)
+
+    # each "from" is in one single chunk
+    chunk_froms = [set(chunk["from"]) for chunk in chunks]
+    assert sum(len(f) for f in chunk_froms) == len(set.union(*chunk_froms))
+
+    all_relations = pd.concat(chunks, ignore_index=True)
+    assert sorted(all_relations["to"].tolist()) == list(range(froms.shape[0]))
+
+
+def build_csr(seed=1):
+    rel = CsrRelationship(seed=seed)
+    rel.add_relations(from_ids=["a", "b", "b", "c", "c", "c"],
+                      to_ids=["ta", "tb1", "tb2", "tc1", "tc2", "tc3"])
+    return rel
+
+
+def test_csr_relations_should_be_equivalent_to_grouped_ones():
+
+    grouped = Relationship(seed=1)
+    csr = CsrRelationship(seed=1)
+    for rel in [grouped, csr]:
+        rel.add_relations(from_ids=["c", "a", "b", "b"], to_ids=["tc", "ta", "tb1", "tb2"],
+                          weights=[1, 2, 3, 4])
+        rel.add_relations(from_ids=["a", "d"], to_ids=["ta2", "td"])
+
+    def sorted_relations(rel, **kwargs):
+        return rel.get_relations(**kwargs).sort_values(["from", "to"]).reset_index(drop=True)
+
+    assert sorted_relations(csr).equals(sorted_relations(grouped))
+    assert sorted_relations(csr, from_ids=["a", "zz", "b"]).equals(
+        sorted_relations(grouped, from_ids=["a", "zz", "b"]))
+
+    requested = ["b", "a", "zz", "a"]
+    assert csr.get_neighbourhood_size(requested).equals(
+        grouped.get_neighbourhood_size(requested))
+    assert csr.unique_tos() == grouped.unique_tos()
+
+
+def test_csr_select_one_should_keep_request_index_and_missing_semantics():
+
+    rel = build_csr()
+    from_ids = pd.Series(["c", "zz", "a", "b"], index=["r1", "r2", "r3", "r4"])
+
+    kept = rel.select_one(from_ids, named_as="T", discard_empty=False)
+    assert kept.index.tolist() == ["r1", "r2", "r3", "r4"]
+    assert kept["from"].tolist() == ["c", "zz", "a", "b"]
+    assert kept.loc["r2", "T"] is None
+    assert kept.loc["r3", "T"] == "ta"
+    assert kept.loc["r1", "T"] in {"tc1", "tc2", "tc3"}
+
+    discarded = rel.select_one(from_ids, named_as="T", discard_empty=True)
+    assert discarded.index.tolist() == ["r1", "r3", "r4"]
+    assert sorted(discarded.columns.tolist()) == ["T", "from"]
+
+
+def test_csr_select_one_should_follow_the_weights():
+
+    rel = CsrRelationship(seed=1)
+    rel.add_relations(from_ids=["a", "a", "a", "b", "b"],
+                      to_ids=["x", "y", "z", "x", "y"],
+                      weights=[1, 0, 3, 0, 0])
+
+    selected = rel.select_one(pd.Series(["a"] * 10000 + ["b"] * 10000))
+    counts_a = selected[selected["from"] == "a"]["to"].value_counts()
+
+    # zero weights are never selected...
+    assert set(counts_a.index) == {"x", "z"}
+    assert 0.70 < counts_a["z"] / 10000 < 0.80
+
+    # ... unless all weights of the row are 0, which behaves as uniform
+    counts_b = selected[selected["from"] == "b"]["to"].value_counts()
+    assert 0.45 < counts_b["x"] / 10000 < 0.55
+
+
+def test_csr_select_one_should_take_overridden_weights_into_account():
+
+    rel = CsrRelationship(seed=1234)
+    rel.add_relations(from_ids=["a"] * 3 + ["b"] * 3, to_ids=["x", "y", "z"] * 2,
+                      weights=[0, 1, 0] * 2)
+
+    selected = rel.select_one(
+        overridden_to_weights=pd.Series([0, 0, 1], index=["x", "y", "z"]))
+
+    assert selected["to"].tolist() == ["z", "z"]
+
+    with pytest.raises(AssertionError):
+        rel.select_one(overridden_to_weights=pd.Series([1], index=["x"]))
+
+
+def test_csr_seeded_selections_should_be_reproducible():
+
+    requested = pd.Series(["a", "b", "c"] * 10)
+    assert build_csr(seed=5).select_one(requested).equals(
+        build_csr(seed=5).select_one(requested))
+
+
+def test_csr_pop_one_should_remove_the_selected_relations():
+
+    rel = build_csr()
+    selected = rel.select_one(from_ids=["a", "c", "c"], remove_selected=True,
+                              one_to_one=True)
+
+    assert selected["to"].nunique() == selected.shape[0]
+    remaining = rel.get_relations()
+    assert remaining.shape[0] == 6 - selected.shape[0]
+    assert not remaining["to"].isin(selected["to"]).any()
+
+    # a has no relation left
+    assert rel.get_neighbourhood_size(["a"]).tolist() == [0]
+    assert rel.select_one(["a"]).shape[0] == 0
+
+
+def test_csr_select_one_to_one_should_not_return_duplicates():
+
+    rel = CsrRelationship(seed=1)
+    rel.add_relations(from_ids=["a", "b", "c", "d"], to_ids=["z", "z", "z", "z"])
+
+    op = rel.ops.select_one(from_field="A", named_as="B", one_to_one=True)
+    output, logs = op(pd.DataFrame({"A": ["a", "b", "c", "d"]}))
+
+    assert output.shape[0] == 1
+
+
+def test_csr_select_many_should_cap_and_remove_selections():
+
+    rel = CsrRelationship(seed=1234)
+    rel.add_relations(from_ids=["id1"] * 25 + ["id2"] * 5,
+                      to_ids=["t%d" % i for i in range(30)])
+
+    selection = rel.select_many(
+        from_ids=pd.Series(["id1", "id2", "id3"], index=["f1", "f2", "f3"]),
+        named_as="the_selection", quantities=[10, 10, 10],
+        remove_selected=True, discard_empty=False)
+
+    assert selection["the_selection"].map(len)[["f1", "f2", "f3"]].tolist() == [10, 5, 0]
+    assert set(selection.loc["f2", "the_selection"]) == {"t25", "t26", "t27", "t28", "t29"}
+    assert rel.get_neighbourhood_size(["id1", "id2"]).tolist() == [15, 0]
+
+    remaining = set(rel.get_relations()["to"])
+    assert not remaining & set(selection.loc["f1", "the_selection"])
+
+
+def test_csr_remove_relations_should_remove_all_matching_pairs():
+
+    rel = build_csr()
+    rel.add_relations(from_ids=["b"], to_ids=["tb1"])
+    rel.remove_relations(from_ids=["b", "c"], to_ids=["tb1", "ta"])
+
+    assert sorted(rel.get_relations(["b"])["to"].tolist()) == ["tb2"]
+    assert rel.get_neighbourhood_size(["a", "c"]).tolist() == [1, 3]
+
+
+def test_csr_select_many_should_serve_repeated_froms_without_duplicates():
+
+    rel = CsrRelationship(seed=1234)
+    rel.add_relations(from_ids=["id1"] * 10 + ["id2"] * 4,
+                      to_ids=["t%d" % i for i in range(14)])
+
+    from_ids = pd.Series(["id1", "id2", "id1", "id1", "id2"],
+                         index=["r1", "r2", "r3", "r4", "r5"])
+    selection = rel.select_many(from_ids=from_ids, named_as="picks",
+                                quantities=[4, 3, 4, 4, 3],
+                                remove_selected=True, discard_empty=False)
+
+    sizes = selection["picks"].map(len)
+
+    # 12 items requested from id1, 6 from id2: 2 items must be dropped for
+    # id1 and 2 for id2, on whichever requests are served last
+    assert sizes[["r1", "r3", "r4"]].sum() == 10
+    assert sizes[["r2", "r5"]].sum() == 4
+    assert sorted(sizes[["r2", "r5"]].tolist()) == [1, 3]
+
+    all_picks = [to for picks in selection["picks"] for to in picks]
+    assert len(set(all_picks)) == len(all_picks) == 14
+
+    assert rel.get_relations().shape[0] == 0
+
+
+def test_csr_select_many_of_unknown_froms_should_return_empty_selections():
+
+    rel = build_csr()
+
+    discarded = rel.select_many(from_ids=pd.Series(["x", "y"]), named_as="T",
+                                quantities=[2, 2])
+    assert discarded.shape[0] == 0
+
+    kept = rel.select_many(from_ids=pd.Series(["x", "y"]), named_as="T",
+                           quantities=[2, 2], discard_empty=False)
+    assert kept["T"].map(len).tolist() == [0, 0]
+    assert rel.get_relations().shape[0] == 6
+
+
+def test_csr_select_many_should_pick_uniformly():
+
+    froms = ["a%d" % i for i in range(8000)]
+    rel = CsrRelationship(seed=1)
+    rel.add_relations(from_ids=np.repeat(froms, 4),
+                      to_ids=["w", "x", "y", "z"] * 8000)
+
+    selection = rel.select_many(from_ids=pd.Series(froms), named_as="T",
+                                quantities=[2] * 8000)
+
+    counts = pd.Series([to for picks in selection["T"] for to in picks]).value_counts()
+    assert counts.sum() == 16000
+    assert all(3600 < count < 4400 for count in counts)
+
+
+def test_csr_removed_relations_should_never_be_selected():
+
+    rel = CsrRelationship(seed=1)
+    rel.add_relations(from_ids=np.repeat(["a", "b"], 10),
+                      to_ids=["t%d" % i for i in range(20)],
+                      weights=[1, 0] * 10)
+
+    rel.remove_relations(from_ids=["a", "a", "b"], to_ids=["t0", "t2", "t18"])
+
+    # those are only flagged as removed, the storage is not rebuilt
+    assert rel.to_ids.shape[0] == 20
+    assert rel.get_neighbourhood_size(["a", "b"]).tolist() == [8, 9]
+    assert "t0" not in rel.unique_tos()
+
+    selected = rel.select_one(pd.Series(["a", "b"] * 5000))
+    assert not selected["to"].isin(["t0", "t2", "t18"]).any()
+
+    # the weights of the remaining relations are still taken into account
+    assert set(selected["to"]) == {"t4", "t6", "t8", "t10", "t12", "t14", "t16"}
+
+    picks = rel.select_many(pd.Series(["a"]), named_as="T", quantities=[20])
+    assert sorted(picks.loc[0, "T"]) == sorted(
+        rel.get_relations(["a"])["to"].tolist())
+
+
+def test_csr_light_row_after_many_heavy_ones_should_keep_its_weights():
+
+    size = 200000
+    froms = np.append(np.repeat(np.arange(size // 20), 20), [size] * 3)
+    weights = np.append(np.full(size, 1000.), [1e-9, 1e-9, 2e-9])
+    rel = CsrRelationship.from_edges(seed=1, from_ids=froms,
+                                     to_ids=np.arange(size + 3),
+                                     weights=weights)
+
+    assert np.allclose(rel.cum_weights[-3:], [1e-9, 2e-9, 4e-9], rtol=1e-6, atol=0)
+    assert np.allclose(rel._cdf[-3:] - size // 20, [.25, .5, 1])
+
+    counts = rel.select_one(pd.Series([size] * 20000))["to"].value_counts()
+    assert 4500 < counts[size] < 5500
+    assert 4500 < counts[size + 1] < 5500
+    assert 9500 < counts[size + 2] < 10500
+
+
+def test_csr_relations_added_in_batches_should_be_stored_like_in_one_go():
+
+    state = np.random.RandomState(3)
+    froms = state.choice(["a", "b", "c", "d", "e", "f"], size=300)
+    tos = state.randint(50, size=300)
+    weights = state.uniform(size=300)
+
+    batched = CsrRelationship(seed=1)
+    for lower, upper in [(0, 10), (10, 100), (100, 101), (101, 300)]:
+        batched.add_relations(froms[lower:upper], tos[lower:upper],
+                              weights[lower:upper])
+        batched.get_neighbourhood_size(["a"])
+
+    at_once = CsrRelationship.from_edges(seed=1, from_ids=froms, to_ids=tos,
+                                         weights=weights)
+
+    assert batched.from_index.equals(at_once.from_index)
+    assert batched.offsets.tolist() == at_once.offsets.tolist()
+    assert batched.to_ids.tolist() == at_once.to_ids.tolist()
+    assert np.allclose(batched.weights, at_once.weights)
+    assert np.allclose(batched.cum_weights, at_once.cum_weights)
+    assert np.allclose(batched._cdf, at_once._cdf)
+    assert np.allclose(batched.live_weight_sums, at_once.live_weight_sums)
+    assert batched.live_degrees.tolist() == at_once.live_degrees.tolist()
+
+
+def test_csr_relations_added_after_removals_should_keep_the_removed_ones_out():
+
+    rel = build_csr()
+    rel.remove_relations(from_ids=["b", "c"], to_ids=["tb1", "tc2"])
+    rel.add_relations(from_ids=["b", "aa", "c"], to_ids=["tb3", "taa", "tc4"])
+
+    assert rel.get_relations().values.tolist() == [
+        ["a", "ta", 1.], ["aa", "taa", 1.], ["b", "tb2", 1.], ["b", "tb3", 1.],
+        ["c", "tc1", 1.], ["c", "tc3", 1.], ["c", "tc4", 1.]]
+    assert rel.get_neighbourhood_size(["a", "aa", "b", "c"]).tolist() == [1, 1, 2, 3]
+
+    selected = rel.select_one(pd.Series(["b", "c"] * 200))
+    assert set(selected["to"]) == {"tb2", "tb3", "tc1", "tc3", "tc4"}
+
+
+def test_csr_removing_most_relations_should_compact_the_storage():
+
+    rel = CsrRelationship(seed=1)
+    rel.add_relations(from_ids=["a"] * 4 + ["b"] * 6,
+                      to_ids=["t%d" % i for i in range(10)])
+
+    rel.select_many(pd.Series(["a", "b"]), named_as="T", quantities=[4, 2],
+                    remove_selected=True)
+
+    assert rel.to_ids.shape[0] == 4
+    assert rel.from_index.tolist() == ["b"]
+    assert rel.get_neighbourhood_size(["a", "b"]).tolist() == [0, 4]
+    assert rel.select_one(["a"]).shape[0] == 0
+
+
+def test_csr_restored_checkpoint_should_select_the_same_as_the_original():
+
+    rel = build_csr(seed=3)
+    rel.remove_relations(from_ids=["c"], to_ids=["tc2"])
+    state = rel.checkpoint_state()
+    random_state = rel.state.get_state()
+
+    requested = pd.Series(["a", "b", "c"] * 10)
+    expected = rel.select_one(requested, remove_selected=True)
+
+    rel.restore_state(state)
+    rel.state.set_state(random_state)
+    assert rel.select_one(requested, remove_selected=True).equals(expected)
+
+
+def test_csr_alias_tables_should_induce_the_exact_weights():
+
+    rel = CsrRelationship(seed=1).freeze()
+    rel.add_relations(from_ids=["a"] * 11 + ["b"] * 2 + ["c"] * 3,
+                      to_ids=["t%d" % i for i in range(16)],
+                      weights=[3.3, 1, 2, 0, 2, 1, 2, 0, 0, 0, 2, 1, 2, 0, 0, 0])
+    rel.select_one(["a"])
+
+    # each bucket keeps its own relation with probability _alias_prob and
+    # otherwise hands over to its alias, which must be in the same row
+    for row in range(3):
+        lo, hi = rel.offsets[row], rel.offsets[row + 1]
+        assert np.all((rel._alias[lo:hi] >= lo) & (rel._alias[lo:hi] < hi))
+
+        induced = np.zeros(rel.to_ids.shape[0])
+        np.add.at(induced, np.arange(lo, hi), rel._alias_prob[lo:hi])
+        np.add.at(induced, rel._alias[lo:hi], 1 - rel._alias_prob[lo:hi])
+
+        expected = rel.weights[lo:hi]
+        if expected.sum() == 0:
+            expected = np.ones(hi - lo)
+        assert np.allclose(induced[lo:hi] / (hi - lo), expected / expected.sum())
+
+
+def test_frozen_csr_select_one_should_follow_the_weights():
+
+    rel = CsrRelationship(seed=1).freeze()
+    rel.add_relations(from_ids=["a"] * 4, to_ids=["w", "x", "y", "z"],
+                      weights=[1, 2, 0, 7])
+
+    counts = rel.select_one(pd.Series(["a"] * 10000))["to"].value_counts()
+
+    assert "y" not in counts
+    assert 800 < counts["w"] < 1200
+    assert 1750 < counts["x"] < 2250
+    assert 6700 < counts["z"] < 7300
+
+
+def test_frozen_csr_should_rebuild_its_alias_tables_after_changes():
+
+    rel = CsrRelationship(seed=1).freeze()
+    rel.add_relations(from_ids=["a", "a"], to_ids=["x", "y"], weights=[1, 0])
+    assert set(rel.select_one(pd.Series(["a"] * 100))["to"]) == {"x"}
+
+    rel.add_relations(from_ids=["a"], to_ids=["z"], weights=[5])
+    assert set(rel.select_one(pd.Series(["a"] * 100))["to"]) == {"x", "z"}
+
+    rel.remove_relations(from_ids=["a"], to_ids=["z"])
+    assert set(rel.select_one(pd.Series(["a"] * 100))["to"]) == {"x"}
+
+    rel.select_one(pd.Series(["a"]), remove_selected=True)
+    assert set(rel.select_one(pd.Series(["a"] * 100))["to"]) == {"y"}
@@ -1,3 +1,4 @@
+import pytest
 import pandas as pd
 import numpy as np
 
@@ -581,3 +582,213 @@ def test_bugfix_force_populations_should_only_act_once():
     story.execute()
     assert recording_op.last_seen_population_ids == ["ac_0", "ac_2", "ac_4"]
     assert story.timer["remaining"].tolist() == [2, 0, 2, 0, 2, 2, 2, 3, 3, 3]
+
+
+def test_unknown_scheduler_should_be_refused():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+
+    with pytest.raises(ValueError):
+        Story(name="tested", initiating_population=population,
+              member_id_field="ac_id", scheduler="sundial")
+
+
+def test_calendar_story_autoreset_true_should_reset_all_timers():
+    # same as the countdown test above, with a calendar scheduler
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+
+    init_timers = pd.Series([2] * 5 + [1] * 5, index=population.ids)
+    timers_gen = MockTimerGenerator(init_timers)
+
+    story = Story(
+        name="tested",
+        initiating_population=population,
+        member_id_field="ac_id",
+        timer_gen=timers_gen,
+        auto_reset_timer=True,
+        scheduler="calendar"
+    )
+
+    recording_op = FakeRecording()
+    story.set_operations(recording_op)
+
+    assert story.remaining_timers().equals(init_timers)
+
+    story.execute()
+    assert recording_op.last_seen_population_ids == []
+    assert story.remaining_timers().equals(init_timers - 1)
+
+    story.execute()
+    assert recording_op.last_seen_population_ids == population.ids[5:].tolist()
+    expected_timers = pd.Series([0] * 5 + [1] * 5, index=population.ids)
+    assert story.remaining_timers().equals(expected_timers)
+
+
+def test_calendar_story_autoreset_false_should_reset_all_timers():
+    # same as the countdown test above, with a calendar scheduler
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+
+    init_timers = pd.Series([2] * 5 + [1] * 5, index=population.ids)
+    timers_gen = MockTimerGenerator(init_timers)
+
+    story = Story(
+        name="tested",
+        initiating_population=population,
+        member_id_field="ac_id",
+        timer_gen=timers_gen,
+        auto_reset_timer=False,
+        scheduler="calendar"
+    )
+
+    story.set_operations(MockDropOp(0, 2))
+
+    all_minus_1 = pd.Series([-1] * 10, index=population.ids)
+    assert story.remaining_timers().equals(all_minus_1)
+
+    story.execute()
+    assert story.remaining_timers().equals(all_minus_1)
+
+    story.reset_timers()
+    assert story.remaining_timers().equals(init_timers)
+
+    story.execute()
+    assert story.remaining_timers().equals(init_timers - 1)
+
+    story.execute()
+    expected_timers = pd.Series([0] * 5 + [-1] * 5, index=population.ids)
+    assert story.remaining_timers().equals(expected_timers)
+
+    story.execute()
+    assert story.remaining_timers().equals(all_minus_1)
+
+
+def test_calendar_force_populations_should_only_act_once():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+
+    init_timers = pd.Series([2] * 5 + [5] * 5, index=population.ids)
+    timers_gen = MockTimerGenerator(init_timers)
+
+    story = Story(
+        name="tested",
+        initiating_population=population,
+        member_id_field="ac_id",
+        timer_gen=timers_gen,
+        scheduler="calendar")
+
+    recording_op = FakeRecording()
+    story.set_operations(recording_op)
+
+    forced = pd.Index(["ac_1", "ac_3", "ac_7", "ac_8", "ac_9"])
+    story.force_act_next(forced)
+
+    # resetting the timers should not cancel the forced execution
+    story.reset_timers()
+    assert story.remaining_timers().tolist() == [2, 0, 2, 0, 2, 5, 5, 0, 0, 0]
+
+    story.execute()
+    assert recording_op.last_seen_population_ids == ["ac_1", "ac_3", "ac_7", "ac_8", "ac_9"]
+    assert story.remaining_timers().tolist() == [1, 2, 1, 2, 1, 4, 4, 5, 5, 5]
+    recording_op.reset()
+
+    story.execute()
+    assert recording_op.last_seen_population_ids == []
+    assert story.remaining_timers().tolist() == [0, 1, 0, 1, 0, 3, 3, 4, 4, 4]
+
+    story.execute()
+    assert recording_op.last_seen_population_ids == ["ac_0", "ac_2", "ac_4"]
+    assert story.remaining_timers().tolist() == [2, 0, 2, 0, 2, 2, 2, 3, 3, 3]
+
+
+def test_calendar_members_forcing_themselves_should_act_at_next_step():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+
+    init_timers = pd.Series([0] * 5 + [3] * 5, index=population.ids)
+
+    story = Story(
+        name="tested",
+        initiating_population=population,
+        member_id_field="ac_id",
+        timer_gen=MockTimerGenerator(init_timers),
+        scheduler="calendar")
+
+    recording_op = FakeRecording()
+    story.set_operations(
+        recording_op,
+        story.ops.force_act_next(member_id_field="ac_id"))
+
+    # members with a zero timer keep on re-executing at each step
+    for _ in range(3):
+        story.execute()
+        assert recording_op.last_seen_population_ids == population.ids[:5].tolist()
+
+
+def test_get_param_of_duplicated_ids_should_return_one_value_per_id():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+    story = Story(name="tested", initiating_population=population,
+                  member_id_field="",
+                  states={
+                      "excited": {
+                          "activity": ConstantGenerator(value=10),
+                          "back_to_default_probability": ConstantGenerator(value=.3)}
+                  })
+
+    story.transit_to_state(["ac_2"], ["excited"])
+
+    activity = story.get_param("activity", ["ac_2", "ac_1", "ac_2"])
+    assert activity.index.tolist() == ["ac_2", "ac_1", "ac_2"]
+    assert activity.tolist() == [10, 1, 10]
+
+
+def test_transiting_to_a_single_state_should_apply_it_to_all_ids():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+    story = Story(name="tested", initiating_population=population,
+                  member_id_field="",
+                  states={
+                      "excited": {
+                          "activity": ConstantGenerator(value=10),
+                          "back_to_default_probability": ConstantGenerator(value=.3)}
+                  })
+
+    story.transit_to_state(["ac_2", "ac_5"], "excited")
+    story.transit_to_state("ac_7", "excited")
+
+    assert story.get_param("activity", population.ids).tolist() == [
+        1, 1, 10, 1, 1, 10, 1, 10, 1, 1]
+
+
+def test_transiting_to_unknown_state_should_be_refused():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+    story = Story(name="tested", initiating_population=population,
+                  member_id_field="")
+
+    with pytest.raises(ValueError):
+        story.transit_to_state(["ac_2", "ac_5"], ["default", "sleepy"])
+
+    # nothing should have been updated
+    assert ["default"] * 10 == story.timer["state"].tolist()
+
+
+def test_get_param_of_unknown_ids_should_be_refused():
+
+    population = Population(circus=None, size=10,
+                            ids_gen=SequencialGenerator(prefix="ac_", max_length=1))
+    story = Story(name="tested", initiating_population=population,
+                  member_id_field="")
+
+    with pytest.raises(KeyError):
+        story.get_param("activity", ["ac_2", "not_a_member"])
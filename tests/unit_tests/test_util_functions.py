@@ -1,8 +1,9 @@
 import pandas as pd
 import functools
 
-from trumania.core.util_functions import merge_2_dicts, merge_dicts, is_sequence, make_random_assign, cap_to_total
+from trumania.core.util_functions import merge_2_dicts, merge_dicts, is_sequence, make_random_assign
 from trumania.core.util_functions import build_ids, latest_date_before, bipartite, make_random_bipartite_data
+from trumania.core.util_functions import to_value_array
 
 
 def test_merge_two_empty_dict_should_return_empty_dict():
@@ -108,26 +109,6 @@ def test_make_random_assign_shoud_assign_each_element_only_once():
     assert set(assignment["chosen_from_set2"].unique().tolist()) <= set(dealers)
 
 
-def test_cap_to_total_should_leave_untouched_values_below_target():
-    assert [10, 20, 30] == cap_to_total([10, 20, 30], target_total=100)
-
-
-def test_cap_to_total_should_leave_untouched_equal_to_target():
-    assert [50, 40, 20] == cap_to_total([50, 40, 20], target_total=110)
-
-
-def test_cap_to_total_should_lower_last_correctly():
-    assert [50, 40, 5] == cap_to_total([50, 40, 20], target_total=95)
-
-
-def test_cap_to_total_should_zero_last_correctly():
-    assert [50, 40, 0] == cap_to_total([50, 40, 20], target_total=90)
-
-
-def test_cap_to_total_should_zero_several_correctly():
-    assert [38, 0, 0] == cap_to_total([50, 40, 20], target_total=38)
-
-
 def test_latest_date_before_should_return_input_if_within_range():
 
     starting_date = pd.Timestamp("6 June 2016")
@@ -234,3 +215,11 @@ def test_random_bipartite_network_generation_returns_bipartite_network():
     bp = make_random_bipartite_data([1, 2], [5, 6], 1., 1234)
 
     assert functools.reduce(lambda x, y: x & y, [e in bp for e in all_edges])
+
+
+def test_to_value_array_should_only_type_numerical_values():
+
+    assert to_value_array([1, 2.5, True]).dtype == float
+    assert to_value_array([1, "a"]).tolist() == [1, "a"]
+    assert to_value_array([(1, 2), (3, 4)]).tolist() == [(1, 2), (3, 4)]
+    assert to_value_array([]).shape == (0,)
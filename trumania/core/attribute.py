@@ -89,6 +89,12 @@ class Attribute(object):
 
     ############
     # IO
+    def checkpoint_state(self):
+        return self._table.copy()
+
+    def restore_state(self, state):
+        self._table = state.copy()
+
     def save_to(self, file_path):
         logging.info("saving attribute to {}".format(file_path))
         self._table.to_csv(file_path)
@@ -1,6 +1,13 @@
+import datetime
+import functools
 import logging
+import numbers
 import os
 import json
+import pickle
+import random
+import types
+import numpy as np
 import pandas as pd
 
 from trumania.core import population
@@ -8,6 +15,8 @@ from trumania.components import db
 from trumania.core.random_generators import seed_provider
 from trumania.core.util_functions import ensure_non_existing_dir
 from trumania.core.clock import Clock
+from trumania.core.log_sinks import CsvSink
+from trumania.core.log_writer import BufferedLogWriter
 from trumania.core.story import Story
 
 
@@ -63,6 +72,10 @@ class Circus(object):
         loaded = db.load_population(namespace=namespace,
                                     population_id=population_id, circus=self)
         self.populations[population_id] = loaded
+
+        for pop in self.populations.values():
+            pop.link_relationships(self.populations)
+
         return loaded
 
     def create_story(self, name, **story_params):
@@ -128,24 +141,100 @@ class Circus(object):
         it does not exist or appending lines to it otherwise.
         """
 
-        output_file = os.path.join(log_output_folder, "{}.csv".format(log_id))
-
         if not os.path.exists(log_output_folder):
             os.makedirs(log_output_folder)
 
         if len(logs) > 0:
-            if not os.path.exists(output_file):
-                # If these are this first persisted logs, we create the file
-                # and include the field names as column header.
-                logs.to_csv(output_file, index=False, header=True)
+            CsvSink(log_output_folder).write(log_id, logs)
 
-            else:
-                # Otherwise, open the existing log file in append mode and add
-                # the new logs at the end, this time without columns headers.
-                with open(output_file, "a") as out_f:
-                    logs.to_csv(out_f, index=False, header=False)
+    def idle_steps(self, max_steps):
+        """
+        :return: the number of upcoming clock steps (at most max_steps)
+            during which no story has any member due
+        """
+        idle = max_steps
+        for story in self.stories:
+            until_next = story.steps_until_next_execution()
+            if until_next is not None:
+                idle = min(idle, until_next)
 
-    def run(self, duration, log_output_folder, delete_existing_logs=False):
+        return idle
+
+    def _steps(self, n_iterations, skip_idle_steps, step_number=0):
+        """
+        Executes all stories in the circus from step_number until
+        n_iterations, yielding the step number, its start date and the list
+        of (log_id, logs) produced by each executed step, after the clock
+        moved to the next step.
+        """
+
+        logging.info("Starting circus at step {} for {} iterations of {} for "
+                     "a total duration of {}".format(
+                        step_number, n_iterations, self.clock.step_duration,
+                        self.clock.step_duration * n_iterations
+                     ))
+
+        while step_number < n_iterations:
+
+            if skip_idle_steps:
+                idle = self.idle_steps(n_iterations - step_number)
+                if idle > 0:
+                    logging.info("skipping steps {} to {}".format(
+                        step_number, step_number + idle - 1))
+
+                    for story in self.stories:
+                        story.skip(idle)
+                    self.clock.increment(idle)
+                    step_number += idle
+                    continue
+
+            logging.info("step : {}".format(step_number))
+            step_date = self.clock.current_date
+
+            step_logs = [(log_id, logs)
+                         for story in self.stories
+                         for log_id, logs in story.execute().items()]
+
+            self.clock.increment()
+            step_number += 1
+
+            yield step_number - 1, step_date, step_logs
+
+    def run_iter(self, duration, skip_idle_steps=False):
+        """
+        Executes all stories in the circus for as long as requested, like
+        run(), though without writing any log: the logs of each step are
+        yielded instead, as soon as they are produced.
+
+        :param duration: duration of the desired simulation (start date is
+        dictated by the clock)
+        :type duration: pd.TimeDelta
+
+        :param skip_idle_steps: see run(). Skipped steps yield nothing.
+
+        :return: a generator of (step, timestamp, logs) tuples, one per
+        executed step, where timestamp is the start date of that step and
+        logs is a dictionary of log_id to the DataFrame of logs produced
+        during that step (concatenated if several stories use the same
+        log_id)
+        """
+
+        for step_number, step_date, step_logs in self._steps(
+                self.clock.n_iterations(duration), skip_idle_steps):
+
+            logs_by_id = {}
+            for log_id, logs in step_logs:
+                if log_id in logs_by_id:
+                    logs = pd.concat([logs_by_id[log_id], logs],
+                                     ignore_index=True)
+                logs_by_id[log_id] = logs
+
+            yield step_number, step_date, logs_by_id
+
+    def run(self, duration, log_output_folder=None, delete_existing_logs=False,
+            skip_idle_steps=False, max_buffered_log_rows=100000,
+            max_buffered_log_bytes=128 * 2**20, log_sink=None,
+            checkpoint_file=None, checkpoint_every=None):
         """
         Executes all stories in the circus for as long as requested.
 
@@ -153,34 +242,177 @@ class Circus(object):
         dictated by the clock)
         :type duration: pd.TimeDelta
 
-        :param log_output_folder: folder where to write the logs.
+        :param log_output_folder: folder where to write the logs as CSV
+        files. Exactly one of log_output_folder and log_sink must be
+        specified.
         :type log_output_folder: string
 
         :param delete_existing_logs:
+
+        :param skip_idle_steps: if True, the clock jumps directly over the
+        steps during which no story has any member due, instead of executing
+        all stories at every step. The produced logs are identical.
+        :type skip_idle_steps: bool
+
+        :param max_buffered_log_rows: the logs are kept in memory and
+        written to disk by a background thread as soon as that many rows
+        are buffered. All logs are written when this method returns, even
+        if the simulation fails.
+
+        :param max_buffered_log_bytes: same as max_buffered_log_rows, for
+        the memory used by the buffered logs
+
+        :param log_sink: LogSink receiving the logs, e.g. a ParquetSink. It
+        is closed at the end of the run.
+        :type log_sink: trumania.core.log_sinks.LogSink
+
+        :param checkpoint_file: file where to save a checkpoint of the run
+        every checkpoint_every steps, from which it can be continued with
+        resume() if it gets interrupted
+        :type checkpoint_file: string
+
+        :param checkpoint_every: number of steps between two checkpoints
+        :type checkpoint_every: int
         """
 
-        n_iterations = self.clock.n_iterations(duration)
-        logging.info("Starting circus for {} iterations of {} for a "
-                     "total duration of {}".format(
-                        n_iterations, self.clock.step_duration, duration
-                     ))
+        if (log_output_folder is None) == (log_sink is None):
+            raise ValueError("exactly one of log_output_folder and log_sink "
+                             "must be specified")
+
+        if (checkpoint_file is None) != (checkpoint_every is None):
+            raise ValueError("checkpoint_file and checkpoint_every must be "
+                             "specified together")
+
+        if checkpoint_every is not None and checkpoint_every <= 0:
+            raise ValueError("checkpoint_every must be strictly positive")
+
+        if log_sink is None:
+            if os.path.exists(log_output_folder):
+                if delete_existing_logs:
+                    ensure_non_existing_dir(log_output_folder)
+                else:
+                    raise EnvironmentError("{} exists and delete_existing_logs is "
+                                           "False => refusing to start and "
+                                           "overwrite logs".format(log_output_folder))
+
+            log_sink = CsvSink(log_output_folder)
+
+        # checked before any log is written rather than at the first
+        # checkpoint, partway through the run
+        if checkpoint_every is not None and not log_sink.supports_checkpoints():
+            raise ValueError("{} does not support checkpoints => cannot run "
+                             "with checkpoint_every".format(
+                                 type(log_sink).__name__))
+
+        run_params = {
+            "n_iterations": self.clock.n_iterations(duration),
+            "skip_idle_steps": skip_idle_steps,
+            "log_output_folder": log_output_folder,
+            "max_buffered_log_rows": max_buffered_log_rows,
+            "max_buffered_log_bytes": max_buffered_log_bytes,
+            "checkpoint_file": checkpoint_file,
+            "checkpoint_every": checkpoint_every,
+        }
 
-        if os.path.exists(log_output_folder):
-            if delete_existing_logs:
-                ensure_non_existing_dir(log_output_folder)
-            else:
-                raise EnvironmentError("{} exists and delete_existing_logs is "
-                                       "False => refusing to start and "
-                                       "overwrite logs".format(log_output_folder))
+        self._run(run_params, log_sink, step_number=0)
 
-        for step_number in range(n_iterations):
-            logging.info("step : {}".format(step_number))
+    def resume(self, checkpoint_file, log_sink=None):
+        """
+        Continues a run of this circus from a checkpoint saved during that
+        run (cf run()), producing exactly the same logs as if the run had
+        never been interrupted. Logs written after the checkpoint are
+        discarded first.
 
-            for story in self.stories:
-                for log_id, logs in story.execute().items():
-                    self.save_logs(log_id, logs, log_output_folder)
+        The stories, populations and generators themselves are not part of
+        the checkpoint, only their state is: this circus must be built
+        exactly like the interrupted one, typically by executing the same
+        building code with the same seeds.
 
-            self.clock.increment()
+        :param checkpoint_file: checkpoint saved during the interrupted run
+
+        :param log_sink: the LogSink of the interrupted run, if it was not
+        writing CSV files to a log_output_folder
+        """
+
+        logging.info("resuming circus {} from {}".format(
+            self.name, checkpoint_file))
+
+        with open(checkpoint_file, "rb") as checkpoint_h:
+            checkpoint = pickle.load(checkpoint_h)
+
+        run_params = checkpoint["run_params"]
+        if run_params["log_output_folder"] is not None:
+            log_sink = CsvSink(run_params["log_output_folder"])
+
+        elif log_sink is None:
+            raise ValueError("the checkpointed run was writing to a custom "
+                             "log sink => it must be provided")
+
+        components = _stateful_components(self)
+        if [_component_type(c) for c in components] != \
+                [comp_type for comp_type, _ in checkpoint["components"]]:
+            raise ValueError("this circus is not built like the one of {}, "
+                             "refusing to resume".format(checkpoint_file))
+
+        for component, (_, state) in zip(components, checkpoint["components"]):
+            _restore_state(component, state)
+
+        log_sink.restore_state(checkpoint["log_sink"])
+
+        self._run(run_params, log_sink, step_number=checkpoint["step"])
+
+    def _run(self, run_params, log_sink, step_number):
+
+        log_writer = BufferedLogWriter(
+            log_sink, max_buffered_rows=run_params["max_buffered_log_rows"],
+            max_buffered_bytes=run_params["max_buffered_log_bytes"])
+
+        checkpoint_every = run_params["checkpoint_every"]
+        if checkpoint_every is not None:
+            next_checkpoint = step_number + checkpoint_every
+
+        try:
+            for step_number, _, step_logs in self._steps(
+                    run_params["n_iterations"], run_params["skip_idle_steps"],
+                    step_number):
+
+                for log_id, logs in step_logs:
+                    log_writer.write(log_id, logs)
+
+                if checkpoint_every is not None and \
+                   step_number + 1 >= next_checkpoint:
+                    log_writer.sync()
+                    self._save_checkpoint(run_params, log_sink, step_number + 1)
+                    next_checkpoint = step_number + 1 + checkpoint_every
+
+        finally:
+            log_writer.close()
+
+    def _save_checkpoint(self, run_params, log_sink, step_number):
+        """
+        Saves the state of the run after step_number steps, replacing the
+        previous checkpoint only once the new one is completely written.
+        """
+
+        checkpoint_file = run_params["checkpoint_file"]
+        logging.info("saving checkpoint of step {} to {}".format(
+            step_number, checkpoint_file))
+
+        components = [(_component_type(c), _checkpoint_state(c))
+                      for c in _stateful_components(self)]
+
+        checkpoint = {
+            "step": step_number,
+            "run_params": run_params,
+            "components": components,
+            "log_sink": log_sink.checkpoint_state(),
+        }
+
+        tmp_file = checkpoint_file + ".tmp"
+        with open(tmp_file, "wb") as checkpoint_h:
+            pickle.dump(checkpoint, checkpoint_h,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, checkpoint_file)
 
     @staticmethod
     def load_from_db(circus_name):
@@ -278,3 +510,95 @@ class Circus(object):
 
     def __str__(self):
         return json.dumps(self.description(), indent=4)
+
+
+def _is_random_state(obj):
+    return isinstance(obj, (np.random.RandomState, random.Random))
+
+
+def _component_type(component):
+    return type(component).__name__
+
+
+def _checkpoint_state(component):
+    if isinstance(component, random.Random):
+        return component.getstate()
+    if isinstance(component, np.random.RandomState):
+        return component.get_state()
+    return component.checkpoint_state()
+
+
+def _restore_state(component, state):
+    if isinstance(component, random.Random):
+        component.setstate(state)
+    elif isinstance(component, np.random.RandomState):
+        component.set_state(state)
+    else:
+        component.restore_state(state)
+
+
+def _closure_values(function):
+    values = list(function.__defaults__ or [])
+    for cell in function.__closure__ or []:
+        try:
+            values.append(cell.cell_contents)
+        except ValueError:
+            # variable not assigned yet in the enclosing scope
+            pass
+    return values
+
+
+def _stateful_components(circus):
+    """
+    :return: all the random states and all the objects having a
+        checkpoint_state() method that are reachable from this circus,
+        including through the closures of the story operations, in an order
+        that only depends on how the circus was built. The attributes listed
+        in the cached_attributes of an object are not traversed, since they
+        are built lazily.
+    """
+
+    opaque = (str, bytes, numbers.Number, np.ndarray, np.generic,
+              pd.DataFrame, pd.Series, pd.Index, datetime.datetime,
+              datetime.date, datetime.timedelta, set, frozenset, type,
+              types.ModuleType, types.GeneratorType)
+
+    components = []
+    visited = set()
+    to_visit = [circus]
+
+    while to_visit:
+        obj = to_visit.pop()
+
+        if id(obj) in visited or obj is None or isinstance(obj, opaque):
+            continue
+        visited.add(id(obj))
+
+        if _is_random_state(obj):
+            components.append(obj)
+            continue
+
+        if callable(getattr(obj, "checkpoint_state", None)):
+            components.append(obj)
+
+        if isinstance(obj, dict):
+            children = list(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            children = list(obj)
+        elif isinstance(obj, types.FunctionType):
+            children = _closure_values(obj)
+        elif isinstance(obj, types.MethodType):
+            children = [obj.__self__, obj.__func__]
+        elif isinstance(obj, functools.partial):
+            children = [obj.func, obj.args, obj.keywords]
+        elif hasattr(obj, "__dict__"):
+            cached = getattr(obj, "cached_attributes", ())
+            children = [value for name, value in vars(obj).items()
+                        if name not in cached]
+        else:
+            children = []
+
+        # depth first, in declaration order
+        to_visit.extend(reversed(children))
+
+    return components
@@ -41,19 +41,34 @@ class Clock(object):
 
     def register_increment_listener(self, listener):
         """Add an object to be incremented at each step (such as a TimeProfiler)
+
+        The listener must have an increment(n_steps) method.
         """
         self.__increment_listeners.append(listener)
 
-    def increment(self):
-        """Increments the clock by 1 step
+    def increment(self, n_steps=1):
+        """Increments the clock by n_steps steps
+
+        :type n_steps: int
+        :param n_steps: number of steps to move forward, default 1
 
         :rtype: NoneType
         :return: None
         """
-        self.current_date += self.step_duration
+        self.current_date += self.step_duration * n_steps
 
         for listener in self.__increment_listeners:
-            listener.increment()
+            listener.increment(n_steps)
+
+    def checkpoint_state(self):
+        """
+        :return: the current date of this clock. Its random state and
+            listeners are checkpointed separately.
+        """
+        return self.current_date
+
+    def restore_state(self, state):
+        self.current_date = state
 
     def get_timestamp(self, size=1, random=True, log_format=None):
         """
@@ -186,19 +201,37 @@ class CyclicTimerGenerator(DependentGenerator):
         # makes sure we'll get notified when the clock goes forward
         clock.register_increment_listener(self)
 
-    def increment(self):
+    def increment(self, n_steps=1):
         """
-        Increment the time generator by 1 step.
+        Increment the time generator by n_steps steps.
 
-        This has as effect to move the cdf of one step to the left, decrease
-        all values by the value of the original first entry, and placing the
-        previous first entry at the end of the cdf, with value 1.
+        Each step has as effect to move the cdf of one step to the left,
+        decrease all values by the value of the original first entry, and
+        placing the previous first entry at the end of the cdf, with value 1.
+
+        The steps are replayed one by one on the bare cdf values (and not
+        computed in one go) s.t. the result is exactly the same as
+        incrementing n_steps times.
         """
 
-        self.profile["cdf"] -= self.profile["cdf"].iloc[0]
+        cdf = self.profile["cdf"].values
+        for _ in range(n_steps):
+            cdf = np.roll(cdf - cdf[0], -1)
+            cdf[-1] = 1
+
+        shift = n_steps % self.n_time_bin
+        self.profile = pd.concat([self.profile.iloc[shift:],
+                                  self.profile.iloc[:shift]])
+        self.profile["cdf"] = cdf
+
+    def checkpoint_state(self):
+        """
+        :return: a copy of the current (shifted) profile of this generator
+        """
+        return self.profile.copy()
 
-        self.profile = pd.concat([self.profile.iloc[1:], self.profile.iloc[:1]])
-        self.profile.loc[self.profile.index[-1], "cdf"] = 1
+    def restore_state(self, state):
+        self.profile = state.copy()
 
     def generate(self, observations):
         """Generate random waiting times, based on some observed activity
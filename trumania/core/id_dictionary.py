@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+
+class IdDictionary(object):
+    """
+    Append-only mapping between member ids and dense int32 codes: the n-th
+    distinct id added to the dictionary gets the code n.
+
+    Storing those codes instead of the ids themselves takes 4 bytes per
+    value instead of a pointer to a python string, and turns lookups by id
+    into array indexing. Since codes are never re-assigned, arrays of codes
+    stay valid while the dictionary grows.
+    """
+
+    def __init__(self, ids=None):
+        # ids in the order of their codes, in a buffer whose capacity is
+        # doubled when it is full s.t. adding ids does not copy all of them
+        self._ids = np.array([], dtype=object)
+        self._size = 0
+
+        # hash indices of consecutive ranges of codes, of decreasing sizes:
+        # an added range is merged with the previous ones as long as it is
+        # larger, s.t. each id is only re-hashed a logarithmic number of times
+        self._levels = []
+
+        if ids is not None:
+            self.add(ids)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def ids(self):
+        """
+        :return: all the ids of this dictionary, in the order of their codes
+        """
+        return self._ids[:self._size]
+
+    def add(self, ids):
+        """
+        Adds the ids that are not in this dictionary yet, keeping their order
+        of first appearance.
+        """
+        self.encode(ids, add=True)
+
+    def encode(self, ids, add=False):
+        """
+        :param add: whether the ids that are not in this dictionary yet
+            should be added to it. Otherwise, they get a code of -1.
+
+        :return: the codes of those ids, as an int32 array
+        """
+        ids = np.asarray(ids)
+        codes = np.full(ids.shape[0], -1, dtype=np.int64)
+
+        level_start = 0
+        for level in self._levels:
+            unknown = np.where(codes == -1)[0]
+            if unknown.shape[0] == 0:
+                break
+            found = level.get_indexer(ids[unknown])
+            codes[unknown] = np.where(found != -1, level_start + found, -1)
+            level_start += level.shape[0]
+
+        if add:
+            unknown = codes == -1
+            if np.any(unknown):
+                new_codes, new_ids = pd.factorize(ids[unknown])
+                codes[unknown] = len(self) + new_codes
+                self._append(pd.Index(new_ids))
+
+        return codes.astype(np.int32)
+
+    def _append(self, new_ids):
+        """
+        Appends those ids, which are not in this dictionary yet, after the
+        existing ones.
+        """
+        size = self._size + new_ids.shape[0]
+
+        # the first added ids set the type of the buffer, e.g. to keep
+        # numerical ids as such. It falls back to objects if mixed later on.
+        if self._size == 0:
+            dtype = new_ids.dtype
+        elif new_ids.dtype != self._ids.dtype:
+            dtype = object
+        else:
+            dtype = self._ids.dtype
+
+        if size > self._ids.shape[0] or dtype != self._ids.dtype:
+            buffer = np.empty(max(size, 2 * self._ids.shape[0]), dtype=dtype)
+            buffer[:self._size] = self.ids
+            self._ids = buffer
+
+        self._ids[self._size:size] = new_ids.values
+        self._size = size
+
+        self._levels.append(new_ids)
+        while len(self._levels) > 1 and self._levels[-1].shape[0] >= self._levels[-2].shape[0]:
+            last = self._levels.pop()
+            self._levels[-1] = self._levels[-1].append(last)
+
+    def decode(self, codes):
+        """
+        :return: the ids of those codes, which must all be valid
+        """
+        return self.ids[codes]
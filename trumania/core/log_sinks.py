@@ -0,0 +1,217 @@
+"""
+Destinations of the logs produced by the stories of a circus
+"""
+
+import os
+
+import pandas as pd
+
+# partition of the logs whose day field is NaT: the name Hive gives to the
+# partition of null values
+NULL_DAY_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+class LogSink(object):
+    """
+    Receives the logs of a circus run, one DataFrame at a time, always in
+    the order in which they have been produced.
+    """
+
+    def write(self, log_id, logs):
+        """
+        Appends those logs (never empty) to the output of this log_id
+        """
+        raise NotImplementedError("not implemented")
+
+    def close(self):
+        """
+        Called once all logs have been written
+        """
+        pass
+
+    def supports_checkpoints(self):
+        """
+        :return: whether this sink implements checkpoint_state() and
+            restore_state(), which are required to checkpoint a run
+        """
+        return type(self).checkpoint_state != LogSink.checkpoint_state
+
+    def checkpoint_state(self):
+        """
+        :return: the current position of the outputs of this sink, s.t.
+            restore_state() can discard anything written afterwards
+        """
+        raise NotImplementedError("{} does not support checkpoints".format(
+            type(self).__name__))
+
+    def restore_state(self, state):
+        raise NotImplementedError("{} does not support checkpoints".format(
+            type(self).__name__))
+
+
+class CsvSink(LogSink):
+    """
+    Appends the logs of each log_id to <output_folder>/<log_id>.csv
+    """
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+
+    def write(self, log_id, logs):
+        if not os.path.exists(self.output_folder):
+            os.makedirs(self.output_folder)
+
+        output_file = os.path.join(self.output_folder, "{}.csv".format(log_id))
+
+        if not os.path.exists(output_file):
+            # If these are this first persisted logs, we create the file
+            # and include the field names as column header.
+            logs.to_csv(output_file, index=False, header=True)
+
+        else:
+            with open(output_file, "a") as out_f:
+                logs.to_csv(out_f, index=False, header=False)
+
+    def _csv_files(self):
+        if not os.path.exists(self.output_folder):
+            return []
+        return [file_name for file_name in os.listdir(self.output_folder)
+                if file_name.endswith(".csv")]
+
+    def checkpoint_state(self):
+        """
+        :return: the size of each CSV file written so far
+        """
+        return {file_name: os.path.getsize(
+                    os.path.join(self.output_folder, file_name))
+                for file_name in self._csv_files()}
+
+    def restore_state(self, state):
+        """
+        Truncates the CSV files to their size at the time of the checkpoint,
+        removing the ones created afterwards.
+        """
+        for file_name in self._csv_files():
+            full_path = os.path.join(self.output_folder, file_name)
+            if file_name in state:
+                with open(full_path, "r+") as out_f:
+                    out_f.truncate(state[file_name])
+            else:
+                os.remove(full_path)
+
+
+class ParquetSink(LogSink):
+    """
+    Writes the logs of each log_id as row groups of a Parquet file,
+    <output_folder>/<log_id>.parquet
+
+    If day_field is specified, the logs are partitioned by the day of that
+    timestamp field instead, in one folder per day:
+    <output_folder>/<log_id>/day=<yyyy-mm-dd>/part-<n>.parquet
+    The logs whose timestamp is NaT go to the day=NULL_DAY_PARTITION folder.
+
+    Both layouts can be read back with pd.read_parquet() or load_all_logs().
+
+    This sink requires pyarrow.
+    """
+
+    def __init__(self, output_folder, schemas=None, day_field=None):
+        """
+        :param output_folder: folder where to write the logs
+
+        :param schemas: optional dictionary of log_id to pyarrow.Schema. The
+        logs of a log_id without schema are written with the types inferred
+        from its first logs.
+
+        :param day_field: optional name of the timestamp field to partition
+        the logs by
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("ParquetSink requires pyarrow, which can be "
+                              "installed with: pip install pyarrow")
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+
+        self.output_folder = output_folder
+        self.schemas = {} if schemas is None else dict(schemas)
+        self.day_field = day_field
+
+        # log_id -> {day: open ParquetWriter}, day being None if not partitioned
+        self.writers = {}
+
+        # (log_id, day) -> number of part files already created
+        self.parts = {}
+
+    def write(self, log_id, logs):
+        if log_id not in self.schemas:
+            self.schemas[log_id] = self.pa.Table.from_pandas(
+                logs, preserve_index=False).schema
+
+        schema = self.schemas[log_id]
+
+        # pyarrow expects the columns in the order of the schema
+        logs = logs[schema.names]
+
+        if self.day_field is None:
+            self._write_table(log_id, None, logs, schema)
+
+        else:
+            times = pd.to_datetime(logs[self.day_field])
+
+            # logs without timestamp are not dropped by the group by below
+            days = times.dt.strftime("%Y-%m-%d").where(
+                times.notnull(), NULL_DAY_PARTITION)
+
+            # logs are produced chronologically: only the writers of the days
+            # still being logged are kept open, any later logs of an older
+            # day going to a new part file
+            day_logs = logs.groupby(days.values, sort=True)
+            self._close_writers(log_id, keep=set(day_logs.groups.keys()))
+
+            for day, logs_of_day in day_logs:
+                self._write_table(log_id, day, logs_of_day, schema)
+
+    def close(self):
+        for log_id in list(self.writers.keys()):
+            self._close_writers(log_id, keep=set())
+
+    def _write_table(self, log_id, day, logs, schema):
+        writers = self.writers.setdefault(log_id, {})
+
+        if day not in writers:
+            writers[day] = self.pq.ParquetWriter(
+                self._new_file(log_id, day), schema)
+
+        table = self.pa.Table.from_pandas(logs, schema=schema,
+                                          preserve_index=False)
+        writers[day].write_table(table)
+
+    def _new_file(self, log_id, day):
+        if day is None:
+            if (log_id, day) in self.parts:
+                raise ValueError("{}.parquet has already been closed".format(
+                    log_id))
+            folder = self.output_folder
+            file_name = "{}.parquet".format(log_id)
+
+        else:
+            folder = os.path.join(self.output_folder, log_id,
+                                  "day={}".format(day))
+            file_name = "part-{}.parquet".format(self.parts.get((log_id, day), 0))
+
+        self.parts[(log_id, day)] = self.parts.get((log_id, day), 0) + 1
+
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        return os.path.join(folder, file_name)
+
+    def _close_writers(self, log_id, keep):
+        writers = self.writers.get(log_id, {})
+        for day in list(writers.keys()):
+            if day not in keep:
+                writers.pop(day).close()
@@ -0,0 +1,187 @@
+"""
+Buffered writing of the logs produced by the stories of a circus
+"""
+
+import logging
+import queue
+import threading
+
+import pandas as pd
+
+
+class BufferedLogWriter(object):
+    """
+    Accumulates the logs of each log_id in memory and hands them over in
+    large batches to a background thread that writes them to a LogSink,
+    s.t. the serialisation overlaps with the simulation.
+
+    Consecutive logs of a log_id are only concatenated if they have the same
+    columns and dtypes, so that a CsvSink produces files identical to the
+    ones obtained by appending every fragment as soon as it is produced.
+    """
+
+    def __init__(self, sink, max_buffered_rows=100000,
+                 max_buffered_bytes=128 * 2**20, max_pending_batches=16):
+        """
+        :param sink: the LogSink receiving the logs, closed together with
+        this writer
+
+        :param max_buffered_rows: total number of rows (across all log_ids)
+        above which the buffered logs are handed over to the background
+        writer
+
+        :param max_buffered_bytes: same as max_buffered_rows, for the
+        (shallow) memory usage of the buffered logs
+
+        :param max_pending_batches: maximum number of batches waiting to be
+        written. Above that, handing over more logs blocks until the
+        background writer catches up.
+        """
+        if max_buffered_rows <= 0 or max_buffered_bytes <= 0:
+            raise ValueError("buffering thresholds must be strictly positive")
+
+        if max_pending_batches <= 0:
+            raise ValueError("max_pending_batches must be strictly positive")
+
+        self.sink = sink
+        self.max_buffered_rows = max_buffered_rows
+        self.max_buffered_bytes = max_buffered_bytes
+
+        # log_id -> list of buffered log fragments, in production order
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+
+        self.pending = queue.Queue(maxsize=max_pending_batches)
+        self.error = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._consume,
+                                       name="trumania-log-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, log_id, logs):
+        """
+        Buffers those logs, to be appended to the output of this log_id
+        """
+        self._check_state()
+
+        if logs.shape[0] == 0:
+            return
+
+        self.buffers.setdefault(log_id, []).append(logs)
+        self.buffered_rows += logs.shape[0]
+        self.buffered_bytes += int(logs.memory_usage(index=False).sum())
+
+        if self.buffered_rows >= self.max_buffered_rows or \
+           self.buffered_bytes >= self.max_buffered_bytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands over all buffered logs to the background writer, blocking if
+        too many batches are already waiting to be written.
+        """
+        self._check_state()
+
+        for log_id, fragments in self.buffers.items():
+            self.pending.put((log_id, fragments))
+
+        self.buffers = {}
+        self.buffered_rows = 0
+        self.buffered_bytes = 0
+
+    def sync(self):
+        """
+        Flushes all buffered logs and waits until they are written.
+        """
+        self.flush()
+        self.pending.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Flushes all buffered logs, waits until they are written and closes
+        the sink.
+
+        Any error that occurred in the background writer is raised here.
+        Closing an already closed writer does nothing.
+        """
+        if self.closed:
+            return
+
+        try:
+            if self.error is None:
+                self.flush()
+        finally:
+            self.closed = True
+            self.pending.put(None)
+            self.thread.join()
+
+        try:
+            self._raise_error()
+        finally:
+            self.sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _check_state(self):
+        if self.closed:
+            raise ValueError("cannot write logs to a closed log writer")
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise IOError("failed to write logs") from self.error
+
+    def _consume(self):
+        while True:
+            batch = self.pending.get()
+            try:
+                if batch is None:
+                    return
+
+                # after a failure, the remaining batches are just drained
+                # s.t. the producer never blocks forever on a full queue
+                if self.error is None:
+                    try:
+                        log_id, fragments = batch
+                        for logs in _concat_compatible(fragments):
+                            self.sink.write(log_id, logs)
+                    except Exception as err:
+                        logging.exception("failed to write logs")
+                        self.error = err
+            finally:
+                self.pending.task_done()
+
+
+def _concat_compatible(fragments):
+    """
+    Concatenates each run of consecutive fragments having the same columns
+    and dtypes, which are the ones that render to CSV exactly as if they
+    were written one by one.
+    """
+
+    def signature(logs):
+        return tuple(zip(logs.columns, logs.dtypes))
+
+    run = [fragments[0]]
+    for logs in fragments[1:]:
+        if signature(logs) == signature(run[0]):
+            run.append(logs)
+        else:
+            yield _concat(run)
+            run = [logs]
+
+    yield _concat(run)
+
+
+def _concat(run):
+    if len(run) == 1:
+        return run[0]
+    return pd.concat(run, ignore_index=True, copy=False)
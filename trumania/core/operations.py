@@ -2,8 +2,7 @@ from scipy import stats
 from abc import ABCMeta, abstractmethod
 import pandas as pd
 import numpy as np
-from trumania.core.util_functions import merge_dicts, df_concat
-import functools
+from trumania.core.ragged import RaggedArray
 
 
 class Operation(object):
@@ -38,6 +37,34 @@ class Operation(object):
         return output, logs
 
 
+class LogAccumulator(object):
+    """
+    Collects the logs emitted by a sequence of operations as lists of
+    fragments per log_id, s.t. they are only concatenated once at the end
+    instead of after each operation.
+    """
+
+    def __init__(self):
+        self.fragments = {}
+
+    def add(self, logs):
+        """
+        :param logs: dictionary of {"log_id": some_data_frame}, as emitted by
+            an operation
+        """
+        for log_id, log in logs.items():
+            self.fragments.setdefault(log_id, []).append(log)
+
+    def result(self):
+        """
+        :return: all the accumulated logs as one dictionary of
+            {"log_id": some_data_frame}
+        """
+        return {log_id: fragments[0] if len(fragments) == 1
+                else pd.concat(fragments, ignore_index=True, copy=False)
+                for log_id, fragments in self.fragments.items()}
+
+
 class Chain(Operation):
     """
     A chain is a list of operation to be executed sequencially
@@ -52,24 +79,13 @@ class Chain(Operation):
         """
         self.operations += list(operations)
 
-    @staticmethod
-    def _execute_operation(story_data__prev_logs, operation):
-        """
-
-        executes this operation and merges its logs with the previous one
-        :param operation: the operation to call
-        :return: the merged story data and logs
-        """
-
-        (story_data, prev_logs) = story_data__prev_logs
-
-        output, supp_logs = operation(story_data)
-        # merging the logs of each operation of this story.
-        return output, merge_dicts([prev_logs, supp_logs], df_concat)
-
     def __call__(self, story_data):
-        init = [(story_data, {})]
-        return functools.reduce(self._execute_operation, init + self.operations)
+        logs = LogAccumulator()
+        for operation in self.operations:
+            story_data, supp_logs = operation(story_data)
+            logs.add(supp_logs)
+
+        return story_data, logs.result()
 
 
 class FieldLogger(Operation):
@@ -107,18 +123,12 @@ class FieldLogger(Operation):
 
         # explode lists, cf constructor documentation
         if self.exploded_cols:
+            exploded = RaggedArray.from_lists(story_data[self.exploded_cols[0]])
 
-            def explo(df):
-                explosion_len = len(df[self.exploded_cols[0]])
-                df2 = pd.DataFrame(
-                    [df.drop(self.exploded_cols) for _ in range(explosion_len)])
-                for col in self.exploded_cols:
-                    df2[col] = df[col]
-
-                return df2
-
-            logged_data = pd.concat(explo(row)
-                                    for _, row in story_data.iterrows())
+            logged_data = story_data.drop(self.exploded_cols, axis=1).iloc[
+                exploded.row_ids()].copy()
+            for col in self.exploded_cols:
+                logged_data[col] = RaggedArray.from_lists(story_data[col]).values
 
         else:
             logged_data = story_data
@@ -173,10 +183,52 @@ class AddColumns(Operation):
     def transform(self, story_data):
         output = self.build_output(story_data)
 #        logging.info("  adding column(s) {}".format(output.columns.tolist()))
+
+        joined = self._assign_columns(story_data, output)
+        if joined is not None:
+            return joined
+
         return pd.merge(left=story_data, right=output,
                         left_index=True, right_index=True,
                         how=self.join_kind)
 
+    def _assign_columns(self, story_data, output):
+        """
+        Fast path of the join above for the (very common) case where both
+        indices are unique and the new columns do not collide with existing
+        ones: the new columns are simply assigned to a shallow copy of
+        story_data, and an inner join is just a row mask, instead of going
+        through a full merge that copies the whole story_data.
+
+        :return: the joined dataframe, or None if the fast path is not
+            applicable
+        """
+
+        if self.join_kind not in ["left", "inner"] \
+                or not story_data.index.is_unique \
+                or not output.index.is_unique \
+                or len(story_data.columns.intersection(output.columns)) > 0:
+            return None
+
+        if output.index.equals(story_data.index):
+            # (shallow copy: the previous story_data might still be
+            # referenced, e.g. in some logs)
+            joined = story_data.copy(deep=False)
+
+        elif self.join_kind == "inner":
+            kept = story_data.index.isin(output.index)
+            joined = story_data[kept].copy(deep=False)
+            output = output.reindex(joined.index)
+
+        else:
+            joined = story_data.copy(deep=False)
+            output = output.reindex(joined.index)
+
+        for column in output.columns:
+            joined[column] = output[column].values
+
+        return joined
+
 
 class DropRow(Operation):
     """
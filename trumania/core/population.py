@@ -1,15 +1,26 @@
 import pandas as pd
+import json
 import logging
-import numpy as np
 import os
-import functools
 
 from trumania.core.operations import AddColumns, SideEffectOnly
-from trumania.core.relationship import Relationship
+from trumania.core.relationship import Relationship, CsrRelationship
 from trumania.core.attribute import Attribute
+from trumania.core.id_dictionary import IdDictionary
+from trumania.core.ragged import RaggedArray
 from trumania.core.util_functions import make_random_assign, ensure_non_existing_dir, is_sequence
 from trumania.core import random_generators
 
+RELATIONSHIP_STORAGES = {"grouped": Relationship, "csr": CsrRelationship}
+
+
+def _relationship_class(storage):
+    if storage not in RELATIONSHIP_STORAGES:
+        raise ValueError("unknown relationship storage: {}, expected one "
+                         "of {}".format(storage, sorted(RELATIONSHIP_STORAGES)))
+
+    return RELATIONSHIP_STORAGES[storage]
+
 
 class Population(object):
     def __init__(self, circus, ids_gen=None, size=None, ids=None):
@@ -42,26 +53,71 @@ class Population(object):
                                  "provided")
 
             self.size = size
+
+        # dense int codes of the member ids, built on first use
+        self._id_dictionary = None
+
+        # loaded csr relationships towards other populations, by name, whose
+        # id dictionary is not shared with them yet, see load_from()
+        self.unlinked_relationships = {}
         self.attributes = {}
         self.relationships = {}
 
         self.ops = self.PopulationOps(self)
 
-    def create_relationship(self, name, seed=None):
+    @property
+    def id_dictionary(self):
+        """
+        :return: the IdDictionary of the member ids of this population
+        """
+        if self._id_dictionary is None:
+            self._id_dictionary = IdDictionary(self.ids)
+        return self._id_dictionary
+
+    def create_relationship(self, name, seed=None, storage="grouped",
+                            to_population=None):
         """
         creates an empty relationship from the members of this population
+
+        :param storage: "grouped" (default) to create a Relationship, or
+            "csr" to create a CsrRelationship, whose selections are
+            vectorised
+
+        :param to_population: population the "to" side of the relationship
+            belongs to, if any. A "csr" relationship then stores its "to" ids
+            as codes of the id dictionary of that population, which are
+            shared with the other relationships towards it.
         """
 
         if name is self.relationships:
             raise ValueError("cannot create a second relationship with "
                              "existing name {}".format(name))
 
-        self.relationships[name] = Relationship(
-            seed=seed if seed else next(self.circus.seeder))
+        seed = seed if seed else next(self.circus.seeder)
+        if storage == "csr" and to_population is not None:
+            self.relationships[name] = CsrRelationship(
+                seed=seed, to_dictionary=to_population.id_dictionary)
+        else:
+            self.relationships[name] = _relationship_class(storage)(seed=seed)
+
+        return self.relationships[name]
+
+    def load_relationship(self, name, file_path, seed=None, storage="grouped"):
+        """
+        creates a relationship from the members of this population, with
+        all the edges stored in that .npz or .parquet file.
+
+        See Relationship.load_edges()
+        """
+
+        self.relationships[name] = _relationship_class(storage).load_edges(
+            seed=seed if seed else next(self.circus.seeder),
+            file_path=file_path)
 
         return self.relationships[name]
 
-    def create_stock_relationship(self, name, item_id_gen, n_items_per_member):
+    def create_stock_relationship(self, name, item_id_gen, n_items_per_member,
+                                  storage="grouped"):
         """
         Creates a relationship aimed at maintaining a stock, from a generator
         that create stock item ids.
@@ -71,7 +127,7 @@ class Population(object):
         """
 
         logging.info("generating initial {} stock".format(name))
-        rel_to_items = self.create_relationship(name=name)
+        rel_to_items = self.create_relationship(name=name, storage=storage)
 
         assigned_items = make_random_assign(
             set1=item_id_gen.generate(size=n_items_per_member * self.size),
@@ -82,14 +138,15 @@ class Population(object):
             from_ids=assigned_items["chosen_from_set2"],
             to_ids=assigned_items["set1"])
 
-    def create_stock_relationship_grp(self, name, stock_bulk_gen):
+    def create_stock_relationship_grp(self, name, stock_bulk_gen,
+                                      storage="grouped"):
         """
         This creates exactly the same kind of relationship as
         create_stock_relationship, but using a generator of list of stock
         items instead of a generators of items.
         """
 
-        stock_rel = self.create_relationship(name)
+        stock_rel = self.create_relationship(name, storage=storage)
         stock_rel.add_grouped_relations(
             from_ids=self.ids,
             grouped_ids=stock_bulk_gen.generate(size=self.size))
@@ -154,10 +211,22 @@ class Population(object):
 
         new_ids = values_dedup.index.difference(self.ids)
         self.ids = self.ids | new_ids
+        if self._id_dictionary is not None:
+            self._id_dictionary.add(new_ids)
 
         for att_name, values in values_dedup.items():
             self.get_attribute(att_name).update(values)
 
+    def checkpoint_state(self):
+        """
+        :return: the member ids of this population. Its attributes and
+            relationships are checkpointed separately.
+        """
+        return self.ids
+
+    def restore_state(self, state):
+        self.ids = state
+
     def to_dataframe(self):
         """
         :return: all the attributes of this population as one single dataframe
@@ -211,15 +280,54 @@ class Population(object):
             relationships_dir = os.path.join(target_folder, "relationships")
             os.mkdir(relationships_dir)
             for name, rel in self.relationships.items():
-                file_path = os.path.join(relationships_dir, name + ".csv")
-                rel.save_to(file_path)
+                rel.save_binary(os.path.join(relationships_dir, name))
+
+        links = self._relationship_links()
+        if len(links) > 0:
+            links_path = os.path.join(target_folder, "relationship_links.json")
+            with open(links_path, "w") as outf:
+                json.dump(links, outf, indent=4)
+
+    def _relationship_links(self):
+        """
+        :return: for each csr relationship whose "to" ids are encoded with
+            the id dictionary of a population, the name of that population in
+            the circus, or None if it is this one
+        """
+        names = {} if self.circus is None else {
+            id(population._id_dictionary): name
+            for name, population in self.circus.populations.items()
+            if population._id_dictionary is not None}
+
+        links = {}
+        for rel_name, rel in self.relationships.items():
+            to_dictionary = getattr(rel, "to_dictionary", None)
+            if to_dictionary is None:
+                continue
+            if to_dictionary is self._id_dictionary:
+                links[rel_name] = None
+            elif id(to_dictionary) in names:
+                links[rel_name] = names[id(to_dictionary)]
+
+        return links
+
+    def link_relationships(self, populations):
+        """
+        Shares the id dictionaries of those populations, by name, with the
+        loaded csr relationships towards them.
+        """
+        for rel_name, to_population in list(self.unlinked_relationships.items()):
+            if to_population in populations:
+                self.get_relationship(rel_name).share_to_dictionary(
+                    populations[to_population].id_dictionary)
+                del self.unlinked_relationships[rel_name]
 
     @staticmethod
     def load_from(folder, circus):
         """
         Reads all persistent data of this population and loads it
 
-        :param folder: folder containing all CSV files of this population
+        :param folder: folder containing all the files saved by save_to()
         :param circus: parent circus containing this population
         :return:
         """
@@ -237,11 +345,19 @@ class Population(object):
         else:
             attributes = {}
 
+        def load_relationship(path):
+            # populations saved before the binary format contain CSV files
+            if path.endswith(".csv"):
+                return Relationship.load_from(path)
+
+            storage = Relationship.binary_storage(path)
+            return _relationship_class(storage).load_binary(path)
+
         relationships_dir = os.path.join(folder, "relationships")
         if os.path.exists(relationships_dir):
             relationships = {
-                filename[:-4]:
-                Relationship.load_from(os.path.join(relationships_dir, filename))
+                os.path.splitext(filename)[0]:
+                load_relationship(os.path.join(relationships_dir, filename))
                 for filename in os.listdir(relationships_dir)
             }
         else:
@@ -253,6 +369,19 @@ class Population(object):
         population.ids = ids
         population.size = len(ids)
 
+        # the csr relationships sharing the id dictionary of a population are
+        # loaded with their own one: this one is linked right away, the other
+        # ones once their population is loaded in the circus
+        links_path = os.path.join(folder, "relationship_links.json")
+        if os.path.exists(links_path):
+            with open(links_path, "r") as inf:
+                for rel_name, to_population in json.load(inf).items():
+                    if to_population is None:
+                        relationships[rel_name].share_to_dictionary(
+                            population.id_dictionary)
+                    else:
+                        population.unlinked_relationships[rel_name] = to_population
+
         return population
 
     class PopulationOps(object):
@@ -300,25 +429,19 @@ class Population(object):
 
             def _lookup_by_sequences(self, story_data):
 
-                # pd.Series containing seq of ids to lookup
-                id_lists = story_data[self.id_field]
+                # all the sequences of ids to lookup, as one flat array
+                id_lists = RaggedArray.from_lists(story_data[self.id_field])
 
                 # unique member ids of the attribute to look up
-                member_ids = np.unique(
-                    functools.reduce(lambda l1, l2: l1 + l2, id_lists))
+                member_ids = pd.unique(id_lists.values)
 
                 output = pd.DataFrame(index=story_data.index)
                 for attribute, named_as in self.select_dict.items():
                     vals = self.population.get_attribute_values(attribute, member_ids)
 
-                    def attributes_of_ids(ids):
-                        """
-                        :param ids:
-                        :return: list of attribute values for those member ids
-                        """
-                        return vals.loc[ids].tolist()
-
-                    output[named_as] = id_lists.map(attributes_of_ids)
+                    looked_up = id_lists.with_values(vals.loc[id_lists.values])
+                    output[named_as] = pd.Series(looked_up.to_lists(),
+                                                 index=story_data.index)
 
                 return output
 
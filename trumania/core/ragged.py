@@ -0,0 +1,81 @@
+import itertools
+
+import numpy as np
+
+from trumania.core.util_functions import to_value_array
+
+
+class RaggedArray(object):
+    """
+    Sequence of rows of variable lengths, stored as one flat array of values
+    together with the offsets of each row in it: the values of the i-th row
+    are values[offsets[i]:offsets[i + 1]].
+
+    pandas cannot hold such a column natively, so list-valued columns of the
+    story_data stay python lists: operations convert them to (from_lists())
+    and from (to_lists()) a RaggedArray in order to process all their values
+    at once.
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    @staticmethod
+    def from_sizes(values, sizes):
+        """
+        :return: the RaggedArray whose consecutive rows have those sizes
+        """
+        sizes = np.asarray(sizes, dtype=np.int64)
+        return RaggedArray(np.asarray(values),
+                           np.append(0, np.cumsum(sizes)).astype(np.int64))
+
+    @staticmethod
+    def from_lists(lists):
+        """
+        :param lists: sequence of lists (or of any other iterables)
+        """
+        lists = list(lists)
+        sizes = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+
+        # anything else than numbers (strings, tuples, mixed types...) is
+        # kept as python objects, like in pandas
+        values = to_value_array(itertools.chain.from_iterable(lists))
+
+        return RaggedArray.from_sizes(values, sizes)
+
+    @property
+    def sizes(self):
+        return np.diff(self.offsets)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def row_ids(self):
+        """
+        :return: the row of each of the flat values
+        """
+        return np.repeat(np.arange(len(self)), self.sizes)
+
+    def with_values(self, values):
+        """
+        :return: a RaggedArray with the same rows, holding those other values
+        """
+        return RaggedArray(np.asarray(values), self.offsets)
+
+    def split(self):
+        """
+        :return: the rows, as a list of numpy arrays (which are views on the
+            flat values)
+        """
+        if len(self) == 0:
+            return []
+        return np.split(self.values, self.offsets[1:-1])
+
+    def to_lists(self):
+        """
+        :return: the rows, as a list of python lists
+        """
+        flat = self.values.tolist()
+        return [flat[lower:upper] for lower, upper in
+                zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())]
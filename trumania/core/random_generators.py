@@ -1,4 +1,3 @@
-from itertools import islice
 from faker import Faker
 from bson.objectid import ObjectId
 import json
@@ -9,7 +8,9 @@ import numpy as np
 from numpy.random import RandomState
 
 from trumania.core.operations import AddColumns, identity
-from trumania.core.util_functions import merge_2_dicts, build_ids
+from trumania.core.util_functions import merge_2_dicts, build_ids, \
+    to_value_array
+from trumania.core.ragged import RaggedArray
 
 
 def seed_provider(master_seed):
@@ -51,27 +52,13 @@ class Generator(object):
         Creates a new generator that transforms the generated values with the
         provided function.
 
-        # TODO: do we really need "non vectorialized" f and vectorialized
-        f_vect? Have a look at numpy ufunc...
-        """
-
-        assert (f is not None) ^ (f_vect is not None)
-        parent = self
-
-        class Transformed(Generator):
-            def generate(self, size):
-
-                samples = parent.generate(size=size)
-
-                if f_vect is not None:
-                    # makes sure the result type is array and not a Series
-                    # (which may cause index mis-alignments)
-                    return [i for i in f_vect(samples)]
-
-                elif f is not None:
-                    return [f(sample) for sample in samples]
+        :param f: function transforming one value at a time. numpy ufuncs
+            (e.g. np.sqrt) are applied to all the values at once, as f_vect.
 
-        return Transformed()
+        :param f_vect: function transforming the whole array of generated
+            values at once
+        """
+        return TransformedGenerator(self, f=f, f_vect=f_vect)
 
     def flatmap(self, dependent_generator):
         """
@@ -127,11 +114,12 @@ class Generator(object):
 
                 # otherwise, provides a columns with list of generated values
                 else:
-                    qties = story_data[self.quantity_field]
+                    qties = story_data[self.quantity_field].values.astype(int)
 
                     # slices groups of generated values of appropriate size
-                    flat_vals = iter(self.generator.generate(size=qties.sum()))
-                    values = [list(islice(flat_vals, size)) for size in qties]
+                    values = RaggedArray.from_sizes(
+                        self.generator.generate(size=qties.sum()),
+                        qties).to_lists()
 
                 return pd.DataFrame({self.named_as: values},
                                     index=story_data.index)
@@ -141,13 +129,111 @@ class Generator(object):
                                      quantity_field=quantity_field)
 
 
+def _as_array(values):
+    """
+    :return: those values as a 1-D numpy array, s.t. they are always assigned
+        positionally (a Series may cause index mis-alignments). Values other
+        than numbers and booleans, e.g. strings or lists, are kept as python
+        objects.
+    """
+    if isinstance(values, pd.Series):
+        return values.values
+
+    if isinstance(values, np.ndarray) and values.ndim == 1:
+        if values.dtype.kind in "US":
+            return values.astype(object)
+        return values
+
+    return to_value_array(values)
+
+
+def _vectorized(f=None, f_vect=None):
+    """
+    :return: the function transforming an array of values with exactly one
+        of f, applied to each value, or f_vect, applied to the whole array
+    """
+    if f is not None:
+        return lambda values: to_value_array(f(value) for value in values)
+    return f_vect
+
+
+class TransformedGenerator(Generator):
+    """
+    Generator transforming the values of a parent generator, see
+    Generator.map().
+
+    Mapping a TransformedGenerator fuses both transformations into a single
+    function applied to the values of the parent, s.t. chains of maps do not
+    build intermediary generators nor, as long as they transform one value at
+    a time, intermediary arrays.
+    """
+
+    def __init__(self, parent, f=None, f_vect=None):
+        Generator.__init__(self)
+        self.parent = parent
+
+        if isinstance(f, np.ufunc):
+            f, f_vect = None, f
+
+        assert (f is not None) ^ (f_vect is not None)
+        self.f = f
+        self.f_vect = f_vect
+
+    def map(self, f=None, f_vect=None):
+        if isinstance(f, np.ufunc):
+            f, f_vect = None, f
+        assert (f is not None) ^ (f_vect is not None)
+
+        if self.f is not None and f is not None:
+            first, then = self.f, f
+            return TransformedGenerator(self.parent,
+                                        f=lambda value: then(first(value)))
+
+        first = _vectorized(self.f, self.f_vect)
+        then = _vectorized(f, f_vect)
+
+        def fused(values):
+            return then(_as_array(first(values)))
+
+        return TransformedGenerator(self.parent, f_vect=fused)
+
+    def generate(self, size):
+        samples = self.parent.generate(size=size)
+        return _as_array(_vectorized(self.f, self.f_vect)(samples))
+
+
 class ConstantGenerator(Generator):
+    """
+    Generator always producing the same value.
+
+    The generated arrays are read-only views broadcasting that one value,
+    which take O(1) memory whatever their size. Callers that write into the
+    generated values must copy them first.
+    """
+
     def __init__(self, value):
         Generator.__init__(self)
         self.value = value
 
+        scalar = np.asarray(value)
+        if scalar.ndim != 0 or scalar.dtype.kind not in "biufcmM":
+            # strings, lists... are kept as python objects, like in pandas
+            scalar = np.empty((), dtype=object)
+            scalar[()] = value
+        self._scalar = scalar
+
     def generate(self, size):
-        return [self.value] * size
+        return np.broadcast_to(self._scalar, (int(size),))
+
+    def map(self, f=None, f_vect=None):
+        """
+        Mapping a constant with a numpy ufunc simply yields another constant.
+        Any other function is called for each generated value, like for any
+        generator, since it might not be pure.
+        """
+        if isinstance(f, np.ufunc):
+            return self.__class__(value=f(self.value))
+        return Generator.map(self, f=f, f_vect=f_vect)
 
 
 class NumpyRandomGenerator(Generator):
@@ -275,6 +361,12 @@ class SequencialGenerator(Generator):
         self.counter += size_i
         return values
 
+    def checkpoint_state(self):
+        return self.counter
+
+    def restore_state(self, state):
+        self.counter = state
+
     def description(self):
         return {
             "type": "SequencialGenerator",
@@ -464,7 +556,7 @@ class DependentGenerator(object):
 class ConstantDependentGenerator(ConstantGenerator, DependentGenerator):
     """
     Dependent generator ignoring the observations and producing a constant
-    value.
+    value. The generated Series wraps the read-only view of ConstantGenerator.
     """
 
     def __init__(self, value):
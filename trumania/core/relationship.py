@@ -1,11 +1,14 @@
-import functools
-import itertools
+import copy
+import json
 import logging
+import os
 
 import numpy as np
 import pandas as pd
 from numpy.random import RandomState
 from trumania.core import util_functions as utils
+from trumania.core.id_dictionary import IdDictionary
+from trumania.core.ragged import RaggedArray
 from trumania.core.operations import AddColumns, Operation, SideEffectOnly
 
 
@@ -16,6 +19,15 @@ from trumania.core.operations import AddColumns, Operation, SideEffectOnly
 # faster.
 
 
+# fraction of removed relations above which the storage of the relations is
+# compacted, i.e. above which the removed relations are actually discarded
+COMPACTION_THRESHOLD = .5
+
+# number of added relations that can be pending before they are merged into
+# the storage of a relationship, even if it is not read in the meantime
+PENDING_RELATIONS_THRESHOLD = 100000
+
+
 class Relations(object):
     """
      This entity contains all the "to" sides of the relationships of a given
@@ -24,15 +36,46 @@ class Relations(object):
      This data structure seems to be the most optimal since it corresponds to a cached
      group-by result, and those group-by are expensive in the select_one
      operation
+
+     Removing relations (e.g. popping items from a stock) does not reallocate
+     the arrays: removed relations are flagged in the "alive" bitmap and their
+     weight set to 0. They are only discarded once they make up more than
+     COMPACTION_THRESHOLD of the stored relations.
     """
 
     def __init__(self, to_ids, weights):
-        self.to_ids = np.array(to_ids)
-        self.weights = np.array(weights)
-        self.weights_normed = self.weights / self.weights.sum()
+        # no copy: those are typically slices of arrays owned by the
+        # Relationship, shared by the Relations of all its "from"
+        self._set(np.asarray(to_ids), np.asarray(weights))
+
+    def _set(self, to_ids, weights):
+        self._to_ids = to_ids
+        self._weights = weights
+        self.alive = np.ones(to_ids.shape[0], dtype=bool)
+        self.live_count = to_ids.shape[0]
+        self.weight_sum = weights.sum()
+
+    def _is_fragmented(self):
+        return self.live_count < self._to_ids.shape[0]
+
+    @property
+    def to_ids(self):
+        if self._is_fragmented():
+            return self._to_ids[self.alive]
+        return self._to_ids
+
+    @property
+    def weights(self):
+        if self._is_fragmented():
+            return self._weights[self.alive]
+        return self._weights
+
+    @property
+    def weights_normed(self):
+        return self.weights / self.weight_sum
 
     def __len__(self):
-        return self.to_ids.shape[0]
+        return self.live_count
 
     def __repr__(self):
         return """to_ids: {},\nweights:{},\nweights_normed:{}""".format(
@@ -46,27 +89,27 @@ class Relations(object):
          arrays.
 
          This methods builds one instance of Relations for each unique from_id
-         value, containing all the to_id's it is related to.
+         value, containing all the to_id's it is related to, in the order in
+         which they appear in to_ids.
+
+         The grouping is done with a couple of array operations: the only
+         python objects created are the Relations themselves.
         """
 
-        from_ids = np.array(from_ids)
-        to_ids = np.array(to_ids)
+        from_ids = _as_id_array(from_ids)
+        to_ids = np.asarray(to_ids)
 
         if type(weights) is int or type(weights) is float:
             weights = np.repeat(weights, from_ids.shape)
         else:
-            weights = np.array(weights)
+            weights = np.asarray(weights)
 
-        order = from_ids.argsort()
-        ordered = zip(from_ids[order], to_ids[order], weights[order])
-
-        def _relations():
-            # itertools.groupby is much faster than pandas
-            for from_id, tuples in itertools.groupby(ordered, lambda t: t[0]):
-                to_ids, weights = list(zip(*tuples))[1: 3]
-                yield from_id, Relations(list(to_ids), list(weights))
+        unique_froms, order, offsets = _group_by_from(from_ids)
+        to_ids, weights = to_ids[order], weights[order]
 
-        return {from_id: relz for from_id, relz in _relations()}
+        return {from_id: Relations(to_ids[lower:upper], weights[lower:upper])
+                for from_id, lower, upper in zip(unique_froms, offsets[:-1],
+                                                 offsets[1:])}
 
     def plus(self, other):
         """
@@ -76,89 +119,519 @@ class Relations(object):
             np.hstack([self.to_ids, other.to_ids]),
             np.hstack([self.weights, other.weights]))
 
-    def minus(self, other):
+    def remove_tos(self, to_ids):
         """
-        removes from self _all_ relations to the to_ids mentioned in the
-        provided other Relation
+        removes from self _all_ relations to any of those to_ids
         """
-        removed_indices = np.argwhere(
-            [idx in other.to_ids for idx in self.to_ids])
-        return Relations(
-            np.delete(self.to_ids, removed_indices),
-            np.delete(self.weights, removed_indices))
+        removed = pd.Series(self._to_ids).isin(to_ids).values
+        self.remove_inplace(np.where(removed)[0])
 
-    def pick_one(self, random_state, overridden_to_weights=None):
+    def pick_one(self, random_state):
         """
-        Randomly picks one of the to_ids of this Relation. By default this
-        uses the weights encapsulated in this Relation, unless
-        overridden_to_weights is specified.
+        Randomly picks one of the to_ids of this Relation, according to the
+        weights encapsulated in this Relation.
         """
 
-        if self.to_ids.shape[0] == 0:
+        if self.live_count == 0:
             return None, None
 
-        if self.to_ids.shape[0] == 1:
-            return 0, self.to_ids[0]
+        if self.live_count == 1:
+            idx = self.alive.argmax()
+            return idx, self._to_ids[idx]
 
-        if overridden_to_weights is None:
-            proba = self.weights_normed.astype(float)
-        else:
-            proba = np.array(
-                [overridden_to_weights[to] for to in self.to_ids]).astype(float)
-            proba = proba / proba.sum()
+        # removed relations have a weight of 0 => they are never picked, and
+        # the random draw is the same as the one of the compacted relations
+        proba = (self._weights / self.weight_sum).astype(float)
 
         idx = random_state.choice(
-            a=range(self.to_ids.shape[0]), size=1, p=proba)[0]
+            a=range(self._to_ids.shape[0]), size=1, p=proba)[0]
 
         # we do not remove values here, even if "pop=true", since some
         # picked selections might be discarded later in case of one-to-one
-        return idx, self.to_ids[idx]
+        return idx, self._to_ids[idx]
 
-    def pick_many(self, random_state, amount):
+    def remove_inplace(self, removed_indices):
         """
-        Quantities and req_indices should have the same size: the first
-        one lists the ids of the index that requests some selections
-        to be picked in the relationship, and the second provide
-        the quantities that each request asked.
-
-        The result will be in vertical format, with as many lines as the
-        sum of the quantities.
+        Removes the relations at those positions, as returned by pick_one()
+        or selected by Relationship.select_many()
         """
+        removed = np.unique(np.asarray(removed_indices, dtype=np.int64))
+        removed = removed[self.alive[removed]]
 
-        sample_size = min(self.to_ids.shape[0], amount)
+        self.live_count -= removed.shape[0]
+        self.weight_sum -= self._weights[removed].sum()
+        self.alive[removed] = False
+        self._weights[removed] = 0
 
-        # pick enough random index of "to_ids"
-        indices = random_state.choice(
-            a=range(self.to_ids.shape[0]),
-            replace=False,
-            size=sample_size
-        ).tolist()
+        removed_count = self._to_ids.shape[0] - self.live_count
+        if removed_count > COMPACTION_THRESHOLD * self._to_ids.shape[0]:
+            self._set(self.to_ids, self.weights)
 
-        return indices, self.to_ids[indices]
 
-    def remove_inplace(self, removed_indices):
-        self.to_ids = np.delete(self.to_ids, removed_indices)
-        self.weights = np.delete(self.weights, removed_indices)
-        self.weights_normed = np.delete(self.weights_normed, removed_indices)
-        self.weights_normed = self.weights / self.weights.sum()
+def _as_id_array(ids):
+    """
+    :return: those ids as a numpy array, strings being kept as python objects
+        like in pandas
+    """
+    ids = np.asarray(ids)
+    if ids.dtype.kind in "US":
+        return ids.astype(object)
+    return ids
+
+
+def _savable_ids(ids):
+    """
+    :return: those ids as an array that np.save() can store without pickling:
+        python strings are converted to a fixed-width unicode dtype, and
+        numbers stored as python objects to their numpy type. Other ids are
+        refused.
+    """
+    ids = np.asarray(ids)
+    if ids.dtype != object:
+        return ids
+
+    kind = pd.api.types.infer_dtype(ids)
+    if kind in ("string", "unicode", "empty"):
+        return ids.astype(str)
+    if kind in ("integer", "floating"):
+        return np.array(ids.tolist())
+
+    raise ValueError("cannot save ids of type {} without pickling them: "
+                     "expecting strings or numbers".format(kind))
+
+
+def _concat_ids(ids_list):
+    if len({ids.dtype for ids in ids_list}) > 1:
+        return np.concatenate([ids.astype(object) for ids in ids_list])
+    return np.concatenate(ids_list)
+
+
+def _resolve_to_weights(overridden_to_weights, to_ids, alive):
+    """
+    :return: the weights of overridden_to_weights aligned with to_ids,
+        resolved with one vectorised lookup in its index. Removed relations
+        do not need any weight and get a weight of 0.
+    """
+    weights = np.zeros(to_ids.shape[0])
+
+    codes = overridden_to_weights.index.get_indexer(to_ids[alive])
+    missing = codes == -1
+    assert not np.any(missing), \
+        "overridden_to_weights is missing those 'to' keys: {}".format(
+            set(pd.unique(to_ids[alive][missing])))
+
+    weights[alive] = overridden_to_weights.values[codes]
+    return weights
+
+
+def _group_by_from(from_ids):
+    """
+    :return: the sorted unique values of from_ids, the order that brings
+        together the positions of each of them while keeping their relative
+        order, and the offsets of each group in that order
+    """
+    # hashing then sorting the unique values only is much faster than
+    # sorting all the from ids, in particular when those are strings
+    codes, unique_froms = pd.factorize(from_ids, sort=True)
+
+    # sort keys are unique => the default sort is stable here, and faster
+    # than mergesort
+    codes = codes.astype(np.int64)
+    order = np.argsort(codes * codes.shape[0] + np.arange(codes.shape[0]))
+    sizes = np.bincount(codes, minlength=unique_froms.shape[0])
+
+    return (np.asarray(unique_froms), order,
+            np.append(0, np.cumsum(sizes)).astype(np.int64))
+
+
+def _segmented_cumsum(values, value_rows):
+    """
+    :return: the sum of the values preceding each value, restarting (at
+        exactly 0) at each new value of value_rows, which must be sorted
+    """
+    if values.shape[0] == 0:
+        return values
+
+    cum_values = np.cumsum(values) - values
+    starts = np.where(np.append(True, value_rows[1:] != value_rows[:-1]))[0]
+    lengths = np.diff(np.append(starts, values.shape[0]))
+    return cum_values - np.repeat(cum_values[starts], lengths)
+
+
+def _row_cdf(row_weights, alive, sizes):
+    """
+    :param row_weights: weights of the relations of consecutive rows of those
+        sizes (each row having at least one relation)
+    :param alive: whether each of those relations is not removed
+
+    :return: the cumulative weights of the relations within each row, and
+        the cdf of each row. Removed relations get a weight of 0 and rows
+        whose weights are all 0 are given uniform weights.
+    """
+    starts = np.cumsum(sizes) - sizes
+    row_weights = np.where(alive, row_weights, 0)
+
+    row_sums = np.add.reduceat(row_weights, starts)
+    unweighted = np.repeat(row_sums == 0, sizes)
+
+    # the weights are normalized within their row before being cumulated
+    # over all the rows: each row then adds about 1 to the running sum,
+    # whose offset at the start of a row can be subtracted without losing
+    # the weights of rows that are much lighter than the previous ones
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normed = row_weights / np.repeat(row_sums, sizes)
+    normed[unweighted] = 0
+    running = np.cumsum(normed)
+    cdf = running - np.repeat(running[starts] - normed[starts], sizes)
+    cum_weights = cdf * np.repeat(row_sums, sizes)
+
+    if np.any(unweighted):
+        live_rank = np.cumsum(alive)
+        live_rank = live_rank - np.repeat(live_rank[starts] - alive[starts],
+                                          sizes)
+        degrees = live_rank[starts + sizes - 1]
+        uniform_cdf = live_rank / np.repeat(np.maximum(degrees, 1), sizes)
+        cdf[unweighted] = uniform_cdf[unweighted]
+
+    return cum_weights, cdf
+
+
+def _draw_positions(random_state, cdf_keys, alive, rows, lowers, uppers):
+    """
+    Randomly picks one relation in each of those rows, with one single
+    uniform draw per row
+
+    :param cdf_keys: concatenated cdf of the rows, in which the cdf of row i
+        spans ]i, i + 1]
+    :param alive: whether each relation of cdf_keys is not removed
+    :param lowers: position in cdf_keys of the first relation of each row
+    :param uppers: position in cdf_keys after the last relation of each row
+
+    :return: the selected positions in cdf_keys
+    """
+    draws = rows + random_state.uniform(size=rows.shape[0])
+    positions = np.searchsorted(cdf_keys, draws, side="right")
+
+    # protects against rounding errors at the upper end of each row
+    positions = np.clip(positions, lowers, uppers - 1)
+
+    # ... which, at the end of a row, might land on removed relations
+    removed = ~alive[positions]
+    if np.any(removed):
+        live_positions = np.where(alive)[0]
+        positions[removed] = live_positions[np.searchsorted(
+            live_positions, positions[removed], side="right") - 1]
+
+    return positions
+
+
+def _injective_positions(random_state, weights, alive, to_codes, sizes,
+                         rows):
+    """
+    Randomly picks one relation for each request of those rows, s.t. no "to"
+    is picked by more than one request.
+
+    This is resolved in rounds: each pending request draws one of the
+    relations of its row whose "to" is still available, one random request
+    among the ones that drew the same "to" gets it, and the others draw again
+    in the next round. Each round assigns at least one "to", and requests
+    whose row has no available "to" left are abandoned.
+
+    :param weights: weights of the relations of consecutive rows of those
+        sizes
+    :param alive: whether each of those relations is not removed
+    :param to_codes: integer code of the "to" of each of those relations
+    :param rows: row of each request
+
+    :return: the position of the relation picked for each request, or -1
+    """
+    positions = np.full(rows.shape[0], -1, dtype=np.int64)
+    if rows.shape[0] == 0:
+        return positions
+
+    lowers = np.cumsum(sizes) - sizes
+    taken = np.zeros(to_codes.max() + 1, dtype=bool)
+    pending = np.arange(rows.shape[0])
+
+    while True:
+        available = alive & ~taken[to_codes]
+        pending = pending[np.add.reduceat(available, lowers)[rows[pending]] > 0]
+        if pending.shape[0] == 0:
+            return positions
+
+        # only the rows that still have pending requests are re-drawn from
+        pending_rows, row_idx = np.unique(rows[pending], return_inverse=True)
+        row_sizes = sizes[pending_rows]
+        row_lowers = np.cumsum(row_sizes) - row_sizes
+        candidates = np.arange(row_sizes.sum()) + np.repeat(
+            lowers[pending_rows] - row_lowers, row_sizes)
+
+        _, cdf = _row_cdf(weights[candidates], available[candidates],
+                          row_sizes)
+        drawn = candidates[_draw_positions(
+            random_state,
+            cdf_keys=np.repeat(np.arange(pending_rows.shape[0]), row_sizes) + cdf,
+            alive=available[candidates], rows=row_idx,
+            lowers=row_lowers[row_idx],
+            uppers=row_lowers[row_idx] + row_sizes[row_idx])]
+
+        # each drawn "to" goes to one random request among the ones that drew
+        # it: the first one of a random permutation to claim it
+        drawn_codes = to_codes[drawn]
+        permutation = random_state.permutation(pending.shape[0])
+        _, first_claims = np.unique(drawn_codes[permutation], return_index=True)
+        won = np.zeros(pending.shape[0], dtype=bool)
+        won[permutation[first_claims]] = True
+
+        positions[pending[won]] = drawn[won]
+        taken[drawn_codes[won]] = True
+        pending = pending[~won]
+
+
+def _last_preceding(anchor_rows, anchor_values, query_rows, query_values,
+                    anchors_first):
+    """
+    Anchors and queries are sorted by row, then by value.
+
+    :param anchors_first: whether an anchor with the same value as a query
+        precedes it
+
+    :return: the index of the last anchor that precedes each query within its
+        row, or -1 if there is none
+    """
+    n_anchors = anchor_rows.shape[0]
+    is_query = np.append(np.zeros(n_anchors, dtype=bool),
+                         np.ones(query_rows.shape[0], dtype=bool))
+
+    order = np.lexsort((is_query if anchors_first else ~is_query,
+                        np.append(anchor_values, query_values),
+                        np.append(anchor_rows, query_rows)))
+
+    last_anchors = np.maximum.accumulate(
+        np.where(is_query[order], -1, order))[is_query[order]]
+
+    preceding = np.full(query_rows.shape[0], -1, dtype=np.int64)
+    preceding[order[is_query[order]] - n_anchors] = last_anchors
+
+    found = preceding != -1
+    found[found] = anchor_rows[preceding[found]] == query_rows[found]
+    preceding[~found] = -1
+    return preceding
 
 
 class Relationship(object):
+
+    # name of this storage in the binary format, see save_binary()
+    storage = "grouped"
+
+    # caches derived from the relations, which are not part of the state of
+    # this relationship and are left out of the circus checkpoints
+    cached_attributes = ("_reverse", "_degree_froms", "_degrees",
+                         "_weight_sums")
+
     def __init__(self, seed):
         self.seed = seed
         self.state = RandomState(self.seed)
-        self.grouped = {}
+        self._grouped = {}
+        self._pending = []
+        self._pending_size = 0
+        self._drop_degrees()
+        self._drop_reverse_index()
         self.ops = self.RelationshipOps(self)
 
+    @property
+    def grouped(self):
+        """
+        :return: the Relations of each "from", once all the pending
+            relations are merged into them
+        """
+        self._merge_pending()
+        return self._grouped
+
+    @grouped.setter
+    def grouped(self, grouped):
+        self._grouped = grouped
+        self._pending = []
+        self._pending_size = 0
+        self._drop_degrees()
+        self._drop_reverse_index()
+
+    def _drop_degrees(self):
+        self._degree_froms = None
+        self._degrees = None
+        self._weight_sums = None
+
+    def _build_degrees(self):
+        """
+        Caches the number of relations and the sum of the weights of each
+        "from" in 2 arrays indexed by the codes of the "from" in
+        _degree_froms. Those are then kept up to date by _refresh_degrees().
+        """
+        grouped = self.grouped
+        self._degree_froms = IdDictionary(list(grouped.keys()))
+        self._degrees = np.array([len(r) for r in grouped.values()],
+                                 dtype=np.int64)
+        self._weight_sums = np.array([r.weight_sum for r in grouped.values()],
+                                     dtype=float)
+
+    def _refresh_degrees(self, from_ids):
+        """
+        Updates the cached degrees and weight sums of those from_ids, after
+        their relations were changed.
+        """
+        self._drop_reverse_index()
+        if self._degree_froms is None:
+            return
+
+        from_ids = pd.unique(np.asarray(list(from_ids)))
+        codes = self._degree_froms.encode(from_ids, add=True)
+
+        n_froms = len(self._degree_froms)
+        if n_froms > self._degrees.shape[0]:
+            missing = n_froms - self._degrees.shape[0]
+            self._degrees = np.append(self._degrees, np.zeros(missing, np.int64))
+            self._weight_sums = np.append(self._weight_sums, np.zeros(missing))
+
+        relations = [self._grouped.get(from_id) for from_id in from_ids]
+        self._degrees[codes] = [0 if r is None else len(r) for r in relations]
+        self._weight_sums[codes] = [0 if r is None else r.weight_sum
+                                    for r in relations]
+
+    def _gather(self, values, from_ids):
+        codes = self._degree_froms.encode(from_ids)
+        gathered = np.zeros(codes.shape[0], dtype=values.dtype)
+        gathered[codes != -1] = values[codes[codes != -1]]
+        return gathered
+
+    def get_degrees(self, from_ids):
+        """
+        :return: the number of relations of each of those from_ids, as an
+            array aligned with them
+        """
+        if self._degree_froms is None:
+            self._build_degrees()
+        else:
+            self._merge_pending()
+        return self._gather(self._degrees, from_ids)
+
+    def get_weight_sums(self, from_ids):
+        """
+        :return: the sum of the weights of the relations of each of those
+            from_ids, as an array aligned with them
+        """
+        if self._degree_froms is None:
+            self._build_degrees()
+        else:
+            self._merge_pending()
+        return self._gather(self._weight_sums, from_ids)
+
+    def _drop_reverse_index(self):
+        self._reverse = None
+
+    def _reverse_index(self):
+        """
+        :return: the relations of this relationship from their "to" to their
+            "from" side, with the same weights, as a CsrRelationship sharing
+            the random state of this one. It is built at its first use after
+            each change of the relations.
+        """
+        self._merge_pending()
+        if self._reverse is None:
+            from_ids, to_ids, weights = self.get_relation_arrays()
+            self._reverse = CsrRelationship.from_edges(
+                seed=self.seed, from_ids=to_ids, to_ids=from_ids,
+                weights=weights)
+
+        self._reverse.state = self.state
+        return self._reverse
+
+    def get_reverse_degrees(self, to_ids):
+        """
+        :return: the number of relations towards each of those to_ids, as an
+            array aligned with them
+        """
+        return self._reverse_index().get_degrees(to_ids)
+
+    def get_reverse_neighbourhood_size(self, to_ids):
+        """
+        :return: the number of relations towards each of those to_ids, as a
+            Series indexed by the unique to_ids
+        """
+        return self._reverse_index().get_neighbourhood_size(to_ids)
+
+    def select_one_reverse(self, to_ids, named_as="from", discard_empty=True):
+        """
+        Randomly selects one "from" among the ones related to each specified
+        id in to_ids, with probabilities proportional to the weights of those
+        relations. This goes through the reverse index of this relationship,
+        instead of scanning all its relations.
+
+        :return: a dataframe with the index of to_ids, their values in a "to"
+            column and the selected "from" in a named_as column. See
+            select_one() for discard_empty.
+        """
+        selected = self._reverse_index().select_one(
+            from_ids=to_ids, named_as=named_as, discard_empty=discard_empty)
+        return selected.rename(columns={"from": "to"})
+
+    def _append_pending(self, from_ids, to_ids, weights):
+        """
+        Buffers those relations until the relationship is read, or until
+        more than PENDING_RELATIONS_THRESHOLD relations are pending.
+        """
+        if from_ids.shape[0] > 0:
+            self._pending.append((from_ids, to_ids, weights))
+            self._pending_size += from_ids.shape[0]
+
+            if self._pending_size >= PENDING_RELATIONS_THRESHOLD:
+                self._merge_pending()
+
+    def _merge_pending(self):
+        if self._pending_size == 0:
+            return
+
+        from_ids, to_ids, weights = zip(*self._pending)
+        self._pending = []
+        self._pending_size = 0
+
+        self._insert(from_ids=_concat_ids(from_ids),
+                     to_ids=_concat_ids(to_ids),
+                     weights=np.concatenate(weights))
+
+    def _insert(self, from_ids, to_ids, weights):
+        """
+        Merges those relations into the storage, after the existing
+        relations of each "from", in the order in which they were added.
+        """
+        inserted = Relations.from_tuples(from_ids, to_ids, weights)
+        for from_id, relations in inserted.items():
+
+            if from_id in self._grouped:
+                self._grouped[from_id] = self._grouped[from_id].plus(relations)
+            else:
+                self._grouped[from_id] = relations
+
+        self._refresh_degrees(inserted.keys())
+
     def add_relations(self, from_ids, to_ids, weights=1):
         """
         Add relations to this Relationships from from_ids, to_ids, weights
+
+        Those are buffered and only merged into the relationship when it is
+        next read, s.t. adding relations many times in a row is not more
+        expensive than adding them all at once.
         """
 
-        self.grouped = utils.merge_2_dicts(
-            self.grouped,
-            Relations.from_tuples(from_ids, to_ids, weights),
-            lambda r1, r2: r1.plus(r2))
+        from_ids = _as_id_array(from_ids)
+        to_ids = np.array(to_ids)
+
+        if type(weights) is int or type(weights) is float:
+            weights = np.repeat(weights, from_ids.shape)
+        else:
+            weights = np.array(weights)
+
+        order = from_ids.argsort()
+        self._append_pending(from_ids[order], to_ids[order], weights[order])
 
     def add_grouped_relations(self, from_ids, grouped_ids):
         """
@@ -172,9 +645,15 @@ class Relationship(object):
         Note: we assume all weights are 1 for this use (for now
         """
 
-        for one_from, many_tos in zip(from_ids, grouped_ids):
-            rels = pd.DataFrame({"from": one_from, "to": many_tos})
-            self.add_relations(from_ids=rels["from"], to_ids=rels["to"])
+        grouped_ids = list(grouped_ids)
+        sizes = [len(tos) for tos in grouped_ids]
+
+        if np.sum(sizes) > 0:
+            self._append_pending(
+                from_ids=np.repeat(_as_id_array(from_ids), sizes),
+                to_ids=_as_id_array(np.concatenate(
+                    [np.asarray(tos) for tos in grouped_ids])),
+                weights=np.ones(np.sum(sizes)))
 
     def remove_relations(self, from_ids, to_ids):
         """
@@ -183,10 +662,40 @@ class Relationship(object):
         If the same relation was stored several times between two ids, this removes them all
         """
 
-        self.grouped = utils.merge_2_dicts(
-            self.grouped,
-            Relations.from_tuples(from_ids, to_ids, weights=0),
-            lambda r1, r2: r1.minus(r2))
+        removed = pd.Series(np.asarray(to_ids), index=np.asarray(from_ids))
+        touched = []
+        for from_id, removed_tos in removed.groupby(level=0, sort=False):
+            if from_id in self.grouped:
+                relations = self.grouped[from_id]
+                relations.remove_tos(removed_tos.values)
+                if len(relations) == 0:
+                    del self.grouped[from_id]
+                touched.append(from_id)
+
+        self._refresh_degrees(touched)
+
+    def _from_ids(self):
+        """
+        :return: all the "from" ids of this relationship, in the order of
+            get_relations()
+        """
+        return utils.to_value_array(self.grouped.keys())
+
+    def get_relation_arrays(self, from_ids=None):
+        """
+        Columnar version of get_relations(): the from ids, to ids and
+        weights of the relations of the specified "from_ids" (or of all the
+        relations if None), as 3 aligned typed arrays.
+        """
+        if from_ids is None:
+            from_ids = self._from_ids()
+        else:
+            from_ids = _as_id_array(pd.unique(np.asarray(from_ids)))
+
+        to_ids, weights, alive, sizes, rows = self._flat_relations(from_ids)
+        found_froms = np.repeat(from_ids[rows != -1], sizes)
+
+        return found_froms[alive], to_ids[alive], weights[alive]
 
     def get_relations(self, from_ids=None):
         """
@@ -194,27 +703,31 @@ class Relationship(object):
         "from" is part of specified "from_ids".
 
         If no from_ids is provided, this just returns all the relations.
-        """
-
-        _from_ids = set(self.grouped.keys()) if from_ids is None else from_ids
 
-        def _rel_arrays():
-            for gid in set(_from_ids):
-                if gid in self.grouped.keys():
-                    relations = self.grouped[gid]
-                    yield np.array([np.array([gid] * relations.to_ids.shape[0]),
-                                    relations.to_ids,
-                                    relations.weights])
+        The relations of each "from" are contiguous, the "from" being in the
+        order of their first appearance in from_ids.
+        """
+        from_ids, to_ids, weights = self.get_relation_arrays(from_ids)
+        return pd.DataFrame({"from": from_ids, "to": to_ids, "weight": weights},
+                            columns=["from", "to", "weight"])
 
-        rel_arrays = list(_rel_arrays())
-        if len(rel_arrays) == 0:
-            return pd.DataFrame(columns=["from", "to", "weight"])
+    def iter_relations(self, chunk_size=1000000):
+        """
+        Iterates over all the relations as successive dataframes like the
+        ones of get_relations(), each containing all the relations of a
+        group of "from".
+
+        Those groups are cut every chunk_size relations, s.t. each chunk
+        contains less than twice chunk_size relations, unless a single
+        "from" has more than that. This allows to dump huge relationships in
+        bounded memory.
+        """
+        from_ids = self._from_ids()
+        chunk_ids = (np.cumsum(self.get_degrees(from_ids)) - 1) // chunk_size
+        boundaries = np.flatnonzero(np.diff(chunk_ids)) + 1
 
-        else:
-            df = pd.DataFrame(np.hstack(rel_arrays).T,
-                              columns=["from", "to", "weight"])
-            df["weight"] = df["weight"].astype(float)
-            return df
+        for chunk in np.split(from_ids, boundaries):
+            yield self.get_relations(chunk)
 
     def get_neighbourhood_size(self, from_ids):
         """
@@ -222,13 +735,8 @@ class Relationship(object):
         each requested from.
         """
 
-        def size(from_id):
-            if from_id in self.grouped:
-                return len(self.grouped[from_id])
-            else:
-                return 0
-
-        return pd.Series({from_id: size(from_id) for from_id in from_ids})
+        from_ids = pd.unique(np.asarray(from_ids))
+        return pd.Series(self.get_degrees(from_ids), index=from_ids).sort_index()
 
     def unique_tos(self):
         """
@@ -259,20 +767,15 @@ class Relationship(object):
         selection were dropped due to one-to-one config.
 
         If one_to_one is True, the selection is an injective function,
-        i.e each to_ids will at most be picked once.
+        i.e each to_ids will at most be picked once. Requests that drew the
+        same "to" as another one draw again among their remaining "to", and
+        are dropped if none is left.
 
         overridden_to_weights is an optional dictionary of {"to": weight}
         that can be used to override the default weights contained in this
         Relationship.
         """
 
-        if overridden_to_weights is not None:
-            missing_keys = self.unique_tos() - set(
-                overridden_to_weights.keys().values)
-            assert len(missing_keys) == 0, \
-                "overridden_to_weights is missing those 'to' keys: {}".format(
-                    missing_keys)
-
         if from_ids is None:
             _from_ids = pd.Series(list(self.grouped.keys()))
         elif type(from_ids) == list:
@@ -280,22 +783,27 @@ class Relationship(object):
         else:
             _from_ids = from_ids
 
+        if one_to_one:
+            picks = self._pick_one_injective(_from_ids, overridden_to_weights)
+        elif overridden_to_weights is None:
+            grouped = self.grouped
+            picks = (grouped[from_id].pick_one(self.state)
+                     if from_id in grouped else (None, None)
+                     for from_id in _from_ids)
+        else:
+            picks = self._pick_one_overridden(_from_ids, overridden_to_weights)
+
         def _results():
             # req_index is the technical index of the table built by the Story,
             # => must be respect to join correctly the result of the select_one
-            for req_index, from_id in zip(_from_ids.index, _from_ids):
-                if from_id in self.grouped:
-                    idx, picked = self.grouped[from_id].pick_one(self.state,
-                                                                 overridden_to_weights)
-                    if picked is None:
-                        if discard_empty:
-                            continue
-                        else:
-                            yield req_index, from_id, -1, None
-                    else:
-                        yield req_index, from_id, idx, picked
-
-                elif not discard_empty:
+            for req_index, from_id, (idx, picked) in zip(_from_ids.index,
+                                                         _from_ids, picks):
+                if picked is not None:
+                    yield req_index, from_id, idx, picked
+
+                # requests that lost all their "to" to one-to-one conflicts
+                # are dropped
+                elif idx is None and not discard_empty:
                     yield req_index, from_id, -1, None
 
         output = list(zip(*_results()))
@@ -308,16 +816,6 @@ class Relationship(object):
                                "from": from_id},
                               index=request_index)
 
-        if one_to_one and output.shape[0] > 0:
-            # not de-duplicating the blank results
-            blank_idx = output[named_as].isna()
-            blanks, present = output[blank_idx], output[~blank_idx]
-
-            present = present.loc[self.state.permutation(present.index)]
-            present.drop_duplicates(subset=named_as, keep="first", inplace=True)
-
-            output = pd.concat([present, blanks])
-
         if remove_selected:
 
             # we have to remove all the relations of each from in one go since
@@ -330,9 +828,104 @@ class Relationship(object):
                 if len(group) == 0:
                     del self.grouped[from_id]
 
+            self._refresh_degrees(g.groups.keys())
+
         output.drop(["idx"], axis=1, inplace=True)
         return output
 
+    def _flat_relations(self, from_ids):
+        """
+        :return: the relations of those from_ids concatenated in flat arrays,
+            as their to_ids, weights and alive flags, the number of relations
+            of each distinct from_id found in this relationship, and the
+            index of the one of each requested from_id in those sizes (or -1
+            if it is not in this relationship)
+        """
+        grouped = self.grouped
+        requested = [from_id for from_id in pd.unique(from_ids)
+                     if from_id in grouped]
+        relations = [grouped[from_id] for from_id in requested]
+
+        if len(relations) == 0:
+            return (np.array([], dtype=object), np.array([], dtype=float),
+                    np.array([], dtype=bool), np.array([], dtype=np.int64),
+                    np.full(len(from_ids), -1, dtype=np.int64))
+
+        return (_concat_ids([r._to_ids for r in relations]),
+                np.concatenate([r._weights for r in relations]).astype(float),
+                np.concatenate([r.alive for r in relations]),
+                np.array([len(r.alive) for r in relations], dtype=np.int64),
+                pd.Index(requested).get_indexer(from_ids))
+
+    def _pick_one_overridden(self, from_ids, overridden_to_weights):
+        """
+        Same as Relations.pick_one() for each of those from_ids, though with
+        the weights of overridden_to_weights, resolved once for the relations
+        of all the requested from_ids, and one batched draw. This consumes the
+        random state exactly as the successive pick_one() would.
+
+        :return: the (idx, picked) pair of each of those from_ids, which is
+            (None, None) for a from_id without relation
+        """
+        to_ids, _, alive, sizes, rows = self._flat_relations(from_ids)
+        if sizes.shape[0] == 0:
+            return [(None, None)] * len(from_ids)
+
+        weights = _resolve_to_weights(overridden_to_weights, to_ids, alive)
+        _, cdf = _row_cdf(weights, alive, sizes)
+        cdf_keys = np.repeat(np.arange(sizes.shape[0]), sizes) + cdf
+        lowers = np.cumsum(sizes) - sizes
+
+        live_counts = np.add.reduceat(alive, lowers)
+        request_live_counts = np.where(rows != -1, live_counts[rows], 0)
+        positions = np.full(rows.shape[0], -1, dtype=np.int64)
+
+        # like in pick_one(), a relation that is alone in its row is picked
+        # without consuming any random draw
+        single = request_live_counts == 1
+        live_positions = np.where(alive)[0]
+        positions[single] = live_positions[np.searchsorted(
+            live_positions, lowers[rows[single]])]
+
+        drawn = request_live_counts > 1
+        positions[drawn] = _draw_positions(
+            self.state, cdf_keys, alive, rows[drawn], lowers[rows[drawn]],
+            lowers[rows[drawn]] + sizes[rows[drawn]])
+
+        idx = np.where(positions != -1, positions - lowers[rows], -1)
+        return [(i, to_ids[p]) if p != -1 else (None, None)
+                for i, p in zip(idx, positions)]
+
+    def _pick_one_injective(self, from_ids, overridden_to_weights):
+        """
+        Picks one relation for each of those from_ids, s.t. no "to" is picked
+        more than once, see _injective_positions().
+
+        :return: the (idx, picked) pair of each of those from_ids, which is
+            (None, None) for a from_id without relation and (-1, None) for
+            a from_id whose relations were all picked by other from_ids
+        """
+        to_ids, weights, alive, sizes, rows = self._flat_relations(from_ids)
+        if sizes.shape[0] == 0:
+            return [(None, None)] * len(from_ids)
+
+        if overridden_to_weights is not None:
+            weights = _resolve_to_weights(overridden_to_weights, to_ids, alive)
+
+        lowers = np.cumsum(sizes) - sizes
+        found = rows != -1
+        found[found] = np.add.reduceat(alive, lowers)[rows[found]] > 0
+
+        positions = np.full(rows.shape[0], -1, dtype=np.int64)
+        positions[found] = _injective_positions(
+            self.state, weights, alive, pd.factorize(to_ids)[0], sizes,
+            rows[found])
+
+        idx = np.where(positions != -1, positions - lowers[rows], -1)
+        return [(None, None) if not is_found else
+                (i, to_ids[p]) if p != -1 else (-1, None)
+                for is_found, i, p in zip(found, idx, positions)]
+
     def select_all_horizontal(self, from_ids, named_as="to"):
         """
         Return all the "to" sides starting from each "from",
@@ -343,12 +936,16 @@ class Relationship(object):
         returned dataframe (=> the corresponding rows are dropped in the result)
         """
 
-        rows = self.get_relations(from_ids)
-        groups = rows.set_index("to", drop=True).groupby("from", sort=False)
-        df = pd.DataFrame(data=list(groups.groups.items()),
-                          columns=["from", named_as])
-        df[named_as] = df[named_as].apply(lambda s: [el for el in s])
-        return df
+        edge_froms, edge_tos, _ = self.get_relation_arrays(from_ids)
+
+        # one row per "from", in their order of first appearance, the
+        # relations of each of them being contiguous
+        codes, froms = pd.factorize(edge_froms)
+        tos = RaggedArray.from_sizes(
+            edge_tos, np.bincount(codes, minlength=froms.shape[0]))
+
+        return pd.DataFrame({"from": froms, named_as: tos.to_lists()},
+                            columns=["from", named_as])
 
     def select_many(self, from_ids, named_as, quantities, remove_selected=False,
                     discard_empty=True):
@@ -358,97 +955,86 @@ class Relationship(object):
         Since we select several values, we return several lines per index value of from_id =>
         during the subsequent join by the Operation, the number of produced rows increases.
 
+        All requests are served together: the requests of each "from" are
+        shuffled, capped s.t. they do not ask for more than its number of
+        relations, then served from one random permutation of those
+        relations, obtained by sorting them on random keys.
         """
 
-        req = pd.DataFrame({"from": from_ids, "qties": quantities})
-        req["qties"] = req["qties"].astype(np.int)
-
-        # gathers all requests to the same "from" together, keeping track of
-        # the "request index" in the original from_ids so we can merge it later
-        def gather(df):
-
-            # shuffles that set of request s.t. in case of capping not the same
-            # from_id get "capped" all time
-            df2 = df.loc[self.state.permutation(df.index)]
-            return pd.Series({"quantities": df2["qties"].tolist(),
-                              "req_index": df2.index.tolist()})
-
-        # the same "from" can be requested several times
-        all_reqs = req.groupby("from", sort=False).apply(gather)
-
-        def _all_picks_results():
-            for _, row in all_reqs.iterrows():
-
-                from_id = row.name
-
-                if from_id in self.grouped:
-
-                    relations = self.grouped[from_id]
-                    quantities = utils.cap_to_total(row["quantities"],
-                                                    len(relations))
-
-                    # rel_idx is the index of the picked values within the grouped values (i.e. for one from_id)
-                    rel_idx, rel_tos = relations.pick_many(self.state,
-                                                           np.sum(quantities))
-
-                    # prepares the indices of the resulting vertical format, as a sequence
-                    # of index interval where to inject the picked values
-                    to_idx = np.cumsum(quantities).tolist()
-                    from_idx = [0] + to_idx[:-1]
-                    idx_intervals = [(lb, ub) for lb, ub in zip(from_idx, to_idx)]
-
-                    def _one_pick_result():
-                        for ((lower_bound, upper_bound), req_index) in zip(
-                                idx_intervals, row["req_index"]):
-                            size = upper_bound - lower_bound
-
-                            if size == 0:
-                                continue
-
-                            yield [
-                                req_index,
-                                from_id,
-                                rel_tos[lower_bound:upper_bound],
-                                rel_idx[lower_bound:upper_bound],
-                            ]
-
-                    yield list(_one_pick_result())
-
-        all_picks_results = list(_all_picks_results())
-
-        if len(all_picks_results) > 0:
-            output = pd.DataFrame(
-                data=functools.reduce(lambda l1, l2: l1 + l2, all_picks_results),
-                columns=["req_idx", "from", named_as, "rel_idx"])
-
-            if remove_selected:
-
-                # remove all the relations of each from in one go since
-                # no injective selection might have the same index several times
-                g = output[output["rel_idx"] != -1][
-                    ["from", "rel_idx"]].groupby(by="from")
-                for from_id in g.groups:
-                    group = self.grouped[from_id]
-                    removed_idx = g.get_group(from_id)["rel_idx"].values[0]
-                    group.remove_inplace(removed_idx)
-                    if len(group) == 0:
-                        del self.grouped[from_id]
-
+        if not isinstance(from_ids, pd.Series):
+            from_ids = pd.Series(from_ids)
+
+        to_ids, _, alive, sizes, rows = self._flat_relations(from_ids.values)
+        quantities = np.asarray(quantities).astype(np.int64)
+        requested = np.where((rows != -1) & (quantities > 0))[0]
+
+        # groups the requests by "from", in random order within each of them
+        # s.t. in case of capping, not always the same requests get capped
+        requested = requested[np.lexsort(
+            (self.state.permutation(requested.shape[0]), rows[requested]))]
+        req_rows = rows[requested]
+        req_qties = quantities[requested]
+
+        if requested.shape[0] > 0:
+            lowers = np.cumsum(sizes) - sizes
+            live_counts = np.add.reduceat(alive, lowers)
+
+            row_starts = np.where(
+                np.append(True, req_rows[1:] != req_rows[:-1]))[0]
+            row_ids = np.repeat(np.arange(row_starts.shape[0]),
+                                np.diff(np.append(row_starts, requested.shape[0])))
+
+            # quantity requested by the previous requests of the same "from"
+            before = np.cumsum(req_qties) - req_qties
+            before -= before[row_starts][row_ids]
+            served = np.clip(live_counts[req_rows] - before, 0, req_qties)
+
+            # sampling without replacement among the relations of each "from"
+            positions = np.where(alive)[0]
+            edge_rows = np.repeat(np.arange(sizes.shape[0]), live_counts)
+            order = np.lexsort(
+                (self.state.uniform(size=positions.shape[0]), edge_rows))
+            positions = positions[order]
+            rank_in_row = np.arange(positions.shape[0]) - np.repeat(
+                np.cumsum(live_counts) - live_counts, live_counts)
+            row_totals = np.bincount(req_rows, weights=served,
+                                     minlength=sizes.shape[0])
+            selected = rank_in_row < row_totals[edge_rows]
+            selected_positions = positions[selected]
+            selected_rows = edge_rows[selected]
         else:
-            output = pd.DataFrame(
-                columns=["req_idx", "from", named_as, "rel_idx"])
+            served = req_qties
+            selected_positions = np.array([], dtype=np.int64)
+            selected_rows = np.array([], dtype=np.int64)
+
+        picks = RaggedArray.from_sizes(to_ids[selected_positions],
+                                       served).split()
+        output = pd.DataFrame(
+            {named_as: pd.Series(
+                [pick for pick, size in zip(picks, served) if size > 0],
+                index=from_ids.index[requested[served > 0]], dtype=object)})
+
+        if remove_selected and selected_positions.shape[0] > 0:
+
+            # the selections of all the requests of a "from" are removed in
+            # one go, they are never picked twice
+            row_froms = from_ids.values[requested[row_starts]]
+            boundaries = np.where(np.diff(selected_rows) != 0)[0] + 1
+            for row, from_id, positions in zip(
+                    req_rows[row_starts], row_froms,
+                    np.split(selected_positions, boundaries)):
+                relations = self.grouped[from_id]
+                relations.remove_inplace(positions - lowers[row])
+                if len(relations) == 0:
+                    del self.grouped[from_id]
 
-        output.set_index("req_idx", drop=True, inplace=True)
-        output.drop(["rel_idx", "from"], axis=1, inplace=True)
+            self._refresh_degrees(row_froms)
 
-        # "discard_empty" option: return empty result (instead of nothing) for
-        # any non existing (i.e. empty) "from" relation
-        if not discard_empty and output.shape[0] != len(from_ids):
+        if not discard_empty and output.shape[0] != from_ids.shape[0]:
             missing_index = from_ids.index.difference(output.index)
             missing_values = pd.DataFrame(
-                {named_as: pd.Series([[] * missing_index.shape[0]],
-                                     index=missing_index)})
-
+                {named_as: pd.Series([[]] * missing_index.shape[0],
+                                     index=missing_index, dtype=object)})
             output = pd.concat([output, missing_values], copy=False)
 
         return output
@@ -457,6 +1043,15 @@ class Relationship(object):
     # IO                 #
     ######################
 
+    def checkpoint_state(self):
+        """
+        :return: a copy of all the relations of this relationship
+        """
+        return copy.deepcopy(self.grouped)
+
+    def restore_state(self, state):
+        self.grouped = copy.deepcopy(state)
+
     def save_to(self, file_path):
         """
         Saves all the relationship as well as the current status of the seed
@@ -464,21 +1059,29 @@ class Relationship(object):
         """
         logging.info("saving relationship to {}".format(file_path))
 
-        # creating a vertical dataframe to store the inner table
-        saved_df = pd.DataFrame(self.get_relations().stack(), columns=["value"])
+        with open(file_path, "w") as outf:
+            outf.write("param,,,value\n")
 
-        # we also want to save the seed => added an index level to separate
-        # self._table from self.seed in the end result
-        saved_df["param"] = "relations"
-        saved_df = saved_df.set_index("param", append=True)
-        saved_df.index = saved_df.index.reorder_levels([2, 0, 1])
+            saved = 0
+            for relations in self.iter_relations():
+                relations.index += saved
+                saved += relations.shape[0]
 
-        # then finally added the seed
-        saved_df.loc[("seed", 0, 0)] = self.seed
-        saved_df.to_csv(file_path)
+                # creating a vertical dataframe to store the inner table
+                saved_df = pd.DataFrame(relations.stack(), columns=["value"])
 
-    @staticmethod
-    def load_from(file_path):
+                # we also want to save the seed => added an index level to
+                # separate the relations from self.seed in the end result
+                saved_df["param"] = "relations"
+                saved_df = saved_df.set_index("param", append=True)
+                saved_df.index = saved_df.index.reorder_levels([2, 0, 1])
+                saved_df.to_csv(outf, header=False)
+
+            # then finally added the seed
+            outf.write("seed,0,0,{}\n".format(self.seed))
+
+    @classmethod
+    def load_from(cls, file_path):
         logging.info("loading relationship from {}".format(file_path))
 
         saved_df = pd.read_csv(file_path, index_col=[0, 1, 2])
@@ -489,7 +1092,7 @@ class Relationship(object):
         relations.index = relations.index.droplevel(0)
         relations.columns = relations.columns.droplevel(0)
 
-        relationship = Relationship(seed)
+        relationship = cls(seed)
         relationship.add_relations(
             from_ids=relations["from"].values,
             to_ids=relations["to"].values,
@@ -497,6 +1100,172 @@ class Relationship(object):
 
         return relationship
 
+    def _binary_arrays(self):
+        """
+        :return: the arrays stored by save_binary(): the relations in
+            compressed sparse row format, as in CsrRelationship
+        """
+        from_ids = self._from_ids()
+        to_ids, weights, alive, sizes, _ = self._flat_relations(from_ids)
+        to_dictionary = IdDictionary(to_ids)
+
+        return {"from_ids": from_ids,
+                "offsets": np.append(0, np.cumsum(sizes)).astype(np.int64),
+                "to_ids": to_dictionary.ids,
+                "to_codes": to_dictionary.encode(to_ids),
+                "weights": weights,
+                "alive": alive}
+
+    def save_binary(self, folder):
+        """
+        Saves all the relationship as well as the current state of its random
+        generator to the specified folder, as one .npy file per array of
+        load_binary() and a relationship.json file for the rest.
+
+        If the folder already exists, it is deleted first
+        """
+        logging.info("saving relationship to {}".format(folder))
+
+        utils.ensure_non_existing_dir(folder)
+        os.makedirs(folder)
+
+        for name, values in self._binary_arrays().items():
+            np.save(os.path.join(folder, name + ".npy"), _savable_ids(values))
+
+        _, keys, pos, has_gauss, cached_gaussian = self.state.get_state()
+        description = {
+            "storage": self.storage,
+            "seed": None if self.seed is None else int(self.seed),
+            "random_state": {"keys": keys.tolist(), "pos": int(pos),
+                             "has_gauss": int(has_gauss),
+                             "cached_gaussian": float(cached_gaussian)},
+            "frozen": getattr(self, "frozen", False),
+            "removed_count": int(getattr(self, "removed_count", 0)),
+        }
+        with open(os.path.join(folder, "relationship.json"), "w") as outf:
+            json.dump(description, outf, indent=4)
+
+    @staticmethod
+    def binary_storage(folder):
+        """
+        :return: the storage of the relationship saved in that folder by
+            save_binary()
+        """
+        with open(os.path.join(folder, "relationship.json"), "r") as inf:
+            return json.load(inf)["storage"]
+
+    @classmethod
+    def load_binary(cls, folder, mmap_mode=None):
+        """
+        Loads a relationship saved by save_binary(), together with the state
+        of its random generator: the selections that follow are the same as
+        the ones the saved relationship would have made.
+
+        :param mmap_mode: mmap_mode of np.load() for the arrays of the
+            relations (the ids are always read in memory). Only a
+            relationship saved by a CsrRelationship and loaded as a
+            CsrRelationship keeps using those arrays: with "r", several
+            processes can then share one read-only copy of it, though
+            removing relations from it fails. Use "c" (copy-on-write)
+            instead in that case.
+        """
+        logging.info("loading relationship from {}".format(folder))
+
+        with open(os.path.join(folder, "relationship.json"), "r") as inf:
+            description = json.load(inf)
+
+        def load(name, mmap_mode=None):
+            values = np.load(os.path.join(folder, name + ".npy"),
+                             mmap_mode=mmap_mode, allow_pickle=False)
+            if values.dtype.kind in "US":
+                return values.astype(object)
+            return values
+
+        from_ids, to_ids = load("from_ids"), load("to_ids")
+        arrays = {name: load(name, mmap_mode) for name in
+                  ["offsets", "to_codes", "weights", "alive"]}
+
+        if description["storage"] == "csr" and cls.storage == "csr":
+            relationship = cls(description["seed"],
+                               to_dictionary=IdDictionary(to_ids))
+            relationship.from_index = pd.Index(from_ids)
+            for name in ["live_degrees", "live_weight_sums", "cum_weights"]:
+                arrays[name] = load(name, mmap_mode)
+            arrays["_cdf"] = load("cdf", mmap_mode)
+
+            for name, values in arrays.items():
+                setattr(relationship, name, values)
+            relationship.removed_count = description["removed_count"]
+
+        else:
+            alive = np.asarray(arrays["alive"])
+            relationship = cls.from_edges(
+                seed=description["seed"],
+                from_ids=np.repeat(from_ids, np.diff(arrays["offsets"]))[alive],
+                to_ids=to_ids[arrays["to_codes"][alive]],
+                weights=arrays["weights"][alive])
+
+        if description["frozen"] and cls.storage == "csr":
+            relationship.freeze()
+
+        random_state = description["random_state"]
+        relationship.state.set_state(
+            ("MT19937", np.array(random_state["keys"], dtype=np.uint32),
+             random_state["pos"], random_state["has_gauss"],
+             random_state["cached_gaussian"]))
+
+        return relationship
+
+    @classmethod
+    def from_edges(cls, seed, from_ids, to_ids, weights=1):
+        """
+        Builds a relationship from 3 aligned arrays of from ids, to ids and
+        weights in one go, without going through the buffer of
+        add_relations(). The relations of each "from" keep the order they
+        have in those arrays.
+
+        This is the fastest way to build very large relationships.
+        """
+        from_ids = _as_id_array(from_ids)
+
+        relationship = cls(seed)
+        relationship._insert(
+            from_ids=from_ids,
+            to_ids=_as_id_array(to_ids),
+            weights=np.broadcast_to(np.asarray(weights), from_ids.shape))
+
+        return relationship
+
+    @classmethod
+    def load_edges(cls, seed, file_path):
+        """
+        Builds a relationship from the "from", "to" and (optional) "weight"
+        columns of a parquet file, or from the arrays of a .npz file with
+        the same names, e.g. as saved by
+        np.savez(file_path, **{"from": from_ids, "to": to_ids})
+
+        The arrays of .npz files are loaded without unpickling, i.e. string
+        ids must be stored with a fixed-width dtype, e.g. as
+        np.array(ids, dtype=str), and not as python objects.
+
+        Reading parquet files requires pyarrow.
+        """
+        logging.info("loading relationship edges from {}".format(file_path))
+
+        if file_path.endswith(".npz"):
+            edges = np.load(file_path, allow_pickle=False)
+            fields = edges.files
+        elif file_path.endswith(".parquet"):
+            edges = pd.read_parquet(file_path)
+            fields = edges.columns
+        else:
+            raise ValueError("cannot load edges from {}: expecting a .npz or "
+                             "a .parquet file".format(file_path))
+
+        return cls.from_edges(
+            seed=seed, from_ids=edges["from"], to_ids=edges["to"],
+            weights=edges["weight"] if "weight" in fields else 1)
+
     class RelationshipOps(object):
         def __init__(self, relationship):
             self.relationship = relationship
@@ -512,16 +1281,41 @@ class Relationship(object):
             def build_output(self, story_data):
 
                 requested_froms = story_data[self.from_field]
-                sizes = self.relationship.get_neighbourhood_size(
-                    from_ids=requested_froms)
+                sizes = self.relationship.get_degrees(requested_froms.values)
 
-                return pd.DataFrame(
-                    {self.named_as: requested_froms.map(sizes).astype(int)})
+                return pd.DataFrame({self.named_as: sizes},
+                                    index=story_data.index)
 
         def get_neighbourhood_size(self, from_field, named_as):
             return self.AddNeighbourhoodSize(self.relationship, from_field,
                                              named_as)
 
+        class AddReverseNeighbourhoodSize(AddColumns):
+            def __init__(self, relationship, to_field, named_as):
+                AddColumns.__init__(self)
+
+                self.relationship = relationship
+                self.to_field = to_field
+                self.named_as = named_as
+
+            def build_output(self, story_data):
+
+                requested_tos = story_data[self.to_field]
+                sizes = self.relationship.get_reverse_degrees(
+                    requested_tos.values)
+
+                return pd.DataFrame({self.named_as: sizes},
+                                    index=story_data.index)
+
+        def get_reverse_neighbourhood_size(self, to_field, named_as):
+            """
+            :return: this operation adds a column with the number of
+                relations towards each "to" of to_field, e.g. the number of
+                customers of a dealer
+            """
+            return self.AddReverseNeighbourhoodSize(self.relationship,
+                                                    to_field, named_as)
+
         class SelectOne(AddColumns):
             """
             """
@@ -582,6 +1376,46 @@ class Relationship(object):
             return self.SelectOne(self.relationship, from_field, named_as,
                                   one_to_one, pop, discard_empty, weight)
 
+        class SelectOneReverse(AddColumns):
+            def __init__(self, relationship, to_field, named_as,
+                         discard_missing):
+
+                # inner join instead of default left to allow dropping rows
+                AddColumns.__init__(self, join_kind="inner")
+
+                self.relationship = relationship
+                self.to_field = to_field
+                self.named_as = named_as
+                self.discard_missing = discard_missing
+
+            def build_output(self, story_data):
+                selected = self.relationship.select_one_reverse(
+                    to_ids=story_data[self.to_field],
+                    named_as=self.named_as,
+                    discard_empty=self.discard_missing)
+
+                selected.drop("to", axis=1, inplace=True)
+                return selected
+
+        def select_one_reverse(self, to_field, named_as, discard_empty=False):
+            """
+            :param to_field: field corresponding to the "to" side of the
+                relationship
+
+            :param named_as: field name assigned to the selected "from" side
+                of the relationship
+
+            :param discard_empty: if False, any "to" without relation yields
+                a None in the resulting selection. If true, that row is
+                removed from the story_data.
+
+            :return: this operation adds a single column corresponding to a
+                random choice among the "from" related to each "to", e.g. one
+                of the subscribers holding a given SIM
+            """
+            return self.SelectOneReverse(self.relationship, to_field, named_as,
+                                         discard_empty)
+
         class SelectAll(Operation):
             def __init__(self, relationship, from_field, named_as):
                 self.relationship = relationship
@@ -683,9 +1517,701 @@ class Relationship(object):
 
             def side_effect(self, story_data):
                 if story_data.shape[0] > 0:
-                    self.relationship.remove(
+                    self.relationship.remove_relations(
                         from_ids=story_data[self.from_field],
                         to_ids=story_data[self.item_field])
 
         def remove(self, from_field, item_field):
             return self.Remove(self.relationship, from_field, item_field)
+
+
+class CsrRelationship(Relationship):
+    """
+    Relationship storing all its relations in compressed sparse row format
+    instead of one Relations object per "from":
+
+    - from_index contains the sorted unique "from" ids
+    - the "to" ids and weights of the i-th "from" are
+      to_codes[offsets[i]:offsets[i + 1]] and
+      weights[offsets[i]:offsets[i + 1]], the "to" ids being stored as their
+      codes in to_dictionary, which can be shared with other relationships
+    - cum_weights contains the cumulative weights within each of those rows
+
+    This allows to select the "to" sides of a whole batch of "from" ids in a
+    few array operations. For the same seed, the selections are different
+    from the ones of a Relationship, though they follow the same
+    distributions.
+
+    Like in Relations, removed relations are only flagged in the "alive"
+    bitmap, and the number of live relations of each row is kept in
+    live_degrees. The arrays are rebuilt once more than COMPACTION_THRESHOLD
+    of the stored relations are removed.
+
+    Relationships whose weights do not change can be frozen, see freeze().
+    """
+
+    storage = "csr"
+
+    cached_attributes = ("_reverse", "_alias", "_alias_prob")
+
+    def __init__(self, seed, to_dictionary=None):
+        """
+        :param to_dictionary: IdDictionary in which the "to" ids are
+            interned, e.g. the one of the population they belong to. A new
+            one is created if not specified.
+        """
+        self.seed = seed
+        self.state = RandomState(self.seed)
+        self.frozen = False
+        self._pending = []
+        self._pending_size = 0
+        self.to_dictionary = to_dictionary if to_dictionary is not None \
+            else IdDictionary()
+        self._set_relations(from_ids=np.array([], dtype=object),
+                            to_codes=np.array([], dtype=np.int32),
+                            weights=np.array([], dtype=float))
+        self.ops = self.RelationshipOps(self)
+
+    def _set_relations(self, from_ids, to_codes, weights):
+        """
+        (Re)builds the whole storage from those 3 aligned arrays, keeping
+        the relations of each "from" in their original order.
+        """
+
+        unique_froms, order, self.offsets = _group_by_from(from_ids)
+
+        self.from_index = pd.Index(unique_froms)
+        self.to_codes = to_codes[order]
+        self.weights = weights[order].astype(float)
+        self.alive = np.ones(order.shape[0], dtype=bool)
+        self.live_degrees = np.diff(self.offsets)
+        self.live_weight_sums = np.bincount(
+            np.repeat(np.arange(self.live_degrees.shape[0]), self.live_degrees),
+            weights=self.weights, minlength=self.live_degrees.shape[0])
+        self.removed_count = 0
+        self._drop_alias_tables()
+        self._drop_reverse_index()
+
+        _, self.cum_weights, self._cdf = self._cumulate(
+            self.weights, np.arange(self.from_index.shape[0]))
+
+    def freeze(self):
+        """
+        Declares the weights of this relationship as static: weighted
+        selections then go through the Walker alias table of each row, which
+        makes each pick O(1) whatever the number of relations of the "from".
+
+        Those tables are built at the next selection, and dropped (then
+        rebuilt) whenever relations are added or removed.
+        """
+        self.frozen = True
+        return self
+
+    def share_to_dictionary(self, to_dictionary):
+        """
+        Encodes the "to" ids of this relationship with that IdDictionary
+        instead, e.g. the one of the population they belong to, which adds
+        the ones it does not contain yet.
+        """
+        self._merge_pending()
+        codes = to_dictionary.encode(self.to_dictionary.ids, add=True)
+        self.to_codes = codes[self.to_codes]
+        self.to_dictionary = to_dictionary
+
+    def _drop_alias_tables(self):
+        self._alias = None
+        self._alias_prob = None
+
+    def _build_alias_tables(self):
+        """
+        Builds the alias tables of all rows at once: for row r of size n, the
+        k-th bucket is kept with probability
+        _alias_prob[offsets[r] + k], and otherwise replaced by its alias
+        _alias[offsets[r] + k].
+
+        In Vose's construction, each weight above the mean ("large") is poured
+        in turn into the buckets of the weights below it ("small"), and
+        becomes small once it drops below the mean. Here, the deficits of the
+        small weights and the surpluses of the large weights of each row are
+        laid out on 2 cumulative lines: a small is aliased to the large whose
+        surplus covers the start of its deficit, and a large whose surplus
+        ends within the deficit of a small keeps the rest of that deficit as
+        its own, served by the next large of the row.
+        """
+
+        sizes = np.diff(self.offsets)
+        rows = np.repeat(np.arange(sizes.shape[0]), sizes)
+
+        # removed relations get a weight of 0 and rows without weight are
+        # uniform among their remaining relations
+        weights = np.where(self.alive, self.weights, 0)
+        unweighted = np.bincount(rows, weights=weights,
+                                 minlength=sizes.shape[0])[rows] == 0
+        weights = np.where(unweighted, self.alive, weights)
+        row_sums = np.bincount(rows, weights=weights, minlength=sizes.shape[0])
+
+        # weights scaled s.t. their mean is 1 in each row (rows whose
+        # relations are all removed get nan, i.e. are neither small nor large)
+        with np.errstate(invalid="ignore"):
+            scaled = weights * sizes[rows] / row_sums[rows]
+            is_small, is_large = scaled < 1, scaled > 1
+
+        positions = np.arange(scaled.shape[0])
+        smalls, larges = positions[is_small], positions[is_large]
+        small_rows, large_rows = rows[smalls], rows[larges]
+
+        deficits = 1 - scaled[smalls]
+        deficit_starts = _segmented_cumsum(deficits, small_rows)
+        deficit_ends = deficit_starts + deficits
+
+        surpluses = scaled[larges] - 1
+        surplus_starts = _segmented_cumsum(surpluses, large_rows)
+        surplus_ends = surplus_starts + surpluses
+
+        self._alias = positions.copy()
+        self._alias_prob = np.where(is_small, scaled, 1.)
+
+        served_by = _last_preceding(
+            anchor_rows=large_rows, anchor_values=surplus_starts,
+            query_rows=small_rows, query_values=deficit_starts,
+            anchors_first=True)
+        served = served_by != -1
+        self._alias[smalls[served]] = larges[served_by[served]]
+
+        # rounding errors might leave a small without large in its row
+        self._alias_prob[smalls[~served]] = 1
+
+        straddled = _last_preceding(
+            anchor_rows=small_rows, anchor_values=deficit_starts,
+            query_rows=large_rows, query_values=surplus_ends,
+            anchors_first=False)
+        has_next = np.zeros(larges.shape[0], dtype=bool)
+        has_next[:-1] = large_rows[1:] == large_rows[:-1]
+        left = has_next & (straddled != -1)
+
+        residuals = np.zeros(larges.shape[0])
+        residuals[left] = np.maximum(
+            deficit_ends[straddled[left]] - surplus_ends[left], 0)
+        self._alias_prob[larges] = 1 - residuals
+        self._alias[larges[has_next]] = larges[1:][has_next[:-1]]
+
+    def _select_alias_positions(self, rows):
+        """
+        Same as _select_positions(), with one O(1) lookup in the alias tables
+        """
+        if self._alias is None:
+            self._build_alias_tables()
+
+        sizes = self.offsets[rows + 1] - self.offsets[rows]
+        draws = self.state.uniform(size=rows.shape[0]) * sizes
+        buckets = np.minimum(draws.astype(np.int64), sizes - 1)
+        positions = self.offsets[rows] + buckets
+
+        kept = draws - buckets < self._alias_prob[positions]
+        return np.where(kept, positions, self._alias[positions])
+
+    def _cumulate(self, weights, rows):
+        """
+        :param weights: weights of all the stored relations
+        :param rows: rows to cumulate
+
+        :return: the positions of all the relations of those rows, their
+            cumulative weights within each row, as well as their search keys
+            in the concatenated cdf of all rows, in which the i-th row spans
+            ]i, i + 1]. Removed relations get a weight of 0 and rows whose
+            weights are all 0 are given uniform weights.
+        """
+        positions, request_idx = self._edge_positions(rows)
+        if positions.shape[0] == 0:
+            return positions, np.array([], dtype=float), np.array([], dtype=float)
+
+        sizes = self.offsets[rows + 1] - self.offsets[rows]
+        cum_weights, cdf = _row_cdf(weights[positions], self.alive[positions],
+                                    sizes)
+
+        return positions, cum_weights, rows[request_idx] + cdf
+
+    def degrees(self):
+        """
+        :return: the number of relations of each "from" of from_index
+        """
+        self._merge_pending()
+        return self.live_degrees
+
+    def _edge_froms(self):
+        return np.repeat(self.from_index.values, np.diff(self.offsets))
+
+    @property
+    def to_ids(self):
+        """
+        :return: the "to" ids of all the stored relations, including the
+            removed ones
+        """
+        return self.to_dictionary.decode(self.to_codes)
+
+    def _live_relations(self):
+        """
+        :return: the from ids, to codes and weights of all the relations that
+            are not removed
+        """
+        return (self._edge_froms()[self.alive], self.to_codes[self.alive],
+                self.weights[self.alive])
+
+    def _rows(self, from_ids):
+        """
+        :return: the row of each of those from ids, or -1 if it has no
+            relation
+        """
+        rows = self.from_index.get_indexer(np.asarray(from_ids))
+        if self.removed_count > 0:
+            rows[(rows != -1) & (self.live_degrees[rows] == 0)] = -1
+        return rows
+
+    def _edge_positions(self, rows):
+        """
+        :return: the positions of all the relations of those rows, including
+            the removed ones, together with the index in rows that each of
+            them comes from
+        """
+        starts = self.offsets[rows]
+        sizes = self.offsets[rows + 1] - starts
+        request_idx = np.repeat(np.arange(rows.shape[0]), sizes)
+        positions = np.arange(sizes.sum()) + \
+            np.repeat(starts - (np.cumsum(sizes) - sizes), sizes)
+
+        return positions, request_idx
+
+    def _live_edge_positions(self, rows):
+        positions, request_idx = self._edge_positions(rows)
+        if self.removed_count > 0:
+            live = self.alive[positions]
+            return positions[live], request_idx[live]
+        return positions, request_idx
+
+    def _remove_positions(self, positions):
+        positions = np.unique(positions).astype(np.int64)
+        positions = positions[self.alive[positions]]
+        if positions.shape[0] == 0:
+            return
+
+        rows = np.searchsorted(self.offsets, positions, side="right") - 1
+        self.alive[positions] = False
+        self._drop_alias_tables()
+        self._drop_reverse_index()
+        np.subtract.at(self.live_degrees, rows, 1)
+        np.subtract.at(self.live_weight_sums, rows, self.weights[positions])
+        self.removed_count += positions.shape[0]
+
+        if self.removed_count > COMPACTION_THRESHOLD * self.to_codes.shape[0]:
+            self._set_relations(*self._live_relations())
+        else:
+            updated, cum_weights, cdf = self._cumulate(self.weights,
+                                                       pd.unique(rows))
+            self.cum_weights[updated] = cum_weights
+            self._cdf[updated] = cdf
+
+    def _insert(self, from_ids, to_ids, weights):
+        to_codes = self.to_dictionary.encode(to_ids, add=True)
+
+        if self.to_codes.shape[0] == 0:
+            self._set_relations(from_ids, to_codes, weights)
+        else:
+            self._splice(from_ids, to_codes, weights)
+
+    def _splice(self, from_ids, to_codes, weights):
+        """
+        Inserts those relations after the existing relations of their "from".
+
+        Only the inserted relations are grouped by "from": the stored ones
+        are moved as they are to their new position, i.e. to the same rank
+        in their row, the rows being shifted by the inserted ones before
+        them. The cumulative weights are only computed again for the rows
+        that received relations.
+        """
+        added_froms, order, added_offsets = _group_by_from(from_ids)
+        added_sizes = np.diff(added_offsets)
+        stored_sizes = np.diff(self.offsets)
+
+        added_rows = self.from_index.get_indexer(added_froms)
+        if (added_rows == -1).any():
+            from_index = self.from_index.union(pd.Index(added_froms))
+            stored_rows = from_index.get_indexer(self.from_index)
+            added_rows = from_index.get_indexer(added_froms)
+        else:
+            # no new "from": the rows stay where they are
+            from_index = self.from_index
+            stored_rows = np.arange(from_index.shape[0])
+        n_rows = from_index.shape[0]
+
+        # sizes of the stored and the inserted part of each new row
+        sizes_before = np.zeros(n_rows, dtype=np.int64)
+        sizes_before[stored_rows] = stored_sizes
+        sizes_after = sizes_before.copy()
+        sizes_after[added_rows] += added_sizes
+        offsets = np.append(0, np.cumsum(sizes_after)).astype(np.int64)
+
+        def destinations(edge_rows, row_offsets, sizes, shifts):
+            """
+            :return: new positions of relations stored in rows of those
+                sizes, starting at row_offsets in their original array
+            """
+            ranks = np.arange(edge_rows.shape[0]) - np.repeat(row_offsets, sizes)
+            return offsets[edge_rows] + shifts + ranks
+
+        previous_rows = np.repeat(np.arange(stored_sizes.shape[0]), stored_sizes)
+        stored_edge_rows = stored_rows[previous_rows]
+        stored_dest = destinations(stored_edge_rows, self.offsets[:-1],
+                                   stored_sizes, 0)
+
+        added_edge_rows = np.repeat(added_rows, added_sizes)
+        added_dest = destinations(added_edge_rows, added_offsets[:-1],
+                                  added_sizes, sizes_before[added_edge_rows])
+
+        def spliced(stored, added, dtype):
+            values = np.empty(offsets[-1], dtype=dtype)
+            values[stored_dest] = stored
+            values[added_dest] = added
+            return values
+
+        added_weights = np.asarray(weights)[order].astype(float)
+        self.to_codes = spliced(self.to_codes, to_codes[order], np.int32)
+        self.weights = spliced(self.weights, added_weights, float)
+        self.alive = spliced(self.alive, True, bool)
+
+        # the cdf keys of the i-th row span ]i, i + 1]: the ones of the
+        # shifted rows are shifted as well
+        self.cum_weights = spliced(self.cum_weights, 0, float)
+        self._cdf = spliced(self._cdf - previous_rows + stored_edge_rows, 0,
+                            float)
+
+        live_degrees = np.zeros(n_rows, dtype=self.live_degrees.dtype)
+        live_degrees[stored_rows] = self.live_degrees
+        live_degrees[added_rows] += added_sizes
+        live_weight_sums = np.zeros(n_rows)
+        live_weight_sums[stored_rows] = self.live_weight_sums
+        live_weight_sums += np.bincount(added_edge_rows, weights=added_weights,
+                                        minlength=n_rows)
+
+        self.from_index = from_index
+        self.offsets = offsets
+        self.live_degrees = live_degrees
+        self.live_weight_sums = live_weight_sums
+        self._drop_alias_tables()
+        self._drop_reverse_index()
+
+        updated, cum_weights, cdf = self._cumulate(self.weights, added_rows)
+        self.cum_weights[updated] = cum_weights
+        self._cdf[updated] = cdf
+
+    def add_relations(self, from_ids, to_ids, weights=1):
+        """
+        Add relations to this Relationships from from_ids, to_ids, weights
+
+        Like in Relationship, those are only merged into the storage when it
+        is next read.
+        """
+        from_ids = _as_id_array(from_ids)
+        self._append_pending(
+            from_ids=from_ids,
+            to_ids=_as_id_array(to_ids),
+            weights=np.broadcast_to(np.asarray(weights, dtype=float),
+                                    from_ids.shape))
+
+    def remove_relations(self, from_ids, to_ids):
+        """
+        See Relationship.remove_relations()
+
+        Only the relations of the specified "from" are looked up, by hashing
+        their (row, to code) pairs.
+        """
+        self._merge_pending()
+        rows = self._rows(from_ids)
+        to_codes = self.to_dictionary.encode(to_ids)
+        found = (rows != -1) & (to_codes != -1)
+
+        n_codes = len(self.to_dictionary)
+        removed = rows[found].astype(np.int64) * n_codes + to_codes[found]
+
+        touched_rows = pd.unique(rows[found])
+        positions, request_idx = self._live_edge_positions(touched_rows)
+        candidates = touched_rows[request_idx].astype(np.int64) * n_codes + \
+            self.to_codes[positions]
+
+        self._remove_positions(
+            positions[pd.Series(candidates).isin(removed).values])
+
+    def _from_ids(self):
+        self._merge_pending()
+        return self.from_index.values
+
+    def get_relation_arrays(self, from_ids=None):
+        """
+        See Relationship.get_relation_arrays(). The relations of each "from"
+        are sliced from the storage with their offsets.
+        """
+        self._merge_pending()
+        if from_ids is None:
+            rows = np.arange(self.from_index.shape[0])
+        else:
+            rows = self._rows(pd.unique(np.asarray(from_ids)))
+            rows = rows[rows != -1]
+
+        positions, request_idx = self._live_edge_positions(rows)
+        return (self.from_index.values[rows][request_idx],
+                self.to_dictionary.decode(self.to_codes[positions]),
+                self.weights[positions])
+
+    def _gather(self, values, from_ids):
+        rows = self._rows(from_ids)
+        gathered = np.zeros(rows.shape[0], dtype=values.dtype)
+        gathered[rows != -1] = values[rows[rows != -1]]
+        return gathered
+
+    def get_degrees(self, from_ids):
+        self._merge_pending()
+        return self._gather(self.live_degrees, from_ids)
+
+    def get_weight_sums(self, from_ids):
+        self._merge_pending()
+        return self._gather(self.live_weight_sums, from_ids)
+
+    def get_neighbourhood_size(self, from_ids):
+        from_ids = pd.unique(np.asarray(from_ids))
+        return pd.Series(self.get_degrees(from_ids), index=from_ids).sort_index()
+
+    def unique_tos(self):
+        self._merge_pending()
+        return set(self.to_dictionary.decode(
+            pd.unique(self.to_codes[self.alive])))
+
+    def _select_positions(self, rows, overridden_to_weights=None):
+        """
+        Randomly picks one relation of each of those rows (each having at
+        least one relation), with one single uniform draw
+
+        :return: the selected positions in to_ids
+        """
+
+        if overridden_to_weights is not None:
+            return self._select_overridden_positions(rows,
+                                                     overridden_to_weights)
+
+        if self.frozen:
+            return self._select_alias_positions(rows)
+
+        return _draw_positions(self.state, self._cdf, self.alive, rows,
+                               self.offsets[rows], self.offsets[rows + 1])
+
+    def _select_overridden_positions(self, rows, overridden_to_weights):
+        """
+        Same as _select_positions(), with the weights of overridden_to_weights,
+        which are only resolved for the relations of the requested rows
+        """
+        requested_rows, row_idx = np.unique(rows, return_inverse=True)
+        positions, _ = self._edge_positions(requested_rows)
+        alive = self.alive[positions]
+
+        weights = np.zeros(self.to_codes.shape[0])
+        weights[positions] = _resolve_to_weights(
+            overridden_to_weights,
+            self.to_dictionary.decode(self.to_codes[positions]), alive)
+        _, _, cdf = self._cumulate(weights, requested_rows)
+
+        sizes = self.offsets[requested_rows + 1] - self.offsets[requested_rows]
+        lowers = np.cumsum(sizes) - sizes
+        picked = _draw_positions(self.state, cdf, alive, rows,
+                                 lowers[row_idx], (lowers + sizes)[row_idx])
+
+        return positions[picked]
+
+    def _select_injective_positions(self, rows, overridden_to_weights=None):
+        """
+        Same as _select_positions(), s.t. no "to" is picked more than once,
+        see _injective_positions()
+
+        :return: the selected positions in to_ids, or -1 for the rows whose
+            relations were all picked by other rows
+        """
+        requested_rows, row_idx = np.unique(rows, return_inverse=True)
+        positions, _ = self._edge_positions(requested_rows)
+        alive = self.alive[positions]
+
+        if overridden_to_weights is None:
+            weights = self.weights[positions]
+        else:
+            weights = _resolve_to_weights(
+                overridden_to_weights,
+                self.to_dictionary.decode(self.to_codes[positions]), alive)
+
+        picked = _injective_positions(
+            self.state, weights, alive,
+            self.to_codes[positions],
+            self.offsets[requested_rows + 1] - self.offsets[requested_rows],
+            row_idx)
+
+        return np.where(picked != -1, positions[picked], -1)
+
+    def select_one(self, from_ids=None, named_as="to", remove_selected=False,
+                   discard_empty=True, one_to_one=False,
+                   overridden_to_weights=None):
+        """
+        See Relationship.select_one()
+        """
+        self._merge_pending()
+
+        if from_ids is None:
+            _from_ids = pd.Series(self.from_index.values[self.degrees() > 0])
+        elif isinstance(from_ids, list):
+            _from_ids = pd.Series(from_ids)
+        else:
+            _from_ids = from_ids
+
+        rows = self._rows(_from_ids)
+        found = rows != -1
+
+        positions = np.full(rows.shape[0], -1, dtype=np.int64)
+        if one_to_one:
+            positions[found] = self._select_injective_positions(
+                rows[found], overridden_to_weights)
+
+            # requests that lost all their "to" to one-to-one conflicts are
+            # dropped
+            lost = found & (positions == -1)
+            rows, found, positions = rows[~lost], found[~lost], positions[~lost]
+            _from_ids = _from_ids[~lost]
+        else:
+            positions[found] = self._select_positions(rows[found],
+                                                      overridden_to_weights)
+
+        if discard_empty:
+            kept = found
+            chosen_tos = self.to_dictionary.decode(
+                self.to_codes[positions[kept]])
+        else:
+            kept = np.ones(rows.shape[0], dtype=bool)
+            chosen_tos = np.full(rows.shape[0], None, dtype=object)
+            chosen_tos[found] = self.to_dictionary.decode(
+                self.to_codes[positions[found]])
+
+        if not np.any(kept):
+            return pd.DataFrame(columns=["from", named_as])
+
+        output = pd.DataFrame({named_as: chosen_tos,
+                               "idx": positions[kept],
+                               "from": np.asarray(_from_ids)[kept]},
+                              index=_from_ids.index[kept])
+
+        if remove_selected:
+            self._remove_positions(
+                output["idx"][output["idx"] != -1].values)
+
+        output.drop(["idx"], axis=1, inplace=True)
+        return output
+
+    def select_many(self, from_ids, named_as, quantities, remove_selected=False,
+                    discard_empty=True):
+        """
+        See Relationship.select_many()
+
+        All requests are served together: the requests of each row are
+        shuffled, capped s.t. they do not ask for more than the degree of
+        the row, then served from one random permutation of the relations of
+        that row, obtained by sorting them on random keys.
+        """
+        self._merge_pending()
+
+        if not isinstance(from_ids, pd.Series):
+            from_ids = pd.Series(from_ids)
+
+        rows = self._rows(from_ids)
+        quantities = np.asarray(quantities).astype(np.int64)
+        requested = np.where((rows != -1) & (quantities > 0))[0]
+
+        # groups the requests by row, in random order within each row s.t.
+        # in case of capping, not always the same requests get capped
+        requested = requested[np.lexsort(
+            (self.state.permutation(requested.shape[0]), rows[requested]))]
+        req_rows = rows[requested]
+        req_qties = quantities[requested]
+
+        if requested.shape[0] > 0:
+            row_starts = np.where(
+                np.append(True, req_rows[1:] != req_rows[:-1]))[0]
+            row_ids = np.repeat(np.arange(row_starts.shape[0]),
+                                np.diff(np.append(row_starts, requested.shape[0])))
+
+            # quantity requested by the previous requests of the same row
+            before = np.cumsum(req_qties) - req_qties
+            before -= before[row_starts][row_ids]
+            served = np.clip(self.degrees()[req_rows] - before, 0, req_qties)
+
+            # sampling without replacement within each row
+            positions, edge_row_ids = self._live_edge_positions(
+                req_rows[row_starts])
+            positions = positions[np.lexsort(
+                (self.state.uniform(size=positions.shape[0]), edge_row_ids))]
+            row_degrees = self.degrees()[req_rows[row_starts]]
+            rank_in_row = np.arange(positions.shape[0]) - np.repeat(
+                np.cumsum(row_degrees) - row_degrees, row_degrees)
+            row_totals = np.add.reduceat(served, row_starts)
+            selected = positions[rank_in_row < row_totals[edge_row_ids]]
+        else:
+            served = req_qties
+            selected = np.array([], dtype=np.int64)
+
+        picks = RaggedArray.from_sizes(
+            self.to_dictionary.decode(self.to_codes[selected]), served).split()
+        output = pd.DataFrame(
+            {named_as: pd.Series(
+                [pick for pick, size in zip(picks, served) if size > 0],
+                index=from_ids.index[requested[served > 0]], dtype=object)})
+
+        if remove_selected:
+            self._remove_positions(selected)
+
+        if not discard_empty and output.shape[0] != from_ids.shape[0]:
+            missing_index = from_ids.index.difference(output.index)
+            missing_values = pd.DataFrame(
+                {named_as: pd.Series([[]] * missing_index.shape[0],
+                                     index=missing_index, dtype=object)})
+            output = pd.concat([output, missing_values], copy=False)
+
+        return output
+
+    def _binary_arrays(self):
+        """
+        :return: the arrays stored by save_binary(): the storage as is,
+            including the removed relations that are not compacted yet and
+            the cumulative weights, s.t. loading it involves no computation
+        """
+        self._merge_pending()
+        return {"from_ids": self.from_index.values,
+                "offsets": self.offsets,
+                "to_ids": self.to_dictionary.ids,
+                "to_codes": self.to_codes,
+                "weights": self.weights,
+                "alive": self.alive,
+                "live_degrees": self.live_degrees,
+                "live_weight_sums": self.live_weight_sums,
+                "cum_weights": self.cum_weights,
+                "cdf": self._cdf}
+
+    def checkpoint_state(self):
+        """
+        :return: a copy of the storage, including the removed relations that
+            are not compacted yet, s.t. the selections that follow a restore
+            are exactly the same
+        """
+        self._merge_pending()
+        return {name: copy.copy(getattr(self, name))
+                for name in ["from_index", "offsets", "to_codes", "weights",
+                             "alive", "live_degrees", "live_weight_sums",
+                             "removed_count", "cum_weights", "_cdf"]}
+
+    def restore_state(self, state):
+        self._pending = []
+        self._pending_size = 0
+        self._drop_alias_tables()
+        self._drop_reverse_index()
+        for name, value in state.items():
+            setattr(self, name, copy.copy(value))
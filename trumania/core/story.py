@@ -1,3 +1,4 @@
+import heapq
 import pandas as pd
 import logging
 import numpy as np
@@ -7,12 +8,101 @@ from trumania.core.random_generators import ConstantGenerator, ConstantDependent
 from trumania.core.util_functions import merge_2_dicts
 
 
+class TimerCalendar(object):
+    """
+    Calendar queue of the scheduled executions of a story: the position of
+    each member is stored in the bucket of the step at which it is due, s.t.
+    retrieving the members due at some step does not require to look at the
+    timers of the whole population.
+
+    Buckets are never updated when a member is re-scheduled: stale entries
+    are discarded when a bucket is read, by comparing them to the current due
+    step of each member.
+    """
+
+    def __init__(self, size):
+        # absolute due step of each member, or -1 if not scheduled
+        self.due = np.full(size, -1, dtype=np.int32)
+        self.buckets = {}
+
+        # heap of the steps for which a bucket exists
+        self.steps = []
+
+    def schedule(self, positions, due_steps):
+        """
+        :param positions: positions of the re-scheduled members
+        :param due_steps: new absolute due step of each of those members,
+            or -1 to un-schedule them
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        due_steps = np.minimum(np.asarray(due_steps, dtype=np.int64),
+                               np.iinfo(np.int32).max)
+        self.due[positions] = due_steps
+
+        scheduled = due_steps >= 0
+        positions, due_steps = positions[scheduled], due_steps[scheduled]
+        if positions.shape[0] == 0:
+            return
+
+        order = np.argsort(due_steps, kind="mergesort")
+        steps, starts = np.unique(due_steps[order], return_index=True)
+        for step, members in zip(steps, np.split(positions[order], starts[1:])):
+            step = int(step)
+            if step not in self.buckets:
+                self.buckets[step] = []
+                heapq.heappush(self.steps, step)
+            self.buckets[step].append(members)
+
+    def _due_at(self, step):
+        """
+        :return: the sorted positions of the members currently due at that
+            step, cleaning up the corresponding bucket on the way
+        """
+        candidates = np.unique(np.concatenate(self.buckets[step]))
+        due = candidates[self.due[candidates] == step]
+        self.buckets[step] = [due]
+        return due
+
+    def pop(self, step):
+        """
+        Removes and returns the sorted positions of the members due at that
+        step.
+        """
+        if step not in self.buckets:
+            return np.array([], dtype=np.int64)
+
+        due = self._due_at(step)
+        del self.buckets[step]
+        return due
+
+    def next_step(self, from_step):
+        """
+        :return: the smallest step >= from_step at which at least one member
+            is due, or None if nobody is scheduled
+        """
+        while len(self.steps) > 0:
+            step = self.steps[0]
+
+            if step >= from_step and step in self.buckets:
+                if self._due_at(step).shape[0] > 0:
+                    return step
+                del self.buckets[step]
+
+            # this bucket is either in the past or only contained stale
+            # entries
+            heapq.heappop(self.steps)
+            if step < from_step:
+                self.buckets.pop(step, None)
+
+        return None
+
+
 class Story(object):
     def __init__(self, name,
                  initiating_population, member_id_field,
                  activity_gen=ConstantGenerator(value=1.), states=None,
                  timer_gen=ConstantDependentGenerator(value=-1),
-                 auto_reset_timer=True):
+                 auto_reset_timer=True, scheduler="countdown"):
         """
         :param name: name of this story
 
@@ -39,6 +129,17 @@ class Story(object):
         :param auto_reset_timer: if True, we automatically re-schedule a new
             execution for the same member id after at the end of the previous
             ont, by resetting the timer.
+
+        :param scheduler: how the timers are maintained:
+
+            - "countdown": each member keeps a count of the remaining clock
+              steps until its next execution, which is decremented at each
+              step
+
+            - "calendar": each member keeps the absolute step of its next
+              execution, and the story keeps a calendar queue of those steps
+              => only the members actually due are touched at each step. This
+              is much faster for large populations with low activity.
         """
 
         self.name = name
@@ -49,25 +150,52 @@ class Story(object):
         self.auto_reset_timer = auto_reset_timer
         self.forced_to_act_next = pd.Series()
 
-        # activity and transition probability parameters, for each state
-        self.params = pd.DataFrame({("default", "activity"): 0},
-                                   index=initiating_population.ids)
+        if scheduler not in ["countdown", "calendar"]:
+            raise ValueError("unrecognized scheduler: {}".format(scheduler))
+        self.scheduler = scheduler
+
+        # All the member state below is kept in arrays aligned with the
+        # position of each member in member_ids, s.t. any lookup is just
+        # some numpy fancy indexing.
+        self.member_ids = pd.Index(initiating_population.ids)
 
         default_state = {"default": {
             "activity": activity_gen,
             "back_to_default_probability": ConstantGenerator(value=1.),
         }}
-        for state, state_gens in merge_2_dicts(default_state, states).items():
-            activity_vals = state_gens["activity"].generate(size=self.size)
-            probs_vals = state_gens["back_to_default_probability"].generate(
-                size=self.size)
-
-            self.params[("activity", state)] = activity_vals
-            self.params[("back_to_default_probability", state)] = probs_vals
+        all_states = merge_2_dicts(default_state, states)
+
+        # states are interned as small int codes: the code of a state is its
+        # position in state_names, "default" being always 0
+        self.state_names = pd.Index(
+            ["default"] + [state for state in all_states if state != "default"])
+        if len(self.state_names) > np.iinfo(np.int8).max:
+            raise ValueError("too many states in story {}".format(name))
+
+        # activity and transition probability parameters, for each member
+        # position and state code
+        self.param_values = {
+            param_name: np.zeros((self.size, len(self.state_names)))
+            for param_name in ["activity", "back_to_default_probability"]
+        }
+        for state, state_gens in all_states.items():
+            code = self.state_names.get_loc(state)
+            for param_name, values in self.param_values.items():
+                values[:, code] = state_gens[param_name].generate(size=self.size)
+
+        # current state and timer value of each member
+        self.state_codes = np.zeros(self.size, dtype=np.int8)
+
+        if self.scheduler == "calendar":
+            self.calendar = TimerCalendar(self.size)
+
+            # number of executions of this story so far, i.e. the step of the
+            # next (or current) execution
+            self.step = 0
+            self.executing = False
+        else:
+            self.remaining = np.full(self.size, -1, dtype=np.int32)
 
-        # current state and timer value for each population member id
-        self.timer = pd.DataFrame({"state": "default", "remaining": -1},
-                                  index=self.params.index)
         if self.auto_reset_timer:
             self.reset_timers()
 
@@ -77,6 +205,32 @@ class Story(object):
         # selection
         self.operation_chain = Chain()
 
+    @property
+    def timer(self):
+        """
+        Current state and timer of each member, as a dataframe.
+
+        This is a copy: modifying it has no effect on the story.
+        """
+        return pd.DataFrame({"state": self.state_names[self.state_codes],
+                             "remaining": self.remaining_timers().values},
+                            index=self.member_ids,
+                            columns=["state", "remaining"])
+
+    @property
+    def params(self):
+        """
+        Activity and transition probability parameters of each member for
+        each state, as a dataframe with (param_name, state) columns.
+
+        This is a copy: modifying it has no effect on the story.
+        """
+        return pd.concat(
+            {param_name: pd.DataFrame(values, index=self.member_ids,
+                                      columns=self.state_names)
+             for param_name, values in self.param_values.items()},
+            axis=1)
+
     def set_operations(self, *ops):
         """
         :param ops: sequence of operations to be executed at each step
@@ -95,24 +249,29 @@ class Story(object):
         :return: the activity level of each requested member id, depending its
         current state
         """
-        if len(self.get_possible_states()) == 1:
-            return self.params.loc[ids][(param_name, "default")]
-        else:
-            # pairs of (member id, state), to select the desired activity level
-            param_idx = zip(ids, self.timer.ix[ids, "state"].tolist())
-            param_values = self.params.loc[ids][param_name].stack()[param_idx]
-            param_values.index = param_values.index.droplevel(level=1)
-            return param_values
+        positions = self._positions(ids)
+        values = self.param_values[param_name][positions,
+                                               self.state_codes[positions]]
+        return pd.Series(values, index=ids)
 
     def get_possible_states(self):
-        return self.params["activity"].columns.tolist()
+        return self.state_names.tolist()
 
     def transit_to_state(self, ids, states):
         """
         :param ids: array of population member id to updates
-        :param states: array of states to assign to those member ids
+        :param states: array of states to assign to those member ids, or one
+            single state assigned to all of them
         """
-        self.timer.loc[ids, "state"] = states
+        positions = self._positions(np.atleast_1d(ids))
+
+        states = np.atleast_1d(states)
+        codes = self.state_names.get_indexer(states)
+        if np.any(codes == -1):
+            raise ValueError("unknown states for story {}: {}".format(
+                self.name, set(states[codes == -1])))
+
+        self.state_codes[positions] = np.broadcast_to(codes, positions.shape)
 
     def active_inactive_ids(self):
         """
@@ -120,24 +279,123 @@ class Story(object):
         others
         """
 
-        active_idx = self.timer["remaining"] == 0
-        return self.timer.index[active_idx].tolist(), self.timer.index[~active_idx].tolist()
+        active_idx = self.remaining_timers().values == 0
+        return self.member_ids[active_idx].tolist(), self.member_ids[~active_idx].tolist()
+
+    def remaining_timers(self):
+        """
+        :return: the number of clock steps before the next execution of each
+            member, or -1 if no execution is scheduled
+        """
+        if self.scheduler == "countdown":
+            remaining = self.remaining.astype(np.int64)
+        else:
+            due = self.calendar.due.astype(np.int64)
+            remaining = np.where(due >= 0, due - self.step, -1)
+
+        return pd.Series(remaining, index=self.member_ids)
+
+    def steps_until_next_execution(self):
+        """
+        :return: the number of clock steps before at least one member of this
+            story is due, i.e. 0 if somebody is due at the next execution, or
+            None if no execution is scheduled at all
+        """
+        if self.scheduler == "calendar":
+            next_step = self.calendar.next_step(self.step)
+            return None if next_step is None else next_step - self.step
+
+        scheduled = self.remaining[self.remaining >= 0]
+        return None if scheduled.shape[0] == 0 else int(scheduled.min())
+
+    def skip(self, n_steps):
+        """
+        Moves the timers of this story n_steps forward without executing it.
+        This is equivalent to executing it n_steps times, as long as nobody
+        is due during those steps (cf steps_until_next_execution()).
+        """
+        self.forced_to_act_next = pd.Series()
+
+        if self.scheduler == "calendar":
+            self.step += n_steps
+        else:
+            self.remaining[self.remaining >= 0] -= n_steps
+
+    def checkpoint_state(self):
+        """
+        :return: a copy of the member states and timers of this story, s.t.
+            restore_state() can later bring it back to this exact point
+        """
+        state = {"state_codes": self.state_codes.copy(),
+                 "forced_to_act_next": self.forced_to_act_next.copy()}
+
+        if self.scheduler == "calendar":
+            state["due"] = self.calendar.due.copy()
+            state["buckets"] = {step: list(due)
+                                for step, due in self.calendar.buckets.items()}
+            state["steps"] = list(self.calendar.steps)
+            state["step"] = self.step
+        else:
+            state["remaining"] = self.remaining.copy()
+
+        return state
+
+    def restore_state(self, state):
+        """
+        Brings this story back to a state obtained from checkpoint_state()
+        """
+        self.state_codes = state["state_codes"].copy()
+        self.forced_to_act_next = state["forced_to_act_next"].copy()
+
+        if self.scheduler == "calendar":
+            self.calendar.due = state["due"].copy()
+            self.calendar.buckets = {step: list(due)
+                                     for step, due in state["buckets"].items()}
+            self.calendar.steps = list(state["steps"])
+            self.step = state["step"]
+            self.executing = False
+        else:
+            self.remaining = state["remaining"].copy()
+
+    def _positions(self, ids):
+        """
+        :return: the positions of those member ids in the state arrays
+        """
+        positions = self.member_ids.get_indexer(ids)
+        if np.any(positions == -1):
+            raise KeyError("unknown member ids for story {}: {}".format(
+                self.name, set(np.asarray(ids)[positions == -1])))
+
+        return positions
 
     def timer_tick(self, member_ids):
 
         member_ids = pd.Index(member_ids).difference(self.forced_to_act_next)
-        impacted_timers = self.timer.loc[member_ids]
+        positions = self._positions(member_ids)
 
-        # not updating members that keep a negative counter: those are "marked
-        #  inactive" already
-        positive_idx = impacted_timers[impacted_timers["remaining"] >= 0].index
-        if len(positive_idx) > 0:
-            self.timer.loc[positive_idx, "remaining"] -= 1
+        if self.scheduler == "calendar":
+            ticked = self.calendar.due[positions] - 1
+            ticked[ticked < self.step] = -1
+            self.calendar.schedule(positions, ticked)
+
+        else:
+            # not updating members that keep a negative counter: those are
+            # "marked inactive" already
+            positive = positions[self.remaining[positions] >= 0]
+            self.remaining[positive] -= 1
 
     def force_act_next(self, ids):
         if len(ids) > 0:
             self.forced_to_act_next = pd.Index(ids).union(self.forced_to_act_next)
-            self.timer.loc[ids, "remaining"] = 0
+            positions = self._positions(pd.Index(ids).unique())
+
+            if self.scheduler == "calendar":
+                # members forced during their own execution are not ticked at
+                # the end of it => they act at the next step
+                due = self.step + 1 if self.executing else self.step
+                self.calendar.schedule(positions, np.repeat(due, len(positions)))
+            else:
+                self.remaining[positions] = 0
 
     def reset_timers(self, ids=None):
         """
@@ -151,9 +409,17 @@ class Story(object):
 
         :param ids: the subset of population member ids to impact
         """
+        self._reset_timers(ids, after_execution=False)
+
+    def _reset_timers(self, ids, after_execution):
+        """
+        :param after_execution: True if this is the automatic reset of the
+            members that have just executed, which are not ticked at the end
+            of the current step
+        """
 
         if ids is None:
-            ids = self.timer.index
+            ids = self.member_ids
         else:
             ids = pd.Index(ids)
 
@@ -170,12 +436,26 @@ class Story(object):
         if len(ids) > 0:
 
             activity = self.get_param("activity", ids)
-            new_timer = self.time_generator.generate(observations=activity)
 
             # replacing any generated timer with -1 for fully inactive members
-            new_timer = new_timer.where(cond=activity != 0, other=-1)
+            if isinstance(self.time_generator, ConstantDependentGenerator):
+                # e.g. the default timer generator: no need to generate a
+                # Series of that one value
+                timers = np.where(activity.values != 0,
+                                  self.time_generator.value, -1)
+            else:
+                new_timer = self.time_generator.generate(observations=activity)
+                timers = new_timer.where(cond=activity != 0, other=-1).values
+
+            # timers too large to ever trigger are capped to the int32 range
+            timers = np.minimum(timers, np.iinfo(np.int32).max)
 
-            self.timer.loc[ids, "remaining"] = new_timer
+            if self.scheduler == "calendar":
+                base = self.step + 1 if after_execution else self.step
+                due = np.where(timers >= 0, base + timers, -1)
+                self.calendar.schedule(self._positions(ids), due)
+            else:
+                self.remaining[self._positions(ids)] = timers
 
     @staticmethod
     def init_story_data(member_id_field_name, active_ids):
@@ -194,7 +474,12 @@ class Story(object):
         self.forced_to_act_next = pd.Series()
 
         logging.info(" executing {} ".format(self.name))
-        active_ids, inactive_ids = self.active_inactive_ids()
+
+        if self.scheduler == "calendar":
+            return self._execute_calendar()
+
+        active = self.remaining == 0
+        active_ids = self.member_ids[active]
 
         if len(active_ids) == 0:
             # skips execution altogether if no member has a timer at 0 right now
@@ -207,11 +492,49 @@ class Story(object):
             if self.auto_reset_timer:
                 # re-scheduling those storys one more time
                 self.reset_timers(active_ids)
-            else:
-                # this should set the timer to -1 => will stay there ad vitam
-                self.timer_tick(active_ids)
 
-        self.timer_tick(inactive_ids)
+        # Ticking the timers of everybody, except the members that have
+        # just been re-scheduled above and the ones that have been forced to
+        # act at the next step. Without auto-reset, this sets the timer of
+        # the active members to -1 => they will stay there ad vitam.
+        ticked = self.remaining >= 0
+        if self.auto_reset_timer:
+            ticked &= ~active
+        ticked[self._positions(self.forced_to_act_next)] = False
+        self.remaining[ticked] -= 1
+
+        return all_logs
+
+    def _execute_calendar(self):
+        """
+        Same as execute(), but only looking at the members that are due at
+        this step instead of ticking the timers of everybody.
+        """
+
+        active_positions = self.calendar.pop(self.step)
+        active_ids = self.member_ids[active_positions]
+        all_logs = {}
+
+        if len(active_ids) > 0:
+            self.executing = True
+            try:
+                _, all_logs = self.operation_chain(
+                    Story.init_story_data(self.member_id_field, active_ids))
+            finally:
+                self.executing = False
+
+            if self.auto_reset_timer:
+                self._reset_timers(active_ids, after_execution=True)
+
+        # Anybody still due at this step at this point (i.e. active members
+        # that were not re-scheduled, or members re-scheduled with a zero
+        # timer during the execution) would have been ticked to -1 by the
+        # countdown scheduler
+        leftovers = np.union1d(self.calendar.pop(self.step), active_positions[
+            self.calendar.due[active_positions] == self.step])
+        self.calendar.schedule(leftovers, np.repeat(-1, len(leftovers)))
+
+        self.step += 1
         return all_logs
 
     class _MaybeBackToDefault(SideEffectOnly):
@@ -227,29 +550,24 @@ class Story(object):
 
         def side_effect(self, story_data):
             # only transiting members that have ran during this clock tick
-            active_timer = self.story.timer.loc[story_data.index]
-
-            non_default_ids = active_timer[
-                active_timer["state"] != "default"].index
+            positions = self.story._positions(story_data.index)
+            codes = self.story.state_codes[positions]
 
-            if non_default_ids.shape[0] == 0:
+            non_default = codes != 0
+            if not np.any(non_default):
                 return
 
-            back_prob = self.story.get_param("back_to_default_probability",
-                                             non_default_ids)
+            positions, codes = positions[non_default], codes[non_default]
+            back_prob = self.story.param_values["back_to_default_probability"][
+                positions, codes]
 
             if np.all(back_prob == 0):
-                cond = [False] * non_default_ids.shape[0]
-            elif np.all(back_prob == 1):
-                cond = [True] * non_default_ids.shape[0]
-            else:
+                return
+            elif not np.all(back_prob == 1):
                 baseline = self.judge.generate(back_prob.shape[0])
-                cond = back_prob > baseline
-
-            member_ids = back_prob[cond].index
-            states = ["default"] * member_ids.shape[0]
+                positions = positions[back_prob > baseline]
 
-            self.story.transit_to_state(ids=member_ids, states=states)
+            self.story.state_codes[positions] = 0
 
     class StoryOps(object):
         class ForceActNext(SideEffectOnly):
@@ -7,6 +7,7 @@ import pandas as pd
 import numpy as np
 import os
 import functools
+import numbers
 from networkx.algorithms import bipartite
 import logging
 
@@ -144,6 +145,27 @@ def is_sequence(arg):
     return type(arg) is list or type(arg) is tuple or type(arg) is set
 
 
+def to_value_array(values):
+    """
+    :return: that sequence of python values as a 1-D numpy array: a typed one
+        if they are all numbers (or booleans), otherwise an object array
+        holding each value as is. np.array() would e.g. turn mixed ints and
+        strings into strings, or tuples of same length into a 2-D array.
+    """
+    values = list(values)
+    if all(isinstance(value, (numbers.Number, np.bool_)) for value in values):
+        return np.array(values)
+
+    array = np.empty(len(values), dtype=object)
+    try:
+        array[:] = values
+    except ValueError:
+        # sequences of same length are broadcast as a 2nd dimension
+        for i, value in enumerate(values):
+            array[i] = value
+    return array
+
+
 def build_ids(size, id_start=0, prefix="id_", max_length=10):
     """
     builds a sequencial list of string ids of specified size
@@ -160,23 +182,6 @@ def log_dataframe_sample(msg, df):
         logging.info("{}: \n  {}".format(msg, df.sample(min(df.shape[0], 15))))
 
 
-def cap_to_total(values, target_total):
-    """
-    return a copy of values with the largest values possible s.t.:
-       - all return values are <= the original ones
-       - their sum is == total
-       -
-    """
-
-    excedent = np.sum(values) - target_total
-    if excedent <= 0:
-        return values
-    elif values[-1] >= excedent:
-        return values[:-1] + [values[-1] - excedent]
-    else:
-        return cap_to_total(values[:-1], target_total) + [0]
-
-
 def ensure_folder_exists(folder):
     if not os.path.exists(folder):
         os.makedirs(folder)
@@ -229,14 +234,24 @@ def load_all_logs(folder):
     """
     loads all csv file contained in this folder and retun them as one
     dictionary where the key is the filename without the extension
+
+    Parquet files and day-partitioned Parquet folders, as written by a
+    ParquetSink, are loaded as well.
     """
 
     all_logs = {}
 
     for file_name in os.listdir(folder):
         full_path = os.path.join(folder, file_name)
-        logs = pd.read_csv(full_path, index_col=None)
-        log_id = file_name[:-4]
+        log_id, extension = os.path.splitext(file_name)
+
+        if os.path.isdir(full_path):
+            logs = pd.read_parquet(full_path)
+            log_id = file_name
+        elif extension == ".parquet":
+            logs = pd.read_parquet(full_path)
+        else:
+            logs = pd.read_csv(full_path, index_col=None)
 
         all_logs[log_id] = logs
 